@@ -0,0 +1,74 @@
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+from .suite import BENCHMARKS, compare_results, run_benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+        Times the core BinSync operations on a generated project, and writes the timings as JSON so they can be
+        compared across releases.
+        """,
+        epilog="""
+        Examples:
+        python -m benchmarks --users 4 --functions 1000 --output results.json
+        python -m benchmarks --only state_parse pull --compare results.json
+        """
+    )
+    parser.add_argument("--users", type=int, default=4, help="Number of users in the generated project")
+    parser.add_argument("--functions", type=int, default=1000, help="Number of functions of every user")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of every benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated states")
+    parser.add_argument("--deci-latency", type=float, default=0.0,
+                        help="Seconds every call to the in-memory decompiler takes, to simulate a real one")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS.keys()), help="Only run these benchmarks")
+    parser.add_argument("--work-dir", type=Path, help="Directory to generate the project in")
+    parser.add_argument("--output", type=Path, help="File to write the JSON results to, instead of stdout")
+    parser.add_argument("--compare", type=Path, help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("binsync").setLevel(logging.ERROR)
+    logging.getLogger("benchmarks").setLevel(logging.INFO)
+
+    results = run_benchmarks(
+        n_users=args.users,
+        n_functions=args.functions,
+        repeat=args.repeat,
+        names=args.only,
+        seed=args.seed,
+        work_dir=args.work_dir,
+        deci_latency=args.deci_latency,
+    )
+
+    failed = [name for name, result in results["results"].items() if "error" in result]
+    for name, result in results["results"].items():
+        if "error" in result:
+            print(f"{name:20} failed: {result['error']}", file=sys.stderr)
+            continue
+
+        print(f"{name:20} median {result['median'] * 1000:10.2f} ms   min {result['min'] * 1000:10.2f} ms",
+              file=sys.stderr)
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        for name, ratio in compare_results(results, baseline).items():
+            print(f"{name:20} {ratio:6.2f}x baseline", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    # the results of the other benchmarks are still written, but a failed one fails the run
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
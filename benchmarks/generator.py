@@ -0,0 +1,80 @@
+import os
+import random
+
+import git
+from libbs.artifacts import (
+    Comment, Enum, FunctionArgument, FunctionHeader, GlobalVariable, StackVariable, Struct, StructMember
+)
+
+from binsync.core.client import Client
+from binsync.core.state import State
+
+BASE_ADDR = 0x400000
+FUNC_SPACING = 0x100
+TYPES = ["int", "char *", "unsigned int", "long", "void *", "size_t", "uint8_t"]
+
+
+def fill_state(state: State, n_functions: int, seed: int = 0, name_prefix: str = "func") -> State:
+    """
+    Fills a state with artifacts that look like a binary being reversed: every function has a header with
+    arguments, stack variables, and a comment, and there is one struct per 10 functions, one enum per 20
+    functions, and one global variable per 5 functions. Users seeded differently name the same addresses
+    differently, like users reversing the same binary would.
+
+    @param state:           The state to fill
+    @param n_functions:     Number of functions to make
+    @param seed:            Seed of the random names and types, so states can be regenerated
+    @param name_prefix:     Prefix of every artifact name
+    @return:                The filled state
+    """
+    rand = random.Random(seed)
+    for i in range(n_functions):
+        addr = BASE_ADDR + i * FUNC_SPACING
+        args = {
+            j: FunctionArgument(j, f"a{j}_{rand.randrange(1000)}", rand.choice(TYPES), 8) for j in range(3)
+        }
+        state.set_function_header(FunctionHeader(f"{name_prefix}_{i}_{rand.randrange(1000)}", addr, "int", args))
+        for j in range(4):
+            state.set_stack_variable(
+                StackVariable(-0x8 * (j + 1), f"v{j}_{rand.randrange(1000)}", rand.choice(TYPES), 8, addr)
+            )
+        state.set_comment(Comment(addr + 0x10, f"{name_prefix} note {rand.randrange(10 ** 6)}", func_addr=addr))
+
+    for i in range(max(1, n_functions // 10)):
+        members = {j * 8: StructMember(f"field_{j}", j * 8, rand.choice(TYPES), 8) for j in range(8)}
+        state.set_struct(Struct(f"{name_prefix}_struct_{i}", 64, members))
+
+    for i in range(max(1, n_functions // 20)):
+        state.set_enum(Enum(f"{name_prefix}_enum_{i}", {f"VALUE_{i}_{j}": j for j in range(8)}))
+
+    for i in range(max(1, n_functions // 5)):
+        state.set_global_var(GlobalVariable(BASE_ADDR + 0x100000 + i * 8, f"g_{name_prefix}_{i}", "int", 8))
+
+    return state
+
+
+def generate_project(root: str, n_users: int, n_functions: int, seed: int = 0) -> str:
+    """
+    Generates a BinSync project with a bare remote, where every user pushed a state of n_functions functions.
+
+    @param root:            Directory to make the project in, which gets a remote.git and a folder per user
+    @param n_users:         Number of users
+    @param n_functions:     Number of functions of every user
+    @param seed:            Seed of the states
+    @return:                Path to the bare remote
+    """
+    remote = os.path.join(root, "remote.git")
+    git.Repo.init(remote, bare=True)
+    for i in range(n_users):
+        user = f"user{i}"
+        client = Client(
+            user, os.path.join(root, user), "fake_hash", init_repo=i == 0, remote_url=remote, disk_cache_size=0
+        )
+        try:
+            client.master_state = fill_state(client.master_state, n_functions, seed=seed + i, name_prefix=user)
+            client.commit_master_state(commit_msg="Generated state")
+            client._push()
+        finally:
+            client.shutdown()
+
+    return remote
@@ -0,0 +1,442 @@
+import argparse
+import bisect
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import queue
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where CPU and RSS are not reported
+    resource = None
+
+from libbs.artifacts import FunctionHeader
+
+from binsync.core.client import Client
+
+from .generator import BASE_ADDR, FUNC_SPACING, generate_project
+from .suite import environment_info
+
+l = logging.getLogger(__name__)
+
+# function every client renames on each edit, so other clients can tell which edits they have seen
+MARKER_ADDR = BASE_ADDR - FUNC_SPACING
+MARKER_PREFIX = "edit_seq_"
+
+
+def _marker_seq(header: Optional[FunctionHeader]) -> int:
+    if header is None or not header.name or not header.name.startswith(MARKER_PREFIX):
+        return 0
+
+    return int(header.name[len(MARKER_PREFIX):])
+
+
+class _LoadClient:
+    """
+    A client replaying random edits at a fixed rate, and syncing every sync interval like the BSController
+    updater does, while recording when it sees the edits of every other client.
+    """
+
+    def __init__(self, index: int, users: List[str], root: str, remote_url: str, params: Dict):
+        self.index = index
+        self.user = users[index]
+        self.others = [user for user in users if user != self.user]
+        self.params = params
+        self.rand = random.Random(params["seed"] * 1000 + index)
+        self.client = Client(
+            self.user, os.path.join(root, "clients", self.user), "fake_hash", remote_url=remote_url,
+            disk_cache_size=0
+        )
+
+        self.seq = 0
+        self.edits = []  # (seq, wall time) of every edit
+        self.seen = {user: 0 for user in self.others}
+        self.observations = {user: [] for user in self.others}  # user -> [(seq, wall time first seen)]
+        self.sync_seconds = []
+        self.pull_seconds = []
+        self.push_seconds = []
+        self.push_attempts = 0
+        self.push_rejections = 0
+        self.push_retries = 0
+        self._last_push_rejected = False
+
+    def edit(self):
+        self.seq += 1
+        state = self.client.master_state
+        addr = BASE_ADDR + self.rand.randrange(self.params["functions"]) * FUNC_SPACING
+        state.set_function_header(FunctionHeader(f"{self.user}_e{self.seq}", addr))
+        state.set_function_header(FunctionHeader(f"{MARKER_PREFIX}{self.seq}", MARKER_ADDR))
+        self.client.master_state = state
+        self.edits.append((self.seq, time.time()))
+
+    def sync(self):
+        # pushes are skipped while the remote has every commit, so only attempts with commits to send count
+        will_push = not self.client.cache.queued_master_state_changes.empty() or self.client._has_unpushed_commits()
+        start = time.perf_counter()
+        self.client.commit_and_update_states()
+        self.sync_seconds.append(time.perf_counter() - start)
+        timings = self.client.last_update_timings
+        if "pull" in timings:
+            self.pull_seconds.append(timings["pull"])
+
+        if will_push:
+            self.push_attempts += 1
+            self.push_seconds.append(timings.get("push", 0.0))
+            if self._last_push_rejected:
+                self.push_retries += 1
+            self._last_push_rejected = self.client._has_unpushed_commits()
+            if self._last_push_rejected:
+                self.push_rejections += 1
+
+        self.observe()
+
+    def observe(self):
+        now = time.time()
+        for user in self.others:
+            seq = _marker_seq(self.client.get_state(user=user).get_function_header(MARKER_ADDR))
+            if seq > self.seen[user]:
+                self.seen[user] = seq
+                self.observations[user].append((seq, now))
+
+    def run_edits(self, duration: float):
+        rate = self.params["rate"]
+        sync_interval = self.params["sync_interval"]
+        start = time.time()
+        end = start + duration
+        next_edit = start + self.rand.expovariate(rate) if rate > 0 else end
+        next_sync = start + sync_interval
+        while True:
+            now = time.time()
+            if now >= end:
+                break
+
+            wake = min(next_edit, next_sync, end)
+            if wake > now:
+                time.sleep(wake - now)
+                continue
+
+            if next_edit <= now:
+                self.edit()
+                next_edit += self.rand.expovariate(rate)
+            if next_sync <= now:
+                self.sync()
+                next_sync = max(next_sync + sync_interval, time.time())
+
+    def push_final(self, timeout: float):
+        deadline = time.time() + timeout
+        self.sync()
+        while self._last_push_rejected and time.time() < deadline:
+            time.sleep(self.params["sync_interval"])
+            self.sync()
+
+    def settle(self, final_seqs: Dict[str, int], timeout: float):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(self.seen[user] >= final_seqs.get(user, 0) for user in self.others):
+                return
+            time.sleep(self.params["sync_interval"])
+            self.sync()
+
+    def report(self) -> Dict:
+        report = {
+            "user": self.user,
+            "edits": self.edits,
+            "observations": self.observations,
+            "syncs": len(self.sync_seconds),
+            "sync_seconds": self.sync_seconds,
+            "pull_seconds": self.pull_seconds,
+            "push_seconds": self.push_seconds,
+            "push_attempts": self.push_attempts,
+            "push_rejections": self.push_rejections,
+            "push_retries": self.push_retries,
+            "clone_bytes": _dir_size(self.client.repo_root),
+        }
+        report.update(_resource_usage())
+        return report
+
+
+def _run_load_client(index, users, root, remote_url, params, barrier, final_seqs, results):
+    """
+    Runs one load client in its own process, so its CPU and memory can be told apart from the others.
+    """
+    logging.getLogger("binsync").setLevel(logging.ERROR)
+    load_client = None
+    try:
+        load_client = _LoadClient(index, users, root, remote_url, params)
+        load_client.run_edits(params["duration"])
+        load_client.push_final(params["settle_timeout"])
+        final_seqs[index] = load_client.seq
+        try:
+            barrier.wait(timeout=params["settle_timeout"] + params["duration"])
+        except threading.BrokenBarrierError:
+            l.warning(f"{users[index]} gave up waiting on the other clients")
+
+        load_client.settle({user: final_seqs[i] for i, user in enumerate(users)}, params["settle_timeout"])
+        results.put(load_client.report())
+    except Exception as e:
+        # the other clients must not wait on a client that died
+        barrier.abort()
+        results.put({"user": users[index], "error": repr(e)})
+    finally:
+        if load_client is not None:
+            load_client.client.shutdown()
+
+
+def run_load_test(
+    n_clients: int = 8,
+    duration: float = 30.0,
+    rate: float = 0.5,
+    sync_interval: float = 2.0,
+    n_functions: int = 200,
+    settle_timeout: float = 60.0,
+    seed: int = 0,
+    work_dir: Optional[str] = None,
+) -> Dict:
+    """
+    Starts n_clients clients, each in its own process with its own clone of a file:// bare remote, which all
+    edit and sync at once. Every client renames a marker function on each edit, so the other clients can tell
+    when they see it.
+
+    @param n_clients:       Number of clients, which are also the users of the generated project
+    @param duration:        Seconds every client edits for
+    @param rate:            Average edits per second of every client
+    @param sync_interval:   Seconds between the commit, pull, and push rounds of every client
+    @param n_functions:     Number of functions in the state of every user
+    @param settle_timeout:  Seconds clients keep syncing after editing, to see the last edits of the others
+    @param seed:            Seed of the generated states and edits
+    @param work_dir:        Directory to make the project in, which is removed after, or None for a temp dir
+    @return:                The results, ready to be written as JSON
+    """
+    if n_clients < 2:
+        raise ValueError("A load test needs at least 2 clients")
+
+    params = {
+        "clients": n_clients, "duration": duration, "rate": rate, "sync_interval": sync_interval,
+        "functions": n_functions, "settle_timeout": settle_timeout, "seed": seed,
+    }
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+    root = tempfile.mkdtemp(prefix="binsync_load_", dir=work_dir)
+    try:
+        start = time.perf_counter()
+        remote = generate_project(root, n_clients, n_functions, seed=seed)
+        generate_time = time.perf_counter() - start
+        remote_bytes = _dir_size(remote)
+        users = [f"user{i}" for i in range(n_clients)]
+
+        ctx = multiprocessing.get_context("spawn")
+        barrier = ctx.Barrier(n_clients)
+        final_seqs = ctx.Array("i", n_clients)
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(
+                target=_run_load_client,
+                args=(i, users, root, pathlib.Path(remote).as_uri(), params, barrier, final_seqs, results),
+                name=f"binsync-load-{user}",
+            )
+            for i, user in enumerate(users)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+
+        # results are read before joining, since a process does not exit until its queued result is read
+        reports = []
+        deadline = time.time() + duration + 3 * settle_timeout + 60
+        while len(reports) < n_clients and time.time() < deadline:
+            try:
+                reports.append(results.get(timeout=1))
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes) and results.empty():
+                    break
+        run_time = time.perf_counter() - start
+
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+        return dict(
+            environment_info(),
+            parameters=params,
+            generate_seconds=generate_time,
+            run_seconds=run_time,
+            summary=_summarize(reports, users, remote_bytes, _dir_size(remote)),
+            clients=[_client_summary(report) for report in sorted(reports, key=lambda r: users.index(r["user"]))],
+        )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _summarize(reports: List[Dict], users: List[str], remote_bytes_before: int, remote_bytes_after: int) -> Dict:
+    ok_reports = [report for report in reports if "error" not in report]
+    convergence, propagation = [], []
+    unconverged = 0
+    for editor in ok_reports:
+        observers = [report for report in ok_reports if report is not editor]
+        for seq, edit_time in editor["edits"]:
+            seen_times = []
+            for observer in observers:
+                seen_time = _first_seen(observer["observations"].get(editor["user"], []), seq)
+                if seen_time is not None:
+                    seen_times.append(seen_time)
+                    propagation.append(seen_time - edit_time)
+
+            if len(seen_times) < len(observers):
+                unconverged += 1
+            elif seen_times:
+                convergence.append(max(seen_times) - edit_time)
+
+    return {
+        "clients": len(users),
+        "failed_clients": [report["user"] for report in reports if "error" in report],
+        "missing_clients": sorted(set(users) - {report["user"] for report in reports}),
+        "edits": sum(len(report["edits"]) for report in ok_reports),
+        "unconverged_edits": unconverged,
+        # seconds from an edit until every other client saw it, and until each other client saw it
+        "convergence_seconds": _stats(convergence),
+        "propagation_seconds": _stats(propagation),
+        "sync_seconds": _stats([s for report in ok_reports for s in report["sync_seconds"]]),
+        "pull_seconds": _stats([s for report in ok_reports for s in report["pull_seconds"]]),
+        "push_seconds": _stats([s for report in ok_reports for s in report["push_seconds"]]),
+        "push_attempts": sum(report["push_attempts"] for report in ok_reports),
+        "push_rejections": sum(report["push_rejections"] for report in ok_reports),
+        "push_retries": sum(report["push_retries"] for report in ok_reports),
+        "remote_bytes_before": remote_bytes_before,
+        "remote_bytes_after": remote_bytes_after,
+        "remote_growth_bytes": remote_bytes_after - remote_bytes_before,
+    }
+
+
+def _client_summary(report: Dict) -> Dict:
+    if "error" in report:
+        return report
+
+    summary = OrderedDict((key, value) for key, value in report.items() if key not in ("edits", "observations"))
+    summary["edits"] = len(report["edits"])
+    for key in ("sync_seconds", "pull_seconds", "push_seconds"):
+        summary[key] = _stats(report[key])
+    return summary
+
+
+def _first_seen(observations: List, seq: int) -> Optional[float]:
+    # observations are in increasing seq order, and seeing a seq means every earlier edit was seen too
+    index = bisect.bisect_left([seen_seq for seen_seq, _ in observations], seq)
+    return observations[index][1] if index < len(observations) else None
+
+
+def _stats(values: List[float]) -> Dict:
+    if not values:
+        return {"count": 0}
+
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "min": values[0],
+        "median": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+def _resource_usage() -> Dict:
+    if resource is None:
+        return {"cpu_seconds": None, "git_cpu_seconds": None, "peak_rss_mb": None, "git_peak_rss_mb": None}
+
+    # max RSS is in bytes on macOS and in KiB everywhere else
+    rss_unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    # Git runs in subprocesses, which are most of the work of a sync
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_seconds": own.ru_utime + own.ru_stime,
+        "git_cpu_seconds": children.ru_utime + children.ru_stime,
+        "peak_rss_mb": own.ru_maxrss / rss_unit,
+        "git_peak_rss_mb": children.ru_maxrss / rss_unit,
+    }
+
+
+def _dir_size(path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""
+        Runs many BinSync clients at once against a local bare remote, each replaying random edits, and reports
+        how long edits take to reach every client, push rejections, CPU and memory per client, and repo growth.
+        """,
+        epilog="""
+        Examples:
+        python -m benchmarks.loadtest --clients 8 --duration 30 --output load.json
+        python -m benchmarks.loadtest --clients 40 --rate 0.2 --sync-interval 5 --duration 300
+        """
+    )
+    parser.add_argument("--clients", type=int, default=8, help="Number of clients editing at once")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds every client edits for")
+    parser.add_argument("--rate", type=float, default=0.5, help="Average edits per second of every client")
+    parser.add_argument("--sync-interval", type=float, default=2.0, help="Seconds between syncs of every client")
+    parser.add_argument("--functions", type=int, default=200, help="Number of functions of every user")
+    parser.add_argument("--settle-timeout", type=float, default=60.0,
+                        help="Seconds clients keep syncing after editing, to see the last edits of the others")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated states and edits")
+    parser.add_argument("--work-dir", type=pathlib.Path, help="Directory to make the project in")
+    parser.add_argument("--output", type=pathlib.Path, help="File to write the JSON results to, instead of stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("binsync").setLevel(logging.ERROR)
+
+    results = run_load_test(
+        n_clients=args.clients,
+        duration=args.duration,
+        rate=args.rate,
+        sync_interval=args.sync_interval,
+        n_functions=args.functions,
+        settle_timeout=args.settle_timeout,
+        seed=args.seed,
+        work_dir=args.work_dir,
+    )
+
+    summary = results["summary"]
+    convergence = summary["convergence_seconds"]
+    print(
+        f"{summary['edits']} edits, {summary['unconverged_edits']} unconverged, convergence median "
+        f"{convergence.get('median', float('nan')):.2f}s p95 {convergence.get('p95', float('nan')):.2f}s, "
+        f"{summary['push_rejections']} push rejections, remote grew {summary['remote_growth_bytes'] / 1024:.0f} KiB",
+        file=sys.stderr
+    )
+    for failed in summary["failed_clients"] + summary["missing_clients"]:
+        print(f"{failed} failed", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    if summary["failed_clients"] or summary["missing_clients"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
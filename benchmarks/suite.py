@@ -0,0 +1,330 @@
+import datetime
+import logging
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+import git
+from libbs.artifacts import FunctionHeader
+
+import binsync
+from binsync.controller import BSController
+from binsync.core.client import Client
+from binsync.core.state import State
+from binsync.interface_overrides.memory import MemoryBSInterface
+
+from .generator import BASE_ADDR, FUNC_SPACING, fill_state, generate_project
+
+l = logging.getLogger(__name__)
+
+# name -> function taking a BenchmarkContext and returning the seconds of one timed run
+BENCHMARKS: Dict[str, Callable[["BenchmarkContext"], float]] = OrderedDict()
+
+
+def benchmark(name):
+    def _register(f):
+        BENCHMARKS[name] = f
+        return f
+
+    return _register
+
+
+class BenchmarkContext:
+    """
+    A generated project shared by every benchmark, and the clients the benchmarks keep between runs.
+    """
+
+    def __init__(self, root: str, n_users: int, n_functions: int, seed: int = 0, deci_latency: float = 0.0):
+        self.root = root
+        self.n_users = n_users
+        self.n_functions = n_functions
+        self.seed = seed
+        self.deci_latency = deci_latency
+        self.remote = generate_project(root, n_users, n_functions, seed=seed)
+        self._clients = {}  # type: Dict[str, Client]
+        self._paths = 0
+        self._edits = 0
+
+    @property
+    def target_user(self):
+        # the last generated user, which is never the master user of a benchmark client
+        return f"user{self.n_users - 1}"
+
+    def new_path(self) -> str:
+        self._paths += 1
+        return os.path.join(self.root, f"clone{self._paths}")
+
+    def new_client(self, user: str, **kwargs) -> Client:
+        kwargs.setdefault("disk_cache_size", 0)
+        return Client(user, self.new_path(), "fake_hash", remote_url=self.remote, **kwargs)
+
+    def client(self, user: str) -> Client:
+        """
+        Gets a client kept between runs, made on first use.
+        """
+        if user not in self._clients:
+            self._clients[user] = self.new_client(user)
+
+        return self._clients[user]
+
+    def edit_master_state(self, client: Client, n_functions: Optional[int] = None):
+        """
+        Renames some functions of the master state of a client, like a user working would.
+        """
+        self._edits += 1
+        n_functions = n_functions or max(1, self.n_functions // 10)
+        state = client.master_state
+        for i in range(n_functions):
+            addr = BASE_ADDR + ((self._edits * n_functions + i) % self.n_functions) * FUNC_SPACING
+            state.set_function_header(FunctionHeader(f"edit_{self._edits}_{i}", addr))
+        client.master_state = state
+
+    def close(self):
+        for client in self._clients.values():
+            client.shutdown()
+        self._clients = {}
+
+
+@benchmark("state_parse")
+def bench_state_parse(ctx: BenchmarkContext) -> float:
+    client = ctx.client("reader")
+    tree = client._get_tree(ctx.target_user, client.repo)
+    start = time.perf_counter()
+    State.parse(tree, client=client)
+    return time.perf_counter() - start
+
+
+@benchmark("state_dump")
+def bench_state_dump(ctx: BenchmarkContext) -> float:
+    state = ctx.client("reader").get_state(user=ctx.target_user)
+    start = time.perf_counter()
+    state.dump({}, only_dirty=False)
+    return time.perf_counter() - start
+
+
+@benchmark("commit_full")
+def bench_commit_full(ctx: BenchmarkContext) -> float:
+    client = ctx.new_client("committer")
+    try:
+        state = fill_state(client.master_state, ctx.n_functions, seed=ctx.seed, name_prefix="committer")
+        start = time.perf_counter()
+        client._commit_state(state, msg="Full commit")
+        return time.perf_counter() - start
+    finally:
+        client.shutdown()
+
+
+@benchmark("commit_incremental")
+def bench_commit_incremental(ctx: BenchmarkContext) -> float:
+    client = ctx.client("writer")
+    ctx.edit_master_state(client)
+    state = client.cache.queued_master_state_changes.get()
+    # only the last queued state is committed, like with coalesced commits
+    while not client.cache.queued_master_state_changes.empty():
+        state = client.cache.queued_master_state_changes.get()
+
+    start = time.perf_counter()
+    client._commit_state(state, msg="Incremental commit")
+    return time.perf_counter() - start
+
+
+@benchmark("push")
+def bench_push(ctx: BenchmarkContext) -> float:
+    client = ctx.client("writer")
+    ctx.edit_master_state(client)
+    client.commit_master_state()
+    start = time.perf_counter()
+    client._push()
+    return time.perf_counter() - start
+
+
+@benchmark("pull")
+def bench_pull(ctx: BenchmarkContext) -> float:
+    writer = ctx.client("writer")
+    reader = ctx.client("reader")
+    # the first pull of a client also tracks the branches of its clone, which is not what is timed
+    reader._pull()
+    ctx.edit_master_state(writer)
+    writer.commit_master_state()
+    writer._push()
+
+    start = time.perf_counter()
+    reader._pull()
+    return time.perf_counter() - start
+
+
+@benchmark("pull_idle")
+def bench_pull_idle(ctx: BenchmarkContext) -> float:
+    reader = ctx.client("reader")
+    reader._pull()
+    start = time.perf_counter()
+    reader._pull()
+    return time.perf_counter() - start
+
+
+@benchmark("all_states")
+def bench_all_states(ctx: BenchmarkContext) -> float:
+    client = ctx.new_client("observer")
+    try:
+        start = time.perf_counter()
+        client.all_states()
+        return time.perf_counter() - start
+    finally:
+        client.shutdown()
+
+
+def _new_controller(ctx: BenchmarkContext, user: str) -> BSController:
+    deci = MemoryBSInterface(binary_hash="fake_hash", latency=ctx.deci_latency)
+    controller = BSController(decompiler_interface=deci, headless=True)
+    controller.connect(user, ctx.new_path(), remote_url=ctx.remote, single_thread=True, disk_cache_size=0)
+    return controller
+
+
+def _shutdown_controller(controller: BSController):
+    controller.shutdown()
+    controller.client.shutdown()
+
+
+@benchmark("fill_all")
+def bench_fill_all(ctx: BenchmarkContext) -> float:
+    controller = _new_controller(ctx, "filler")
+    try:
+        # the state is parsed ahead of time, so only the filling is timed
+        controller.get_state(user=ctx.target_user)
+        start = time.perf_counter()
+        controller.fill_all(user=ctx.target_user)
+        return time.perf_counter() - start
+    finally:
+        _shutdown_controller(controller)
+
+
+@benchmark("magic_fill")
+def bench_magic_fill(ctx: BenchmarkContext) -> float:
+    controller = _new_controller(ctx, "filler")
+    try:
+        controller.client.all_states()
+        start = time.perf_counter()
+        controller.magic_fill(preference_user=ctx.target_user)
+        return time.perf_counter() - start
+    finally:
+        _shutdown_controller(controller)
+
+
+@benchmark("force_push")
+def bench_force_push(ctx: BenchmarkContext) -> float:
+    controller = _new_controller(ctx, "pusher")
+    try:
+        # the decompiler starts out with the functions of another user, which are then pushed from it
+        state = controller.get_state(user=ctx.target_user)
+        for addr, func in state.functions.items():
+            controller.deci.functions[addr] = func
+        start = time.perf_counter()
+        controller.force_push_functions(list(state.functions.keys()))
+        return time.perf_counter() - start
+    finally:
+        _shutdown_controller(controller)
+
+
+def run_benchmarks(
+    n_users: int = 4,
+    n_functions: int = 1000,
+    repeat: int = 3,
+    names: Optional[Iterable[str]] = None,
+    seed: int = 0,
+    work_dir: Optional[str] = None,
+    deci_latency: float = 0.0,
+) -> Dict:
+    """
+    Generates a project and times every benchmark on it.
+
+    @param n_users:     Number of users in the generated project
+    @param n_functions: Number of functions of every user
+    @param repeat:      Number of timed runs of every benchmark
+    @param names:       Names of the benchmarks to run, or None for all of them
+    @param seed:        Seed of the generated states
+    @param work_dir:    Directory to generate the project in, which is removed after, or None for a temp dir
+    @param deci_latency: Seconds every call to the in-memory decompiler takes, to simulate a real one
+    @return:            The results, ready to be written as JSON. Benchmarks that raised have an error
+                        instead of timings.
+    """
+    names = list(names) if names else list(BENCHMARKS.keys())
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+    root = tempfile.mkdtemp(prefix="binsync_bench_", dir=work_dir)
+    results = OrderedDict()
+    try:
+        start = time.perf_counter()
+        ctx = BenchmarkContext(root, n_users, n_functions, seed=seed, deci_latency=deci_latency)
+        generate_time = time.perf_counter() - start
+        try:
+            for name in names:
+                l.info(f"Running {name}...")
+                try:
+                    runs = [BENCHMARKS[name](ctx) for _ in range(repeat)]
+                except Exception as e:
+                    # one broken benchmark should not lose the results of the others
+                    l.warning(f"Benchmark {name} failed: {e!r}")
+                    results[name] = {"error": repr(e)}
+                    continue
+
+                results[name] = _summarize(runs)
+        finally:
+            ctx.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return dict(
+        environment_info(),
+        parameters={
+            "users": n_users, "functions": n_functions, "repeat": repeat, "seed": seed, "deci_latency": deci_latency
+        },
+        generate_seconds=generate_time,
+        results=results,
+    )
+
+
+def environment_info() -> Dict:
+    """
+    Gets the versions and machine a run happened on, so results can be compared across releases.
+    """
+    return {
+        "binsync_version": binsync.__version__,
+        "python_version": platform.python_version(),
+        "git_version": ".".join(str(v) for v in git.Git().version_info),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+    }
+
+
+def compare_results(results: Dict, baseline: Dict) -> Dict[str, float]:
+    """
+    Compares the median of every benchmark against a baseline run.
+
+    @return: Dict of benchmark name -> median / baseline median, so above 1 is slower than the baseline
+    """
+    ratios = OrderedDict()
+    for name, result in results["results"].items():
+        base = baseline.get("results", {}).get(name, None)
+        if "median" in result and base and base.get("median", 0) > 0:
+            ratios[name] = result["median"] / base["median"]
+
+    return ratios
+
+
+def _summarize(runs: List[float]) -> Dict:
+    return {
+        "runs": runs,
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs),
+    }
@@ -34,6 +34,7 @@ def main():
         epilog="""
         Examples:
         binsync --install
+        binsync --daemon daemon.toml
         """
     )
     parser.add_argument(
@@ -59,6 +60,12 @@ def main():
         Execute the decompiler server for headless connection (only Ghidra supported).
         """
     )
+    parser.add_argument(
+        "--daemon", type=Path, metavar="CONFIG", help="""
+        Run a headless daemon that keeps many BinSync projects in sync from one process, as listed in the
+        provided TOML config. Each project is committed, pulled, and pushed on its own interval.
+        """
+    )
     if EXTRAS_AVAILABLE:
         parser.add_argument(
             "-ai", help="""
@@ -140,6 +147,14 @@ def main():
         from binsync.interface_overrides.ghidra import start_ghidra_remote_ui
         start_ghidra_remote_ui()
 
+    if args.daemon:
+        if not args.daemon.exists():
+            l.error(f"The daemon config {args.daemon} does not exist.")
+            return
+
+        from binsync.daemon import run_daemon
+        run_daemon(args.daemon)
+
     if EXTRAS_AVAILABLE and args.ai:
         if not (args.proj_path and args.binary_path):
             l.error("Using the AI feature requires you to specify the binary path and project path with cli options.")
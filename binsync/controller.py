@@ -15,13 +15,22 @@ from libbs.artifacts import (
 from libbs.api import DecompilerInterface
 from libbs.api.type_parser import CType
 
-from binsync.core.client import Client, SchedSpeed, Scheduler, Job
+from binsync.core.client import Client, SchedSpeed, Scheduler, Job, StateChangeEvent
+from binsync.core.metrics import registry
+from binsync.core.tracing import traced, tracer
 from binsync.core.state import State
 from binsync.core.user import User
 from binsync.configuration import ProjectConfig
 
 _l = logging.getLogger(name=__name__)
 
+_UPDATER_ITERATION_TIME = registry.histogram(
+    "binsync_updater_iteration_seconds", "Seconds updater iterations that did work took"
+)
+_UPDATER_PHASE_TIME = registry.histogram(
+    "binsync_updater_phase_seconds", "Seconds each phase of an updater iteration took", labels=("phase",)
+)
+
 
 #
 # State Checking Decorators
@@ -50,7 +59,10 @@ def fill_event(f):
 
 
 # https://stackoverflow.com/questions/10926328
-BUSY_LOOP_COOLDOWN = 0.5
+# seconds between checks of the active decompiler context, which has no change callback
+CTX_POLL_INTERVAL = 0.5
+# seconds a queued commit of the master state waits for more changes, before it is committed without a pull
+COMMIT_DELAY = 1.0
 GET_MANY = True
 FILL_MANY = True
 
@@ -139,9 +151,19 @@ class BSController:
         self.client = None  # type: Optional[Client]
 
         # ui callback created on UI init
-        self.ui_callback = None  # func(states: List[State])
+        self.ui_callback = None  # func(states: List[State], changes: Optional[Dict])
         self.ctx_change_callback = None  # func()
         self._last_reload = None
+        # branch changes reported by the client since the last UI update
+        self._state_change_events = []  # type: List[StateChangeEvent]
+        # guards the updater state, and wakes the updater when there is work for it
+        self._updater_cond = threading.Condition()
+        self._commit_queued_time = None  # type: Optional[float]
+        # seconds each phase of the last updater iteration that did any work took
+        self.updater_timings = {}  # type: Dict[str, float]
+        # the last UI update scheduled, which is replaced if it has not run by the next one
+        self._pending_ui_job = None  # type: Optional[Job]
+        self._pending_ui_changes = None
         self.last_ctx = None
         # ui worker that fires off requests for UI update
         self._ui_updater_thread = None
@@ -250,70 +272,217 @@ class BSController:
 
     def wait_for_next_push(self):
         last_push = self.client.last_push_attempt_time
-        start_time = time.time()
-        wait_time = 0
-        while wait_time < self.reload_time:
-            if last_push != self.client.last_push_attempt_time:
-                if not self.push_job_scheduler._job_queue.empty():
+        deadline = time.monotonic() + self.client.next_pull_delay(self.reload_time)
+        with self._updater_cond:
+            while True:
+                if last_push != self.client.last_push_attempt_time:
+                    if self.push_job_scheduler.empty():
+                        break
+
                     # restart wait time when pusher still has jobs
-                    start_time = time.time()
-                else:
+                    last_push = self.client.last_push_attempt_time
+                    deadline = time.monotonic() + self.client.next_pull_delay(self.reload_time)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
                     break
 
-            time.sleep(BUSY_LOOP_COOLDOWN*2)
-            wait_time = time.time() - start_time
+                # the updater notifies after every update
+                self._updater_cond.wait(timeout=remaining)
 
     def updater_routine(self):
+        """
+        Commits, pulls, pushes, and updates the UI. The routine sleeps until there is work to do: the deadline of
+        the next pull (reload_time, backed off by the client while the remote is idle), a queued commit of the
+        master state, branch changes reported by the client, or, with a UI, the next check of the decompiler
+        context.
+        """
         while self._run_updater_threads:
-            time.sleep(BUSY_LOOP_COOLDOWN)
-            now = datetime.datetime.now(tz=datetime.timezone.utc)
-
+            self._wait_for_updater_work()
             # validate a client is connected to this controller (which may be local only)
-            if not self.check_client():
+            if not self._run_updater_threads or not self.check_client():
                 continue
 
+            timings = {}
+            start_time = time.perf_counter()
             # do git pull/push operations if a remote exist for the client
             if self.client.last_pull_attempt_time is None:
+                self._take_queued_commit()
                 self.client.commit_and_update_states(commit_msg="User created")
-
-            # update every reload_time
-            elif int(now.timestamp() - self.client.last_pull_attempt_time.timestamp()) >= self.reload_time:
+                timings.update(self.client.last_update_timings)
+            # update every pull interval
+            elif self._seconds_until_pull() <= 0:
+                self._take_queued_commit()
                 self.client.commit_and_update_states()
-                
-            if not self.headless:
-                all_states = self.client.all_states()
-                if not all_states:
-                    _l.warning("There were no states remote or local.")
-                    continue
+                timings.update(self.client.last_update_timings)
+            # commit changes of the master state without waiting for the next pull
+            elif self._take_queued_commit():
+                self.client.commit_master_state()
+                self.client.dispatch_state_changes()
+                timings["commit"] = time.perf_counter() - start_time
+
+            # events are drained even without a UI, since pending events wake the updater
+            with self._updater_cond:
+                events, self._state_change_events = self._state_change_events, []
 
-                # update context knowledge every loop iteration
+            if not self.headless:
+                # update context knowledge
                 if self.ctx_change_callback:
+                    # a check that has not run yet covers this iteration too
                     self._ui_updater_worker.schedule_job(
-                        Job(self._check_and_notify_ctx, all_states)
+                        Job(self._check_and_notify_ctx), coalesce=True
                     )
 
-                # update the control panel with new info every BINSYNC_RELOAD_TIME seconds
-                if self._last_reload is None or \
-                        int(now.timestamp() - self._last_reload.timestamp()) > self.reload_time:
+                # update the control panel only when a branch moved, on the first iteration, or every
+                # reload_time so that times and colors in the tables stay fresh
+                if events or self._seconds_until_ui_refresh() <= 0:
+                    states_start_time = time.perf_counter()
+                    all_states = self.client.all_states()
+                    timings["states"] = time.perf_counter() - states_start_time
+                    if not all_states:
+                        _l.warning("There were no states remote or local.")
+                        continue
+
+                    changes = self._merge_state_changes(events) if self._last_reload is not None else None
+                    commits = [commit for event in events for commit in (event.commits or ())]
                     self._last_reload = datetime.datetime.now(tz=datetime.timezone.utc)
+                    # an update that has not run yet is stale, but its changes must still reach the tables
+                    if self._pending_ui_job is not None and self._pending_ui_job.cancel():
+                        changes = self._merge_ui_changes(self._pending_ui_changes, changes)
+                        commits = self._pending_ui_job.kwargs.get("commits", []) + commits
+                    self._pending_ui_job = Job(self._update_ui, all_states, changes, commits=commits)
+                    self._pending_ui_changes = changes
+                    self._ui_updater_worker.schedule_job(self._pending_ui_job)
+
+            if timings:
+                timings["total"] = time.perf_counter() - start_time
+                self.updater_timings = timings
+                for phase, seconds in timings.items():
+                    if phase != "total":
+                        _UPDATER_PHASE_TIME.observe(seconds, phase=phase)
+                _UPDATER_ITERATION_TIME.observe(timings["total"])
+                _l.debug("Updater phases: %s", ", ".join(f"{phase}={secs:.3f}s" for phase, secs in timings.items()))
+
+            with self._updater_cond:
+                self._updater_cond.notify_all()
+
+    def _wait_for_updater_work(self):
+        with self._updater_cond:
+            timeout = self._seconds_until_pull()
+            if self._commit_queued_time is not None:
+                timeout = min(timeout, self._commit_queued_time + COMMIT_DELAY - time.monotonic())
+            if not self.headless:
+                timeout = min(timeout, self._seconds_until_ui_refresh())
+                if self.ctx_change_callback:
+                    timeout = min(timeout, CTX_POLL_INTERVAL)
 
-                    self._ui_updater_worker.schedule_job(
-                        Job(self._update_ui, all_states)
-                    )
+            if timeout > 0 and not self._state_change_events and self._run_updater_threads:
+                self._updater_cond.wait(timeout=timeout)
+
+    def _wake_updater(self):
+        with self._updater_cond:
+            self._updater_cond.notify_all()
+
+    def _seconds_until_pull(self) -> float:
+        if not self.check_client():
+            return self.reload_time
+        if self.client.last_pull_attempt_time is None:
+            return 0
+
+        # the client backs off the pull interval while the remote is idle
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        pull_interval = self.client.next_pull_delay(self.reload_time)
+        return pull_interval - (now - self.client.last_pull_attempt_time).total_seconds()
+
+    def _seconds_until_ui_refresh(self) -> float:
+        if self._last_reload is None:
+            return 0
+
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        return self.reload_time - (now - self._last_reload).total_seconds()
+
+    def _on_commit_queued(self):
+        with self._updater_cond:
+            if self._commit_queued_time is None:
+                self._commit_queued_time = time.monotonic()
+                self._updater_cond.notify_all()
+
+    def _take_queued_commit(self) -> bool:
+        """
+        Marks the queued commit as handled, if one is queued and has waited COMMIT_DELAY seconds for more changes.
+        Commits done with a pull always handle it.
+        """
+        with self._updater_cond:
+            if self._commit_queued_time is None:
+                return False
+
+            if self._seconds_until_pull() > 0 and time.monotonic() - self._commit_queued_time < COMMIT_DELAY:
+                return False
+
+            self._commit_queued_time = None
+            return True
+
+    def _on_state_change(self, event: StateChangeEvent):
+        with self._updater_cond:
+            self._state_change_events.append(event)
+            self._updater_cond.notify_all()
+
+    @staticmethod
+    def _merge_state_changes(events: List[StateChangeEvent]) -> Dict[str, Optional[Dict]]:
+        """
+        Merges the changes of many branch moves into the changes of each user.
+
+        @param events:  StateChangeEvents in the order they happened
+        @return:        Dict of user -> (dict of ArtifactType -> set of changed keys, or None when anything may
+                        have changed)
+        """
+        changes = {}
+        for event in events:
+            BSController._add_user_changes(changes, event.user, event.changes)
+
+        return changes
+
+    @staticmethod
+    def _merge_ui_changes(old_changes: Optional[Dict], new_changes: Optional[Dict]) -> Optional[Dict]:
+        """
+        Merges the changes of two UI updates, where None means everything may have changed.
+        """
+        if old_changes is None or new_changes is None:
+            return None
+
+        merged = {}
+        for ui_changes in (old_changes, new_changes):
+            for user, user_changes in ui_changes.items():
+                BSController._add_user_changes(merged, user, user_changes)
+
+        return merged
+
+    @staticmethod
+    def _add_user_changes(merged: Dict, user: str, user_changes: Optional[Dict]):
+        if user_changes is None or merged.get(user, {}) is None:
+            merged[user] = None
+            return
+
+        merged_user_changes = merged.setdefault(user, {})
+        for artifact_type, keys in user_changes.items():
+            merged_user_changes.setdefault(artifact_type, set()).update(keys)
 
-    def _update_ui(self, states):
+    def _update_ui(self, states, changes=None, commits=None):
         if not self.ui_callback:
             return
 
-        self.ui_callback(states)
+        # commits are only known while tracing, and tie the table update to the edits that caused it
+        with tracer.span("BSController._update_ui", process=self.client.master_user, commits=commits or ()):
+            self.ui_callback(states, changes)
 
-    def _check_and_notify_ctx(self, states):
+    def _check_and_notify_ctx(self):
         active_ctx = self.deci.gui_active_context()
         if active_ctx is None or self.last_ctx == active_ctx:
             return
 
         self.last_ctx = active_ctx
-        self.ctx_change_callback(states)
+        # states are only gathered when the context actually changed
+        self.ctx_change_callback(self.client.all_states())
 
     def start_worker_routines(self):
         self._run_updater_threads = True
@@ -328,6 +497,7 @@ class BSController:
 
     def stop_worker_routines(self):
         self._run_updater_threads = False
+        self._wake_updater()
         self.push_job_scheduler.stop_worker_thread()
         self._stop_ui_components()
 
@@ -340,6 +510,8 @@ class BSController:
         self.client = Client(
             user, path, binary_hash, init_repo=init_repo, remote_url=remote_url, **kwargs
         )
+        self.client.subscribe(self._on_state_change)
+        self.client.commit_queued_callback = self._on_commit_queued
 
         if not single_thread:
             self.start_worker_routines()
@@ -390,8 +562,8 @@ class BSController:
     #
 
     @init_checker
-    def get_state(self, user=None, version=None, priority=None, no_cache=False) -> State:
-        return self.client.get_state(user=user, version=version, priority=priority, no_cache=no_cache)
+    def get_state(self, user=None, priority=None, no_cache=False) -> State:
+        return self.client.get_state(user=user, priority=priority, no_cache=no_cache)
 
     @init_checker
     def pull_artifact(self, type_: Artifact, *identifiers, many=False, user=None, state=None) -> Optional[Artifact]:
@@ -412,6 +584,7 @@ class BSController:
 
         return artifact
 
+    @traced(process=lambda self: getattr(self.client, "master_user", None), pending=True)
     def _commit_initiated_changes(self, *args, **kwargs):
         """
         A special wrapper for callbacks to only commit artifacts when they are changed by the user, and not
@@ -507,7 +680,9 @@ class BSController:
         master_artifact = artifact if artifact else art_state_getter(master_state, *identifiers)
         target_artifact = art_state_getter(state, *identifiers)
         if target_artifact is not None:
-            # specify to BinSync that this is not user-changed, but merged from someone else
+            # specify to BinSync that this is not user-changed, but merged from someone else. the artifact
+            # is shared with the cached copies of the state, so it must be copied before being changed
+            target_artifact = target_artifact.copy()
             target_artifact.reset_last_change()
 
         merged_artifact = self.merge_artifacts(
@@ -715,7 +890,7 @@ class BSController:
                 _l.warning(f"Failed to force push function @ {func_addr:#0x}")
                 continue
 
-            master_state.functions[f.addr] = f
+            master_state.set_function(f)
             committed += 1
 
         # commit the master state back!
@@ -736,18 +911,18 @@ class BSController:
         for lookup_key in lookup_items:
             if isinstance(lookup_key, int):
                 art = self.deci.global_vars[lookup_key]
-                master_state.global_vars[art.addr] = art
+                master_state.set_global_var(art)
             else:
                 art = None
                 # structs always first
                 try:
                     art = self.deci.structs[lookup_key]
-                    master_state.structs[lookup_key] = art
+                    master_state.set_struct(art)
                 except KeyError:
                     pass
 
                 if art is None:
-                    master_state.enums[lookup_key] = self.deci.enums[lookup_key]
+                    master_state.set_enum(self.deci.enums[lookup_key])
             committed += 1
 
         self.client.master_state = master_state
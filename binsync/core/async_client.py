@@ -0,0 +1,198 @@
+import asyncio
+import datetime
+import logging
+import os
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from binsync.core.client import BINSYNC_ROOT_BRANCH, Client, StateChangeEvent
+from binsync.core.scheduler import SchedSpeed
+from binsync.core.state import State
+from binsync.core.user import User
+
+l = logging.getLogger(__name__)
+
+
+class AsyncClient:
+    """
+    An asyncio interface to a Client, so one event loop can drive many BinSync projects without a thread
+    waiting on each of them. Operations on the repo still run on the Git thread of the Client, and are awaited
+    through the futures of their atomic Git actions. Fetches and pushes, which wait on the network, run as
+    asyncio subprocesses instead, so they never hold up the Git thread.
+
+    The Client is shared with any synchronous users of it, like a BSController, so both can be used at once.
+    """
+
+    def __init__(self, client: Client):
+        self.client = client
+        # fetches of the same repo are serialized, since each one diffs the refs from before it
+        self._fetch_lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, *args, **kwargs) -> "AsyncClient":
+        """
+        Creates a Client without blocking the event loop, which clones or inits the repo if needed.
+        Takes the arguments of Client.
+        """
+        loop = asyncio.get_running_loop()
+        client = await loop.run_in_executor(None, lambda: Client(*args, **kwargs))
+        return cls(client)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.client.shutdown)
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    #
+    # State Access
+    #
+
+    async def get_state(self, user=None, priority=None, no_cache=False) -> State:
+        return await asyncio.wrap_future(
+            self.client.get_state(user=user, priority=priority, no_cache=no_cache, block=False)
+        )
+
+    async def users(self, priority=None, no_cache=False) -> Iterable[User]:
+        return await asyncio.wrap_future(self.client.users(priority=priority, no_cache=no_cache, block=False))
+
+    async def all_states(self) -> List[State]:
+        """
+        Gets the state of every user, see Client.all_states. States that are not cached are parsed concurrently
+        by the state parsing workers of the Client, which a pool thread waits on.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.client.all_states)
+
+    async def has_remote(self) -> bool:
+        # the property can not take arguments, so the atomic Git action behind it is called directly
+        return bool(await asyncio.wrap_future(Client.has_remote.fget(self.client, block=False)))
+
+    #
+    # Git Operations
+    #
+
+    async def commit_master_state(self, commit_msg=None):
+        futures = self.client.commit_master_state(commit_msg=commit_msg, block=False)
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+
+    async def pull(self):
+        """
+        Fetches the remote branches, then fast-forwards the local branches to them on the Git thread. Users whose
+        branch moved get a StateChangeEvent, which is sent to subscribers by dispatch_state_changes.
+        """
+        client = self.client
+        client.last_pull_attempt_time = datetime.datetime.now(tz=datetime.timezone.utc)
+        if not await self.has_remote():
+            return
+
+        async with self._fetch_lock:
+            returncode, output = await self._git("for-each-ref", *client._binsync_refs_args())
+            if returncode != 0:
+                l.debug(f"Failed to read the refs of {client.repo.working_dir}: {output}")
+                return
+
+            old_refs = client._parse_refs(output)
+            if client.adaptive_pull:
+                # listing the remote refs is far cheaper than a fetch, which is skipped if none of them moved
+                returncode, output = await self._git("ls-remote", *client._ls_remote_args())
+                if returncode != 0:
+                    client.active_remote = False
+                    client._record_pull(False)
+                    return
+
+                # the first pull also tracks the branches of a fresh clone, so it never skips the update
+                if client._last_pull_time is not None and not client._remote_refs_moved(output, old_refs):
+                    client._last_pull_time = datetime.datetime.now(tz=datetime.timezone.utc)
+                    client.active_remote = True
+                    client._record_pull(False)
+                    return
+
+            returncode, output = await self._git("fetch", client.remote)
+            if returncode != 0:
+                #l.debug(f"Pull exception {output}")
+                client.active_remote = False
+                client._record_pull(False)
+                return
+
+            await asyncio.wrap_future(client._apply_fetch(old_refs=old_refs, priority=SchedSpeed.AVERAGE, block=False))
+
+    async def push(self):
+        client = self.client
+        client.last_push_attempt_time = datetime.datetime.now(tz=datetime.timezone.utc)
+        if not await self.has_remote():
+            return
+
+        if client.adaptive_pull:
+            returncode, output = await self._git("for-each-ref", *client._binsync_refs_args())
+            if returncode == 0 and not client._has_unpushed_commits(client._parse_refs(output)):
+                return
+
+        returncode, output = await self._git("push", client.remote, BINSYNC_ROOT_BRANCH, client.user_branch_name)
+        if returncode != 0:
+            client.active_remote = False
+            #l.debug(f"Failed to push b/c {output}")
+            return
+
+        client._last_push_time = datetime.datetime.now(tz=datetime.timezone.utc)
+        client.active_remote = True
+
+    async def commit_and_update_states(self, commit_msg=None):
+        """
+        The asyncio version of Client.commit_and_update_states.
+        """
+        client = self.client
+        await self.commit_master_state(commit_msg=commit_msg)
+        if client.pull_on_update:
+            await self.pull()
+        if client.push_on_update:
+            await self.push()
+
+        client.dispatch_state_changes()
+
+    async def _git(self, *args: str) -> Tuple[int, str]:
+        """
+        Runs a Git command in the repo of the Client.
+
+        @return: The exit code and the output of the command, with stderr merged into it
+        """
+        env = dict(os.environ)
+        env.update(self.client.ssh_agent_env())
+        proc = await asyncio.create_subprocess_exec(
+            "git", *args,
+            cwd=self.client.repo.working_dir,
+            env=env,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        output, _ = await proc.communicate()
+        return proc.returncode, output.decode(errors="replace")
+
+    #
+    # Change Events
+    #
+
+    async def changes(self, users: Optional[List[str]] = None) -> AsyncIterator[StateChangeEvent]:
+        """
+        Iterates over every StateChangeEvent the Client sends once the iteration started, until it is stopped.
+        Events are sent by dispatch_state_changes, on whichever thread calls it.
+
+        @param users:   Only iterate over the events of these users, or None for every user
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()  # type: asyncio.Queue
+
+        def _on_state_change(event: StateChangeEvent):
+            if users is None or event.user in users:
+                loop.call_soon_threadsafe(events.put_nowait, event)
+
+        self.client.subscribe(_on_state_change)
+        try:
+            while True:
+                yield await events.get()
+        finally:
+            self.client.unsubscribe(_on_state_change)
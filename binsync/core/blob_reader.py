@@ -0,0 +1,136 @@
+import logging
+import subprocess
+import threading
+from typing import Dict, Iterable, List, Optional
+
+l = logging.getLogger(__name__)
+
+
+class BlobReader:
+    """
+    Reads Git objects in bulk through a single long-lived `git cat-file --batch` process, so loading
+    every file of a tree costs one round trip through a pipe instead of one object database lookup per file.
+    Objects can be requested by any name Git understands, like a hexsha or `<tree-ish>:<path>`.
+
+    The reader is thread safe, but requests are served one batch at a time.
+    """
+
+    def __init__(self, git_dir: str):
+        self.git_dir = str(git_dir)
+        self._process = None  # type: Optional[subprocess.Popen]
+        self._lock = threading.Lock()
+
+    def _git_cmd(self, *args) -> List[str]:
+        return ["git", f"--git-dir={self.git_dir}", *args]
+
+    def _get_process(self) -> subprocess.Popen:
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                self._git_cmd("cat-file", "--batch"),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+
+        return self._process
+
+    @staticmethod
+    def _write_requests(process: subprocess.Popen, object_names: List[str]):
+        try:
+            process.stdin.write(b"".join(name.encode() + b"\n" for name in object_names))
+            process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            l.warning(f"Failed to request objects from git cat-file: {e}")
+
+    def read_many(self, object_names: Iterable[str]) -> Dict[str, Optional[bytes]]:
+        """
+        Reads many objects in one pass.
+
+        @param object_names:    Names of the objects to read, like "<tree-hexsha>:<path>"
+        @return:                Dict of object name -> object data, or None if the object does not exist
+        """
+        object_names = list(dict.fromkeys(object_names))
+        objects = {}
+        if not object_names:
+            return objects
+
+        with self._lock:
+            process = self._get_process()
+            # requests are written from another thread so a full stdout pipe can never block the writes
+            writer = threading.Thread(target=self._write_requests, args=(process, object_names), daemon=True)
+            writer.start()
+            try:
+                for name in object_names:
+                    header = process.stdout.readline()
+                    if not header:
+                        raise RuntimeError("git cat-file exited before all objects were read")
+
+                    # missing objects respond with "<name> missing"
+                    if header.rstrip(b"\n").endswith(b" missing"):
+                        objects[name] = None
+                        continue
+
+                    _, _, size = header.split()
+                    objects[name] = process.stdout.read(int(size))
+                    # every object is terminated with a newline
+                    process.stdout.read(1)
+            except Exception:
+                # the pipe is in an unknown position, so start fresh on the next read
+                self._kill_process()
+                raise
+            finally:
+                writer.join()
+
+        return objects
+
+    def read(self, object_name: str) -> Optional[bytes]:
+        return self.read_many([object_name])[object_name]
+
+    def list_tree(self, tree_ish: str) -> Dict[str, str]:
+        """
+        Lists every file in a tree, recursively, with a single `git ls-tree`.
+
+        @param tree_ish:    A hexsha or name of a tree or commit
+        @return:            Dict of file path -> blob hexsha
+        """
+        output = subprocess.run(
+            self._git_cmd("ls-tree", "-r", "-z", tree_ish),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout
+
+        files = {}
+        for entry in output.split(b"\0"):
+            if not entry:
+                continue
+
+            info, path = entry.split(b"\t", 1)
+            _, obj_type, hexsha = info.split()
+            if obj_type == b"blob":
+                files[path.decode()] = hexsha.decode()
+
+        return files
+
+    def _kill_process(self):
+        if self._process is None:
+            return
+
+        try:
+            self._process.kill()
+            self._process.wait()
+        except OSError:
+            pass
+        self._process = None
+
+    def close(self):
+        with self._lock:
+            if self._process is None:
+                return
+
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self._kill_process()
+            self._process = None
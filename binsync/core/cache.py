@@ -3,6 +3,8 @@ from queue import Queue
 from threading import Lock
 import logging
 
+from binsync.core.tracing import tracer
+
 l = logging.getLogger(__name__)
 
 
@@ -19,6 +21,13 @@ class Cache:
         self.queued_master_state_changes = Queue()
 
     def clear_state_cache(self, username_commit_dict: dict):
+        """
+        Drops the cached state of every user whose commit changed. The last parsed state of that user
+        is kept as a base state, so the next get_state only needs to reparse what changed in the tree.
+
+        @return: Dict of username -> (old commit, new commit) for every user whose state was dropped
+        """
+        moved_users = {}
         for username, commit in username_commit_dict.items():
             # master user should never have state erased
             if not username or username == self._master_user:
@@ -26,9 +35,12 @@ class Cache:
 
             with self.state_lock:
                 if self.state_cache[username].commit != commit:
+                    moved_users[username] = (self.state_cache[username].commit, commit)
                     self.state_cache[username].state = None
                     self.state_cache[username].commit = commit
 
+        return moved_users
+
     def clear_user_branch_cache(self, branch_set: set):
         with self.user_lock:
             if branch_set != self.user_cache.known_branches:
@@ -49,6 +61,39 @@ class Cache:
                 state = self.state_cache[user].state
                 return state.copy() if state else state
 
+    def get_base_state(self, user=None):
+        """
+        Gets the last state parsed for a user along with the Git tree it was parsed from.
+        The master user never has a base state since its state is never erased.
+
+        @return: (state, tree) or (None, None)
+        """
+        if not user or user == self._master_user:
+            return None, None
+
+        with self.state_lock:
+            cache = self.state_cache[user]
+            return cache.base_state, cache.base_tree
+
+    def get_state_commit(self, user):
+        """
+        Gets the commit of a user branch the state cache was last cleared for, see clear_state_cache.
+        """
+        with self.state_lock:
+            return self.state_cache[user].commit
+
+    def base_states(self):
+        """
+        Gets the last state parsed for every non-master user along with the Git tree it was parsed from.
+
+        @return: Dict of username -> (state, tree)
+        """
+        with self.state_lock:
+            return {
+                user: (cache.base_state, cache.base_tree) for user, cache in self.state_cache.items()
+                if cache.base_state is not None and cache.base_tree is not None
+            }
+
     def users(self, **kwargs):
         with self.user_lock:
             return self.user_cache.users if self.user_cache.users else []
@@ -58,14 +103,41 @@ class Cache:
     #
 
     def set_state(self, state, user=None, **kwargs):
-        copied_state = state.copy()
+        is_master = not user or user == self._master_user
+        # a queued master state waits on its commit to be traced
+        with tracer.span("Cache.set_state", process=self._master_user, pending=self._master_user if is_master else None):
+            copied_state = state.copy()
+            if is_master:
+                with self.master_state_lock:
+                    self.queued_master_state_changes.put_nowait(copied_state)
+                    self._master_state = copied_state
+            else:
+                with self.state_lock:
+                    self.state_cache[user].state = copied_state
+
+    def set_state_if_current(self, state, commit, user=None):
+        """
+        Caches the state of a non-master user, unless the cache was cleared for a new commit of the user branch
+        since the state was parsed from commit.
+
+        @return: True if the state was cached
+        """
+        with self.state_lock:
+            cache = self.state_cache[user]
+            if cache.commit != commit:
+                return False
+
+            cache.state = state.copy()
+            return True
+
+    def set_base_state(self, state, tree, user=None):
         if not user or user == self._master_user:
-            with self.master_state_lock:
-                self.queued_master_state_changes.put_nowait(copied_state)
-                self._master_state = copied_state
-        else:
-            with self.state_lock:
-                self.state_cache[user].state = copied_state
+            return
+
+        with self.state_lock:
+            cache = self.state_cache[user]
+            cache.base_state = state.copy()
+            cache.base_tree = tree
 
     def set_users(self, users, **kwargs):
         with self.user_lock:
@@ -76,6 +148,9 @@ class StateCache:
     def __init__(self, state=None, commit=None):
         self.state = state
         self.commit = commit
+        # the last parsed state and the Git tree it came from, kept across commits for incremental parsing
+        self.base_state = None
+        self.base_tree = None
 
 
 class UserCache:
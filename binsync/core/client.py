@@ -3,21 +3,37 @@ import pathlib
 import os
 import re
 import subprocess
+import threading
+import time
 import datetime
+import multiprocessing
+import queue
+from concurrent.futures import (
+    CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+)
+from io import BytesIO
+from collections import defaultdict
 from functools import wraps
-from typing import Iterable, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Set
 from pathlib import Path
 
 import filelock
 import git
+import toml
 import git.exc
+from git.objects.fun import tree_to_stream
+from gitdb import IStream, LooseObjectDB
 
 from binsync.core.user import User
 from binsync.configuration import GlobalConfig
 from binsync.core.errors import ExternalUserCommitError, MetadataNotFoundError
-from binsync.core.state import State, load_toml_from_file
+from binsync.core.state import State
 from binsync.core.scheduler import Scheduler, Job, SchedSpeed
 from binsync.core.cache import Cache
+from binsync.core.blob_reader import BlobReader
+from binsync.core.disk_cache import StateDiskCache
+from binsync.core.metrics import COUNT_BUCKETS, registry
+from binsync.core.tracing import traced, tracer
 
 
 l = logging.getLogger(__name__)
@@ -26,11 +42,66 @@ BINSYNC_ROOT_BRANCH = f'{BINSYNC_BRANCH_PREFIX}/__root__'
 
 logging.getLogger("git").setLevel(logging.ERROR)
 
+# atomic Git actions that only read, so identical pending calls can share one run
+COALESCED_GIT_ACTIONS = {"get_state", "users", "_resolve_state_trees"}
+# atomic Git actions whose results are cached, see Client.check_cache_
+CACHED_GIT_ACTIONS = {"get_state", "users"}
+# seconds an atomic Git action is waited for by default
+DEFAULT_GIT_ACTION_TIMEOUT = 30
+# marks a git action called without a timeout, which returns an empty result instead of raising on timeout
+_DEFAULT_TIMEOUT = object()
+# seconds commits, pulls, and pushes of an update are waited for, which may be slow on a busy remote
+UPDATE_GIT_ACTION_TIMEOUT = 300
+# max factor the pull interval is backed off by while the remote is idle or unreachable
+MAX_PULL_BACKOFF = 8
+# max commits looked up per moved branch to tag trace spans with
+MAX_TRACED_COMMITS = 1000
+# max seconds shutdown spends caching states on disk, states left over are reparsed in the next session
+DISK_CACHE_SHUTDOWN_BUDGET = 1.0
+
+_CACHE_LOOKUPS = registry.counter(
+    "binsync_git_action_cache_total", "Cache lookups of atomic Git actions, by function and hit or miss",
+    labels=("function", "result")
+)
+_COMMIT_BATCH_SIZE = registry.histogram(
+    "binsync_commit_batch_size", "Queued master state changes taken by one commit of the master state",
+    buckets=COUNT_BUCKETS
+)
+_UPDATE_PHASE_TIME = registry.histogram(
+    "binsync_update_phase_seconds", "Seconds each phase of commit_and_update_states took, like pull and push",
+    labels=("phase",)
+)
+
 
 class ConnectionWarnings:
     HASH_MISMATCH = 0
 
 
+class StateChangeEvent:
+    """
+    Describes a user branch that moved to a new commit, like after a pull or a commit.
+
+    :ivar str user:         Name of the user whose branch moved
+    :ivar str old_commit:   Hexsha of the commit the branch was at, or None if the user is new
+    :ivar str new_commit:   Hexsha of the commit the branch is now at
+    :ivar changes:          Dict of ArtifactType -> set of keys of the artifacts that changed, or None when
+                            any artifact of the user may have changed
+    :ivar commits:          Hexshas of every commit the branch moved by, or None when tracing is off
+    """
+
+    def __init__(self, user: str, old_commit: Optional[str], new_commit: str, changes: Optional[Dict[str, Set]],
+                 commits: Optional[List[str]] = None):
+        self.user = user
+        self.old_commit = old_commit
+        self.new_commit = new_commit
+        self.changes = changes
+        self.commits = commits
+
+    def __repr__(self):
+        changes = "all" if self.changes is None else {k: len(v) for k, v in self.changes.items()}
+        return f"<StateChangeEvent: {self.user} {self.old_commit} -> {self.new_commit} changes={changes}>"
+
+
 def atomic_git_action(f):
     """
     Assures that any function called with this decorator will execute in-order, atomically, on a single thread.
@@ -41,27 +112,75 @@ def atomic_git_action(f):
     This function will also attempt to check the cache for requested data on the same thread the original call
     was made from. If not found, the atomic scheduling is done.
 
+    Besides the arguments of the function, every call takes:
+        block:      When False, return a Future of the result right away instead of waiting for it. The Future can
+                    be cancelled to abandon the action if it has not started yet.
+        timeout:    Seconds to wait for the result when blocking, or None to wait until the action is done. An
+                    action that has not started when the timeout hits is abandoned, and TimeoutError is raised.
+                    Without a timeout, DEFAULT_GIT_ACTION_TIMEOUT seconds are waited, after which an empty result
+                    is returned instead of raising, so long-lived callers like the updater skip a round. The
+                    same goes for an action cancelled by the scheduler stopping, which raises CancelledError
+                    when a timeout was given.
+
     @param f:   A Client object function
     @return:
     """
     @wraps(f)
-    def _atomic_git_action(self: "Client", *args, **kwargs):
+    def _atomic_git_action(self: "Client", *args, block=True, timeout=_DEFAULT_TIMEOUT, **kwargs):
         no_cache = kwargs.get("no_cache", False)
         if not no_cache:
             # cache check
             cache_item = self.check_cache_(f, **kwargs)
+            if f.__name__ in CACHED_GIT_ACTIONS:
+                _CACHE_LOOKUPS.inc(function=f.__name__, result="miss" if cache_item is None else "hit")
             if cache_item is not None:
-                return cache_item
+                if block:
+                    return cache_item
+
+                future = Future()
+                future.set_result(cache_item)
+                return future
 
         # non cache available, queue it up!
         priority = kwargs.get("priority", None) or SchedSpeed.SLOW
-        ret_val = self.scheduler.schedule_and_wait_job(
-            Job(f, self, *args, **kwargs),
-            priority=priority
+        job = Job(f, self, *args, **kwargs)
+        future = self.scheduler.schedule_job(
+            job,
+            priority=priority,
+            # identical reads that are waiting to run, like get_state for the same user, only run once
+            coalesce=f.__name__ in COALESCED_GIT_ACTIONS,
         )
 
-        if ret_val:
-            self._set_cache(f, ret_val, **kwargs)
+        def _cache_result(done_future: Future):
+            if not done_future.cancelled() and done_future.exception() is None and done_future.result():
+                self._set_cache(f, done_future.result(), **kwargs)
+
+        # results are cached however they are waited for, or even if the caller stopped waiting
+        future.add_done_callback(_cache_result)
+        if not block:
+            return future
+
+        explicit_timeout = timeout is not _DEFAULT_TIMEOUT
+        if not explicit_timeout:
+            timeout = DEFAULT_GIT_ACTION_TIMEOUT
+
+        try:
+            ret_val = future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            if job.cancel():
+                l.warning(f"Abandoned {f.__name__} after waiting {timeout} seconds for it to start")
+            else:
+                l.warning(f"Stopped waiting on {f.__name__} after {timeout} seconds")
+            if explicit_timeout:
+                raise
+
+            ret_val = None
+        except CancelledError:
+            l.debug(f"{f.__name__} was cancelled before it ran")
+            if explicit_timeout:
+                raise
+
+            ret_val = None
 
         return ret_val if ret_val is not None else {}
 
@@ -86,6 +205,15 @@ class Client:
         push_on_update=True,
         pull_on_update=True,
         commit_on_update=True,
+        write_snapshots=False,
+        coalesce_commits=True,
+        state_parse_workers=4,
+        parse_processes=0,
+        disk_cache_size=256 * 1024 * 1024,
+        scheduler: Optional[Scheduler] = None,
+        state_parse_pool: Optional[ThreadPoolExecutor] = None,
+        disk_cache: Optional[StateDiskCache] = None,
+        adaptive_pull=True,
         **kwargs,
     ):
         """
@@ -102,6 +230,23 @@ class Client:
         :param remote_url:          Remote URL to a Git Repo which may be used for cloning or initing
         :param ssh_agent_pid:       SSH Agent PID
         :param ssh_auth_sock:       SSH Auth Socket
+        :param write_snapshots:     Write a state snapshot with every commit, so other users load the state faster
+        :param coalesce_commits:    Commit all queued master state changes as a single commit, instead of one
+                                    commit per change (up to commit_batch_size)
+        :param state_parse_workers: Max number of user states parsed concurrently by all_states
+        :param parse_processes:     Number of worker processes that decode the TOML files of large states, or 0
+                                    to decode them in-process. Workers are spawned from sys.executable, so this
+                                    is meant for headless clients, not clients embedded in a decompiler
+        :param disk_cache_size:     Max bytes of parsed states kept in .git/binsync-cache between sessions, or 0
+                                    to never cache states on disk
+        :param scheduler:           A started Scheduler to run the Git actions on, shared with other clients,
+                                    instead of a Git thread of this client
+        :param state_parse_pool:    A thread pool to parse states on, shared with other clients, instead of one
+                                    of state_parse_workers threads
+        :param disk_cache:          A StateDiskCache shared with other clients, used instead of the one in
+                                    .git/binsync-cache. Shared resources are never shut down by the client.
+        :param adaptive_pull:       Poll the remote refs and only fetch when they moved, only push when the local
+                                    branches are ahead, and back off next_pull_delay while the remote is idle
         """
         self.master_user = master_user
         self.repo_root = repo_root
@@ -109,9 +254,24 @@ class Client:
         self.remote = remote
         self.repo = None
         self.repo_lock = None
+        self.blob_reader = None  # type: Optional[BlobReader]
+        self.object_writer = None  # type: Optional[LooseObjectDB]
         self.pull_on_update = pull_on_update
         self.push_on_update = push_on_update
         self.commit_on_update = commit_on_update
+        self.write_snapshots = write_snapshots
+        self.coalesce_commits = coalesce_commits
+        self.state_parse_workers = max(1, state_parse_workers)
+        self._state_parse_pool = state_parse_pool  # type: Optional[ThreadPoolExecutor]
+        self._owns_state_parse_pool = state_parse_pool is None
+        self.parse_processes = max(0, parse_processes)
+        self._parse_process_pool = None  # type: Optional[ProcessPoolExecutor]
+        self._parse_process_pool_lock = threading.Lock()
+        self.disk_cache_size = disk_cache_size
+        self.disk_cache = disk_cache  # type: Optional[StateDiskCache]
+        self.adaptive_pull = adaptive_pull
+        # pulls in a row that found nothing new on the remote, or could not reach it
+        self._idle_pulls = 0
 
         # validate this username can exist
         if not master_user or master_user.endswith('/') or '__root__' in master_user:
@@ -126,11 +286,26 @@ class Client:
 
         # job scheduler
         self.cache = Cache(master_user=master_user)
-        self.scheduler = Scheduler(name="GitScheduler")
+        self.scheduler = scheduler or Scheduler(name="GitScheduler")
+        self._owns_scheduler = scheduler is None
+
+        # subscribers to branch changes, and the events waiting to be sent to them
+        self._state_change_callbacks = []  # type: List[Callable[[StateChangeEvent], None]]
+        self._pending_state_changes = queue.Queue()
+        # called whenever a change to the master state is queued for commit
+        self.commit_queued_callback = None  # type: Optional[Callable[[], None]]
+        # seconds each phase of the last commit_and_update_states took
+        self.last_update_timings = {}  # type: Dict[str, float]
 
         # create, init, and checkout Git repo
         self.repo = self._get_or_init_binsync_repo(remote_url, init_repo)
-        self.scheduler.start_worker_thread()
+        self.blob_reader = BlobReader(self.repo.git_dir)
+        if self.disk_cache is None and self.disk_cache_size > 0:
+            self.disk_cache = StateDiskCache(os.path.join(self.repo.git_dir, "binsync-cache"), self.disk_cache_size)
+        # objects are written in-process, since the default object database spawns a git process per object
+        self.object_writer = LooseObjectDB(os.path.join(self.repo.git_dir, "objects"))
+        if self._owns_scheduler:
+            self.scheduler.start_worker_thread()
         self._get_or_init_user_branch()
 
         # timestamps
@@ -172,11 +347,24 @@ class Client:
         try:
             branch = next(o for o in self.repo.branches if o.name.endswith(self.user_branch_name))
         except StopIteration:
-            branch = self.repo.create_head(self.user_branch_name, BINSYNC_ROOT_BRANCH)
+            try:
+                remote_branch = self.repo.remote(self.remote).refs[self.user_branch_name]
+            except (ValueError, IndexError):
+                remote_branch = None
+
+            if remote_branch is not None:
+                # a user on a fresh clone continues their remote branch, since a new branch could never be pushed
+                branch = self.repo.create_head(self.user_branch_name, remote_branch)
+                branch.set_tracking_branch(remote_branch)
+            else:
+                branch = self.repo.create_head(self.user_branch_name, BINSYNC_ROOT_BRANCH)
         else:
             if branch.is_remote():
                 branch = self.repo.create_head(self.user_branch_name)
-        branch.checkout()
+
+        # commits are written directly to the user branch ref, so the working tree is parked on the root commit
+        # and never has to follow any user branch
+        self._detach_head()
 
     def _get_or_init_binsync_repo(self, remote_url, init_repo):
         """
@@ -269,6 +457,8 @@ class Client:
     @master_state.setter
     def master_state(self, state):
         self.cache.set_state(state, user=self.master_user)
+        if self.commit_queued_callback is not None:
+            self.commit_queued_callback()
 
     @property
     def last_push_ts(self):
@@ -301,10 +491,14 @@ class Client:
         while attempt_again:
             attempt_again = False
             users = list()
-            for ref in self._get_best_refs(repo, force_local=force_local_users).values():
-                #l.debug(f"{ref} NAME: {ref.name}")
+            # read the metadata of every user in one batch
+            metadata_names = [
+                f"{ref.commit.hexsha}:metadata.toml"
+                for ref in self._get_best_refs(repo, force_local=force_local_users).values()
+            ]
+            for metadata_name, metadata_data in self.blob_reader.read_many(metadata_names).items():
                 try:
-                    metadata = load_toml_from_file(ref.commit.tree, "metadata.toml", client=self)
+                    metadata = toml.loads(metadata_data.decode())
                     user = User.from_metadata(metadata)
                     users.append(user)
                 except Exception as e:
@@ -321,28 +515,75 @@ class Client:
 
     @atomic_git_action
     def get_state(self, user=None, priority=None, no_cache=False):
+        state, _ = self._load_state(user)
+        return state
+
+    def _load_state(self, user=None):
+        """
+        Parses the state of a user from its branch. This is not an atomic action, so it must only be called
+        from a function that already runs on the Git scheduler thread.
+
+        @return:    The state and a dict of ArtifactType -> set of keys that changed since the last parse of the
+                    user, or None when every artifact was (re)loaded
+        """
         if user is None:
             user = self.master_user
 
-        repo = self.repo
-        state = State(None)
         try:
-            state = State.parse(
-                self._get_tree(user, repo),
-                client=self
-            )
-        except MetadataNotFoundError:
-            if user == self.master_user:
-                # create of the first state ever
-                state = State(self.master_user, client=self)
+            tree = self._get_tree(user, self.repo)
         except Exception as e:
-            if user == self.master_user:
-                raise
+            return self._failed_state(user, e), None
+
+        return self._parse_state(user, tree)
+
+    def _parse_state(self, user, tree: git.Tree):
+        """
+        Parses the state of a user from a tree of its branch. Trees are immutable, so unlike _load_state this
+        can run on any thread.
+
+        @return:    See _load_state
+        """
+        changes = None
+        try:
+            # reuse the last state parsed for this user to only reload artifacts that changed since then
+            base_state, base_tree = self.cache.get_base_state(user)
+            if base_state is not None and base_tree is not None:
+                state, changes = State.parse_incremental(tree, base_state, base_tree, client=self)
             else:
-                l.critical(f"Invalid state for {user}, dropping: {e}")
-                state = State(user)
+                state = self.disk_cache.load(tree, client=self) if self.disk_cache is not None else None
+                if state is None:
+                    state = State.parse(tree, client=self, executor=self._get_parse_process_pool())
+                    if self.disk_cache is not None:
+                        self.disk_cache.store(tree, state)
+            self.cache.set_base_state(state, tree, user=user)
+        except Exception as e:
+            return self._failed_state(user, e), None
 
-        return state
+        return state, changes
+
+    def _get_parse_process_pool(self) -> Optional[ProcessPoolExecutor]:
+        if not self.parse_processes:
+            return None
+
+        with self._parse_process_pool_lock:
+            if self._parse_process_pool is None:
+                # workers are spawned, since forking would copy the locks held by the threads of this process
+                self._parse_process_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_processes, mp_context=multiprocessing.get_context("spawn")
+                )
+
+            return self._parse_process_pool
+
+    def _failed_state(self, user, error: Exception):
+        if isinstance(error, MetadataNotFoundError):
+            # create of the first state ever
+            return State(self.master_user, client=self) if user == self.master_user else State(None)
+
+        if user == self.master_user:
+            raise error
+
+        l.critical(f"Invalid state for {user}, dropping: {error}")
+        return State(user)
 
     @property
     @atomic_git_action
@@ -355,89 +596,293 @@ class Client:
         return self.remote and any(r.name == self.remote for r in self.repo.remotes)
 
     def all_states(self):
-        states = list()
         # promises users in the event of inability to get new users
         users = self.users(no_cache=True) or self.users()
         if not users:
             l.critical("Failed to get users from current project. Report me if possible.")
             return {}
 
+        states = {}
+        uncached_users = []
         for user in users:
-            state = self.get_state(user=user.name)
-            states.append(state)
+            state = self.cache.get_state(user=user.name)
+            if state is not None:
+                states[user.name] = state
+            else:
+                uncached_users.append(user.name)
+
+        if uncached_users:
+            loaded_states = self._load_states(uncached_users)
+            if len(loaded_states) < len(uncached_users):
+                # Git was busy for longer than the timeout, so callers like the updater retry on their next round
+                l.warning("Timed out loading the states of users, skipping this update")
+                return {}
+            states.update(loaded_states)
+
+        return [states[user.name] for user in users]
+
+    def _load_states(self, users: List[str]) -> Dict[str, State]:
+        """
+        Loads the states of many users, parsing them concurrently with up to state_parse_workers threads.
+        Only the branch trees are resolved on the Git scheduler thread; the parsing itself only reads
+        immutable Git objects, so it never waits behind (or blocks) other Git operations.
+
+        @param users:   Names of the users to load
+        @return:        Dict of username -> State, without the users whose state timed out
+        """
+        # the master state is always cached, and parsing it again would queue a commit of it
+        if self.master_user in users or self.state_parse_workers == 1 or len(users) == 1:
+            states = {user: self.get_state(user=user) for user in users}
+            # a get_state that timed out returns an empty dict
+            return {user: state for user, state in states.items() if isinstance(state, State)}
+
+        trees = self._resolve_state_trees(users=users)
+        if not trees:
+            # timed out, since a resolve has an entry for every user
+            return {}
+        if self._state_parse_pool is None:
+            self._state_parse_pool = ThreadPoolExecutor(
+                max_workers=self.state_parse_workers, thread_name_prefix="StateParser"
+            )
+
+        futures = {
+            user: self._state_parse_pool.submit(self._parse_state, user, tree)
+            for user, (tree, _) in trees.items() if tree is not None
+        }
+        states = {}
+        for user in users:
+            tree, commit = trees.get(user, (None, None))
+            if tree is None:
+                states[user] = self._failed_state(user, ValueError(f'No such user "{user}" found in repository'))
+                continue
+
+            state, _ = futures[user].result()
+            # a pull may have moved the branch while it was parsed, in which case the pull cached a newer state
+            self.cache.set_state_if_current(state, commit, user=user)
+            states[user] = state
 
         return states
 
-    def commit_master_state(self, commit_msg=None):
-        # attempt to commit dirty files in a update phase
-        for i in range(self._commit_batch_size):
-            if self.cache.queued_master_state_changes.empty():
+    @atomic_git_action
+    def _resolve_state_trees(self, users=None, priority=None):
+        """
+        Resolves the tree of the branch of every user, along with the commit the state cache knows for it.
+
+        @return:    Dict of username -> (tree, cached commit), with a tree of None for users without a branch
+        """
+        trees = {}
+        for user in users:
+            try:
+                trees[user] = (self._get_tree(user, self.repo), self.cache.get_state_commit(user))
+            except Exception as e:
+                l.debug(f"Unable to resolve the tree of {user}: {e}")
+                trees[user] = (None, None)
+
+        return trees
+
+    #
+    # State Change Events
+    #
+
+    def subscribe(self, callback: Callable[[StateChangeEvent], None]):
+        """
+        Registers a callback for every user branch that moves, either from a pull or a commit of the master
+        user. Callbacks are run on the thread that called commit_and_update_states, after the Git operations
+        are done, so they may use the Client.
+
+        @param callback:    A function taking a StateChangeEvent
+        """
+        if callback not in self._state_change_callbacks:
+            self._state_change_callbacks.append(callback)
+
+    def unsubscribe(self, callback: Callable[[StateChangeEvent], None]):
+        try:
+            self._state_change_callbacks.remove(callback)
+        except ValueError:
+            pass
+
+    def dispatch_state_changes(self):
+        """
+        Sends every pending StateChangeEvent to the subscribers.
+        """
+        while True:
+            try:
+                event = self._pending_state_changes.get_nowait()
+            except queue.Empty:
                 break
 
-            state = self.cache.queued_master_state_changes.get()
-            self._commit_state(
-                state,
-                msg=commit_msg or state.last_commit_msg,
-                no_checkout=i > 0
-            )
+            for callback in list(self._state_change_callbacks):
+                try:
+                    callback(event)
+                except Exception as e:
+                    l.warning(f"State change callback {callback} failed on {event}: {e}")
+
+    def commit_master_state(self, commit_msg=None, block=True) -> List[Future]:
+        """
+        Commits the queued changes of the master state.
+
+        @param commit_msg:  Message used for the commits instead of the messages of the queued changes
+        @param block:       When False, return right after the commits are queued instead of waiting for them
+        @return:            The futures of the queued commits
+        """
+        futures = []
+        if self.coalesce_commits:
+            future = self._commit_coalesced_master_states(commit_msg=commit_msg)
+            if future is not None:
+                futures.append(future)
+        else:
+            # attempt to commit dirty files in a update phase
+            for i in range(self._commit_batch_size):
+                if self.cache.queued_master_state_changes.empty():
+                    break
+
+                state = self.cache.queued_master_state_changes.get()
+                futures.append(self._commit_state(state, msg=commit_msg or state.last_commit_msg, block=False))
+
+            if futures:
+                _COMMIT_BATCH_SIZE.observe(len(futures))
+
+        # the states are already off the queue, so the commits must not be abandoned, only stopped waiting on
+        if block:
+            try:
+                for future in futures:
+                    future.result(timeout=UPDATE_GIT_ACTION_TIMEOUT)
+            except FuturesTimeoutError:
+                l.warning(f"Stopped waiting on a commit after {UPDATE_GIT_ACTION_TIMEOUT} seconds")
+            except CancelledError:
+                l.warning("A commit of the master state was cancelled by the client shutting down")
 
         self.cache._master_state._dirty = False
+        return futures
+
+    def _commit_coalesced_master_states(self, commit_msg=None) -> Optional[Future]:
+        """
+        Commits every queued master state change as a single commit. Each queued state is a full copy of the
+        master state, and its dirty artifacts include every change since the last commit, so committing the
+        latest state covers all of them. The commit message lists the message of every queued change.
+        """
+        states = []
+        while True:
+            try:
+                states.append(self.cache.queued_master_state_changes.get_nowait())
+            except queue.Empty:
+                break
+
+        if not states:
+            return None
+
+        _COMMIT_BATCH_SIZE.observe(len(states))
+        msgs = list(dict.fromkeys(state.last_commit_msg for state in states if state.last_commit_msg))
+        return self._commit_state(states[-1], msg=commit_msg or self._combine_commit_msgs(msgs), block=False)
+
+    @staticmethod
+    def _combine_commit_msgs(msgs: List[str]) -> Optional[str]:
+        if len(msgs) <= 1:
+            return msgs[0] if msgs else None
+
+        return f"Combined {len(msgs)} changes\n\n" + "\n".join(f"- {msg}" for msg in msgs)
 
     def commit_and_update_states(self, commit_msg=None):
         """
         Update both the local and remote repo knowledge of files through pushes/pulls and commits
         in the case of dirty files.
         """
+        timings = {}
+        phase_start = time.perf_counter()
         self.commit_master_state(commit_msg=commit_msg)
+        timings["commit"] = time.perf_counter() - phase_start
 
-        # do a pull if there is a remote repo connected
+        # do a pull if there is a remote repo connected. Network actions get far longer than other actions, since
+        # giving up on them early would only queue more of them.
         self.last_pull_attempt_time = datetime.datetime.now(tz=datetime.timezone.utc)
         if self.has_remote and self.pull_on_update:
-            self._pull()
+            phase_start = time.perf_counter()
+            if not self._wait_update_action(self._pull):
+                return
+            timings["pull"] = time.perf_counter() - phase_start
 
         self.last_push_attempt_time = datetime.datetime.now(tz=datetime.timezone.utc)
         if self.has_remote and self.push_on_update:
-            self._push()
+            phase_start = time.perf_counter()
+            if not self._wait_update_action(self._push):
+                return
+            timings["push"] = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        self.dispatch_state_changes()
+        timings["dispatch"] = time.perf_counter() - phase_start
+        self.last_update_timings = timings
+        for phase, seconds in timings.items():
+            _UPDATE_PHASE_TIME.observe(seconds, phase=phase)
+
+    @staticmethod
+    def _wait_update_action(action: Callable) -> bool:
+        """
+        Runs a pull or push of an update, waiting up to UPDATE_GIT_ACTION_TIMEOUT seconds for it.
+
+        @return:    False if the update should stop, because the action timed out or the client is shutting down
+        """
+        try:
+            action(timeout=UPDATE_GIT_ACTION_TIMEOUT)
+        except FuturesTimeoutError:
+            l.warning(f"Skipping this update, {action.__name__} took over {UPDATE_GIT_ACTION_TIMEOUT} seconds")
+            return False
+        except CancelledError:
+            return False
+
+        return True
 
     #
     # Git Backend
     #
 
     @atomic_git_action
-    def _commit_state(self, state, msg=None, priority=None, no_checkout=False):
+    @traced(process=lambda self: self.master_user)
+    def _commit_state(self, state, msg=None, priority=None):
         msg = msg or self.DEFAULT_COMMIT_MSG
         if self.master_user != state.user:
             raise ExternalUserCommitError(f"User {self.master_user} is not allowed to commit to user {state.user}")
 
-        if not no_checkout:
-            self._checkout_to_master_user()
-
-        master_user_branch = next(o for o in self.repo.branches if o.name == self.user_branch_name)
-        index = self.repo.index
-
-        # dump the state
-        state.dump(index)
-
-        # commit changes
-        self.repo.index.add([os.path.join(state.user, "*")])
+        # dump only the files of artifacts changed since the last commit
+        files = {}
+        changes = None
+        if not state._dump_all:
+            changes = defaultdict(set)
+            for artifact_type, key in state.dirty_artifacts:
+                changes[artifact_type].add(key)
 
-        if not self.repo.index.diff("HEAD"):
-            return
-
-        # commit if there is any difference
         try:
-            commit = index.commit(msg)
+            # a snapshot covers every artifact, so it must know the files already on the branch
+            existing_files = self.blob_reader.list_tree(f"refs/heads/{self.user_branch_name}") if self.write_snapshots else None
+            state.dump(files, only_dirty=True, snapshot=self.write_snapshots, existing_files=existing_files)
+            commit = self._commit_files(self.user_branch_name, files, msg)
         except Exception as e:
             l.warning(f"Internal Git Commit Error: {e}")
             return
-        self._last_commit_time = datetime.datetime.now(tz=datetime.timezone.utc)
-        master_user_branch.commit = commit
-        state._dirty = False
+
+        state._mark_committed()
+        if commit is not None:
+            self._last_commit_time = datetime.datetime.now(tz=datetime.timezone.utc)
+            # someone is working, so pull and push at the full rate again
+            self._idle_pulls = 0
+            old_commit = commit.parents[0].hexsha if commit.parents else None
+            # the edits that queued the committed state now know their commit
+            tracer.add_commits(commit.hexsha)
+            tracer.resolve_pending(self.master_user, commit.hexsha)
+            self._pending_state_changes.put_nowait(
+                StateChangeEvent(
+                    state.user, old_commit, commit.hexsha, dict(changes) if changes is not None else None,
+                    commits=[commit.hexsha] if tracer.enabled else None
+                )
+            )
 
     @atomic_git_action
+    @traced(process=lambda self: self.master_user)
     def _pull(self, priority=SchedSpeed.AVERAGE):
         """
-        Pull changes from the remote side.
+        Pull changes from the remote side. Remote branches are fetched, and local BinSync branches are then
+        fast-forwarded to them by updating their refs, so no branch is ever checked out. A master user branch
+        that diverged from its remote is merged with it, see _fast_forward_branches.
 
         :return:    None
         """
@@ -447,37 +892,76 @@ class Client:
         except Exception:
             return
 
+        old_refs = self._get_binsync_refs()
+        # the first pull also tracks the branches of a fresh clone, so it never skips the update
+        first_pull = self._last_pull_time is None
+        fetched = False
         with self.repo.git.custom_environment(**env):
             # dangerous remote operations happen here
             try:
-                self._localize_remote_branches()
-                self.repo.git.checkout(BINSYNC_ROOT_BRANCH)
-                self.repo.git.fetch("--all")
-                self.repo.git.pull("--all")
+                # listing the remote refs is far cheaper than a fetch, which is skipped if none of them moved
+                if not self.adaptive_pull or \
+                        self._remote_refs_moved(self.repo.git.ls_remote(*self._ls_remote_args()), old_refs):
+                    self.repo.git.fetch(self.remote)
+                    fetched = True
                 self._last_pull_time = datetime.datetime.now(tz=datetime.timezone.utc)
                 self.active_remote = True
             except Exception as e:
                 #l.debug(f"Pull exception {e}")
                 self.active_remote = False
 
-        if not self.active_remote:
+        self._record_pull(fetched)
+        if not fetched and not (first_pull and self.active_remote):
             return
 
-        # preform a merge on each branch
-        for branch in self.repo.branches:
-            if "HEAD" in branch.name:
-                continue
+        self._update_fetched_branches(old_refs)
 
-            self.repo.git.checkout(branch)
-            try:
-                self.repo.git.merge()
-            except Exception as e:
-                #l.debug(f"Failed to merge on {branch} with {e}")
-                pass
+    @atomic_git_action
+    @traced(process=lambda self: self.master_user)
+    def _apply_fetch(self, old_refs=None, priority=SchedSpeed.AVERAGE):
+        """
+        Updates the local branches after a fetch that was run outside the Git thread, like by the AsyncClient.
+
+        @param old_refs:    The BinSync refs from before the fetch, see _get_binsync_refs
+        @return:
+        """
+        self._last_pull_time = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.active_remote = True
+        self._record_pull(True)
+        self._update_fetched_branches(old_refs)
+
+    def _update_fetched_branches(self, old_refs: Dict[str, str]):
+        """
+        Tracks and fast-forwards the local branches to the fetched remote branches, then reloads the state of
+        every user whose branch moved and queues a StateChangeEvent for each.
+
+        @param old_refs:    The BinSync refs from before the fetch, see _get_binsync_refs
+        @return:
+        """
+        self._localize_remote_branches()
+        self._fast_forward_branches()
 
-        self._update_cache()
+        # only the users whose local or remote branch moved need their cached state dropped
+        new_refs = self._get_binsync_refs()
+        moved_refs = {ref for ref in old_refs.keys() | new_refs.keys() if old_refs.get(ref) != new_refs.get(ref)}
+        if not moved_refs:
+            return
+
+        if f"refs/heads/{BINSYNC_ROOT_BRANCH}" in moved_refs:
+            self._detach_head()
+
+        moved_users = self._update_cache(users={ref.split("/")[-1] for ref in moved_refs})
+        # reparse every moved user now, since the tree diff against their last state tells what changed
+        for user, (old_commit, new_commit) in moved_users.items():
+            state, changes = self._load_state(user)
+            self.cache.set_state(state, user=user)
+            commits = self._commits_between(old_commit, new_commit) if tracer.enabled else None
+            self._pending_state_changes.put_nowait(
+                StateChangeEvent(user, old_commit, new_commit, changes, commits=commits)
+            )
 
     @atomic_git_action
+    @traced(process=lambda self: self.master_user)
     def _push(self, print_error=False, priority=SchedSpeed.AVERAGE):
         """
         Push local changes to the remote side.
@@ -485,12 +969,29 @@ class Client:
         :return:    None
         """
         self.last_push_attempt_time = datetime.datetime.now(tz=datetime.timezone.utc)
-        self._checkout_to_master_user()
+        if self.adaptive_pull and not self._has_unpushed_commits():
+            return
+
+        if tracer.enabled:
+            refs = self._get_binsync_refs()
+            tracer.add_commits(*self._commits_between(
+                refs.get(f"refs/remotes/{self.remote}/{self.user_branch_name}", None),
+                refs.get(f"refs/heads/{self.user_branch_name}", None)
+            ))
+
         try:
             env = self.ssh_agent_env()
             with self.repo.git.custom_environment(**env):
-                self.repo.remotes[self.remote].push(BINSYNC_ROOT_BRANCH)
-                self.repo.remotes[self.remote].push(self.user_branch_name)
+                push_infos = list(self.repo.remotes[self.remote].push(BINSYNC_ROOT_BRANCH))
+                push_infos += self.repo.remotes[self.remote].push(self.user_branch_name)
+
+            # GitPython reports rejected refs, like a diverged user branch, instead of raising
+            rejected = [info.local_ref.name for info in push_infos if info.flags & git.PushInfo.ERROR]
+            if rejected:
+                l.warning(f"The remote rejected the push of {', '.join(rejected)}")
+                self.active_remote = False
+                return
+
             self._last_push_time = datetime.datetime.now(tz=datetime.timezone.utc)
             #l.debug("Push completed successfully at %s", self._last_push_ts)
             self.active_remote = True
@@ -505,15 +1006,13 @@ class Client:
     def _localize_remote_branches(self):
         """
         Looks up all the remote refrences on the server and attempts to make them a tracked local
-        branch.
+        branch. Branches are created from the remote refs, so nothing is checked out.
 
         @return:
         """
-
-
         # get all remote branches
         try:
-            remote_branches = self.repo.remote().refs
+            remote_branches = self.repo.remote(self.remote).refs
         except ValueError:
             return
 
@@ -525,22 +1024,194 @@ class Client:
                 continue
 
             # attempt to localize the remote name
+            local_name = branch.remote_head
+            # never try to track things already tracked
+            if local_name in local_branches:
+                continue
+
             try:
-                local_name = re.findall(f"({self.remote}/)(.*)", branch.name)[0][1]
-            except IndexError:
-                print("INDEX ERROR")
+                self.repo.create_head(local_name, branch).set_tracking_branch(branch)
+            except (git.GitCommandError, OSError, ValueError) as e:
                 continue
 
-            # never try to track things already tracked
-            if local_name in local_branches:
+    def _fast_forward_branches(self):
+        """
+        Moves every local BinSync branch that is behind its remote branch up to the remote commit. The ref is
+        only updated if it still points to the commit it was compared against. When the branch of the master user
+        diverged from its remote, like when the same user works from two machines, both sides are merged so the
+        next push can land, see _merge_diverged_branch. Other diverged branches are reset to their remote, since
+        only their own user commits to them.
+
+        @return:
+        """
+        refs = self._get_binsync_refs()
+        remote_prefix = f"refs/remotes/{self.remote}/"
+        user_ref = f"refs/heads/{self.user_branch_name}"
+        for remote_ref, remote_sha in refs.items():
+            if not remote_ref.startswith(remote_prefix):
+                continue
+
+            local_ref = "refs/heads/" + remote_ref[len(remote_prefix):]
+            local_sha = refs.get(local_ref, None)
+            if local_sha is None or local_sha == remote_sha:
                 continue
 
             try:
-                self.repo.git.checkout('--track', branch.name)
+                if self.repo.is_ancestor(local_sha, remote_sha):
+                    self.repo.git.update_ref(local_ref, remote_sha, local_sha)
+                elif self.repo.is_ancestor(remote_sha, local_sha):
+                    # the local branch is ahead, and is pushed as it is
+                    continue
+                elif local_ref == user_ref:
+                    self._merge_diverged_branch(local_ref, local_sha, remote_sha)
+                else:
+                    l.warning(f"{local_ref} diverged from its remote branch, resetting it to {remote_sha[:10]}")
+                    self.repo.git.update_ref(local_ref, remote_sha, local_sha)
             except git.GitCommandError as e:
+                l.warning(f"Failed to update {local_ref} to its remote branch: {e}")
+                if local_ref == user_ref:
+                    # pushes fail until the branch is reconciled, which the UI shows as a lost remote
+                    self.active_remote = False
+
+    def _merge_diverged_branch(self, local_ref: str, local_sha: str, remote_sha: str):
+        """
+        Makes a merge commit of a local branch and the remote branch it diverged from, and moves the local branch
+        to it, which the remote branch can then be fast-forwarded to. The trees are merged without a working tree,
+        and files that both sides changed, like metadata.toml, are taken from the local branch, since it holds
+        the master state. When Git can not merge without a working tree, the branch is left diverged and the
+        remote is marked as inactive.
+
+        @param local_ref:   Full name of the local branch ref
+        @param local_sha:   Hexsha of the local branch
+        @param remote_sha:  Hexsha of the remote branch
+        @return:
+        """
+        local_commit = self.repo.commit(local_sha)
+        status, output, _ = self.repo.git.merge_tree(
+            "--write-tree", "--name-only", local_sha, remote_sha, with_extended_output=True, with_exceptions=False
+        )
+        if status not in (0, 1):
+            # Git before 2.38 can not merge without a working tree. A merge commit of only the local tree would
+            # drop the remote changes for good once pushed, so the branch is left diverged instead.
+            l.warning(f"Unable to merge {local_ref} with its diverged remote branch, which needs Git 2.38 or later")
+            self.active_remote = False
+            return
+
+        # the merged tree, then the conflicted files up to the first empty line
+        lines = output.split("\n")
+        tree = self.repo.tree(lines[0])
+        conflicts = []
+        for line in lines[1:] if status == 1 else []:
+            if not line:
+                break
+            conflicts.append(line)
+
+        if conflicts:
+            local_files = self.read_blobs({path: f"{local_commit.tree.hexsha}:{path}" for path in conflicts})
+            files = {path: local_files.get(path, None) for path in conflicts}
+            tree = git.Tree(self.repo, self._write_tree(tree, files))
+
+        commit = git.Commit.create_from_tree(
+            self.repo, tree, f"Merge diverged {local_ref[len('refs/heads/'):]}",
+            parent_commits=[local_commit, self.repo.commit(remote_sha)], head=False
+        )
+        self.repo.git.update_ref(local_ref, commit.hexsha, local_sha)
+        l.info(f"Merged {local_ref} with its diverged remote branch")
+
+    def _commits_between(self, old_commit: Optional[str], new_commit: Optional[str]) -> List[str]:
+        """
+        Gets the hexshas of the commits reachable from new_commit but not from old_commit, newest first.
+        """
+        if new_commit is None:
+            return []
+        if old_commit is None:
+            return [new_commit]
+
+        try:
+            return self.repo.git.rev_list(f"--max-count={MAX_TRACED_COMMITS}", f"{old_commit}..{new_commit}").split()
+        except git.GitCommandError:
+            return [new_commit]
+
+    def _get_binsync_refs(self) -> Dict[str, str]:
+        """
+        Gets every local and remote BinSync branch ref in a single call.
+
+        @return: Dict of full ref name -> commit hexsha
+        """
+        output = self.repo.git.for_each_ref(*self._binsync_refs_args())
+        return self._parse_refs(output)
+
+    def _binsync_refs_args(self) -> List[str]:
+        return [
+            "--format=%(refname) %(objectname)",
+            f"refs/heads/{BINSYNC_BRANCH_PREFIX}/",
+            f"refs/remotes/{self.remote}/{BINSYNC_BRANCH_PREFIX}/",
+        ]
+
+    @staticmethod
+    def _parse_refs(output: str) -> Dict[str, str]:
+        return dict(line.split(" ", 1) for line in output.splitlines() if line)
+
+    #
+    # Adaptive Pulls
+    #
+
+    def next_pull_delay(self, interval: float) -> float:
+        """
+        Gets the seconds to wait between pulls. With adaptive_pull, the interval doubles for every pull in a row
+        that found nothing new on the remote, or could not reach it, up to MAX_PULL_BACKOFF times the interval.
+        A pull that fetched changes, or a commit of the master user, resets it.
+
+        @param interval:    The seconds between pulls while the remote is active
+        @return:
+        """
+        if not self.adaptive_pull:
+            return interval
+
+        return interval * min(2 ** self._idle_pulls, MAX_PULL_BACKOFF)
+
+    def _record_pull(self, fetched: bool):
+        if fetched:
+            self._idle_pulls = 0
+        elif 2 ** self._idle_pulls < MAX_PULL_BACKOFF:
+            self._idle_pulls += 1
+
+    def _ls_remote_args(self) -> List[str]:
+        return [self.remote, f"refs/heads/{BINSYNC_BRANCH_PREFIX}/*"]
+
+    def _remote_refs_moved(self, ls_remote_output: str, refs: Dict[str, str]) -> bool:
+        """
+        Checks if a fetch would get anything, which is when a BinSync branch on the remote is new or does not
+        match its remote-tracking branch. Branches deleted from the remote are never fetched, so they are ignored.
+
+        @param ls_remote_output:    Output of git ls-remote with _ls_remote_args
+        @param refs:                The local BinSync refs, see _get_binsync_refs
+        @return:
+        """
+        for line in ls_remote_output.splitlines():
+            if not line:
                 continue
 
+            remote_sha, remote_ref = line.split("\t", 1)
+            tracking_ref = f"refs/remotes/{self.remote}/" + remote_ref[len("refs/heads/"):]
+            if refs.get(tracking_ref, None) != remote_sha:
+                return True
+
+        return False
 
+    def _has_unpushed_commits(self, refs: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Checks if the root or master user branch does not match its remote-tracking branch, which a push updates.
+
+        @param refs:    The local BinSync refs, see _get_binsync_refs
+        @return:
+        """
+        refs = refs if refs is not None else self._get_binsync_refs()
+        for branch in (BINSYNC_ROOT_BRANCH, self.user_branch_name):
+            if refs.get(f"refs/heads/{branch}", None) != refs.get(f"refs/remotes/{self.remote}/{branch}", None):
+                return True
+
+        return False
 
     def ssh_agent_env(self):
         if self.ssh_agent_pid is not None and self.ssh_auth_sock is not None:
@@ -573,13 +1244,14 @@ class Client:
 
         return repo
 
-    def _checkout_to_master_user(self):
+    def _detach_head(self):
         """
-        Ensure the repo is in the proper branch for current user.
+        Detaches HEAD onto the root commit. Since HEAD never points to a user branch, user branch refs can be
+        moved by commits and pulls without making the working tree stale.
 
-        :return: bool
+        :return:
         """
-        self.repo.git.checkout(self.user_branch_name)
+        self.repo.git.checkout("--detach", BINSYNC_ROOT_BRANCH)
 
     @staticmethod
     def discover_ssh_agent(ssh_agent_cmd):
@@ -627,11 +1299,26 @@ class Client:
         return ssh_agent_pid, ssh_agent_sock
 
     def shutdown(self):
-        if hasattr(self, "repo"):
+        self._store_base_states()
+        if self._state_parse_pool is not None:
+            if self._owns_state_parse_pool:
+                self._state_parse_pool.shutdown(wait=True)
+            self._state_parse_pool = None
+
+        if self._parse_process_pool is not None:
+            self._parse_process_pool.shutdown(wait=True)
+            self._parse_process_pool = None
+
+        if self.blob_reader is not None:
+            self.blob_reader.close()
+
+        # the repo is None if opening it failed
+        if getattr(self, "repo", None) is not None:
             self.repo.close()
             del self.repo
 
-        self.scheduler.stop_worker_thread()
+        if self._owns_scheduler:
+            self.scheduler.stop_worker_thread()
 
         if self.repo_lock is not None:
             self.repo_lock.release()
@@ -640,6 +1327,31 @@ class Client:
                 self._repo_lock_path.unlink(missing_ok=True)
 
 
+    def _store_base_states(self):
+        """
+        Caches the last state parsed for every user on disk, so the next session starts from where this one
+        left off, even for branches that were only incrementally parsed. Fully parsed states are already cached
+        when they are parsed, so only incrementally parsed ones are written here, for up to
+        DISK_CACHE_SHUTDOWN_BUDGET seconds, so closing the decompiler is never held up for long.
+        """
+        if self.disk_cache is None:
+            return
+
+        deadline = time.perf_counter() + DISK_CACHE_SHUTDOWN_BUDGET
+        base_states = self.cache.base_states()
+        for i, (user, (state, tree)) in enumerate(base_states.items()):
+            if time.perf_counter() >= deadline:
+                l.info(f"Skipped caching {len(base_states) - i} states on disk to not delay the shutdown")
+                break
+
+            try:
+                self.disk_cache.store(tree, state)
+            except Exception as e:
+                l.warning(f"Unable to cache the state of {user} on disk: {e}")
+
+        # only store states once, since shutdown may run more than once
+        self.disk_cache = None
+
     def _get_best_refs(self, repo, force_local=False):
         candidates = {}
         for ref in repo.refs:  # type: git.Reference
@@ -669,17 +1381,112 @@ class Client:
 
         :param commit: A gitpython Tree object
         """
-        file_list = []
-        stack = [base_tree]
-        while len(stack) > 0:
-            tree = stack.pop()
-            # enumerate blobs (files) at this level
-            for b in tree.blobs:
-                file_list.append(b.path)
-            for subtree in tree.trees:
-                stack.append(subtree)
+        return list(self.list_blobs_in_tree(base_tree))
+
+    def list_blobs_in_tree(self, tree: git.Tree) -> Dict[str, str]:
+        """
+        Lists all the files in a tree, recursively, with their blob hexshas.
+
+        @param tree:    A gitpython Tree object
+        @return:        Dict of path -> blob hexsha
+        """
+        return self.blob_reader.list_tree(tree.hexsha)
 
-        return file_list
+    def read_blobs(self, path_to_object: Dict[str, str]) -> Dict[str, bytes]:
+        """
+        Reads many objects in a single batch.
+
+        @param path_to_object:  Dict of path -> object name, like a blob hexsha or "<tree-hexsha>:<path>"
+        @return:                Dict of path -> object bytes, for every object that exists
+        """
+        objects = self.blob_reader.read_many(path_to_object.values())
+        return {
+            path: objects[name]
+            for path, name in path_to_object.items() if objects[name] is not None
+        }
+
+    def load_files_from_tree(self, tree: git.Tree, filenames: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Loads many files from a tree in a single batch.
+
+        @param tree:        A gitpython Tree object
+        @param filenames:   Paths of the files to load, or None to load every file in the tree
+        @return:            Dict of path -> file contents, for every file that exists in the tree
+        """
+        if filenames is None:
+            # identical files share a blob, so request each blob once
+            path_to_object = self.list_blobs_in_tree(tree)
+        else:
+            path_to_object = {path: f"{tree.hexsha}:{path}" for path in filenames}
+
+        return {path: data.decode() for path, data in self.read_blobs(path_to_object).items()}
+
+    def _commit_files(self, branch_name: str, files: Dict[str, Optional[bytes]], msg: str) -> Optional[git.Commit]:
+        """
+        Commits files on top of a branch without a checkout or any writes to the working tree. Blobs and trees
+        are written straight into the object database, and then the branch ref is moved to the new commit.
+        Only the trees on the paths to changed files are rewritten.
+
+        @param branch_name: Name of the local branch to commit to
+        @param files:       Dict of file path -> file bytes, where None marks a removed file
+        @param msg:         Commit message
+        @return:            The new commit, or None if the files caused no changes
+        """
+        branch = next(o for o in self.repo.branches if o.name == branch_name)
+        parent = branch.commit
+        tree_sha = self._write_tree(parent.tree, files)
+        if tree_sha == parent.tree.binsha:
+            return None
+
+        tree = git.Tree(self.repo, tree_sha)
+        commit = git.Commit.create_from_tree(self.repo, tree, msg, parent_commits=[parent], head=False)
+        branch.commit = commit
+        return commit
+
+    def _write_tree(self, tree: Optional[git.Tree], files: Dict[str, Optional[bytes]]) -> Optional[bytes]:
+        """
+        Writes a copy of tree, with files applied, into the object database.
+
+        @param tree:    A gitpython Tree object, or None for a new tree
+        @param files:   Dict of file path (relative to the tree) -> file bytes, where None marks a removed file
+        @return:        The binsha of the new tree, or None if the new tree would be empty
+        """
+        entries = {name: (binsha, mode) for binsha, mode, name in tree._cache} if tree is not None else {}
+        subtree_files = defaultdict(dict)
+        for path, data in files.items():
+            name, _, sub_path = path.partition("/")
+            if sub_path:
+                subtree_files[name][sub_path] = data
+            elif data is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = (self._store_object(git.Blob.type, data), git.Blob.file_mode)
+
+        for name, sub_files in subtree_files.items():
+            subtree = None
+            if name in entries and entries[name][1] == git.Tree.tree_id << 12:
+                subtree = git.Tree(self.repo, entries[name][0], path=name)
+
+            subtree_sha = self._write_tree(subtree, sub_files)
+            if subtree_sha is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = (subtree_sha, git.Tree.tree_id << 12)
+
+        if not entries:
+            return None
+
+        # git orders tree entries by name, with a trailing slash on the names of subtrees
+        sorted_entries = sorted(
+            ((binsha, mode, name) for name, (binsha, mode) in entries.items()),
+            key=lambda e: (e[2] + "/" if e[1] == git.Tree.tree_id << 12 else e[2]).encode()
+        )
+        stream = BytesIO()
+        tree_to_stream(sorted_entries, stream.write)
+        return self._store_object(git.Tree.type, stream.getvalue())
+
+    def _store_object(self, obj_type: str, data: bytes) -> bytes:
+        return self.object_writer.store(IStream(obj_type, len(data), BytesIO(data))).binsha
 
     def add_data(self, index: git.IndexFile, path: str, data: bytes):
         """
@@ -701,15 +1508,41 @@ class Client:
         index.add([fullpath])
 
     def remove_data(self, index: git.IndexFile, path: str):
+        # artifacts deleted before they were ever committed have nothing to remove
+        if (str(pathlib.PurePosixPath(path)), 0) not in index.entries:
+            return
+
         fullpath = os.path.join(os.path.dirname(index.repo.git_dir), path)
         pathlib.Path(fullpath).parent.mkdir(parents=True, exist_ok=True)
         index.remove([fullpath], working_tree=True)
 
+    def diff_trees(self, old_tree: git.Tree, new_tree: git.Tree):
+        """
+        Finds the files whose blobs differ between two trees. Git compares the trees by object id, so
+        unchanged subtrees are never walked.
+
+        @param old_tree:    A gitpython Tree object
+        @param new_tree:    A gitpython Tree object
+        @return:            A tuple of (set of added or modified paths, set of deleted paths)
+        """
+        changed, deleted = set(), set()
+        if old_tree.binsha == new_tree.binsha:
+            return changed, deleted
+
+        for diff in old_tree.diff(new_tree):
+            if diff.change_type == "D":
+                deleted.add(diff.a_path)
+                continue
+
+            if diff.change_type == "R":
+                deleted.add(diff.a_path)
+            changed.add(diff.b_path)
+
+        return changed, deleted
+
     def load_file_from_tree(self, tree: git.Tree, filename):
-        try:
-            return tree[filename].data_stream.read().decode()
-        except KeyError:
-            return None
+        data = self.blob_reader.read(f"{tree.hexsha}:{filename}")
+        return data.decode() if data is not None else None
 
     def _get_tree(self, user, repo: git.Repo):
         options = [ref for ref in repo.refs if ref.name.endswith(f"{BINSYNC_BRANCH_PREFIX}/{user}")]
@@ -769,14 +1602,29 @@ class Client:
 
         set_func(ret_value, *args, **kwargs)
 
-    def _update_cache(self):
+    @traced(process=lambda self: self.master_user)
+    def _update_cache(self, users=None):
+        """
+        Drops the cached states of users whose branch moved, and refreshes the known user branches.
+
+        @param users:   Names of the users whose branches moved, or None to check every user
+        @return:        Dict of username -> (old commit, new commit) for every user whose state was dropped
+        """
         #l.debug(f"Updating cache commits for State Cache...")
-        cache_dict = self._get_commits_for_users(git.Repo(self.repo_root))
-        self.cache.clear_state_cache(cache_dict)
+        cache_dict = self._get_commits_for_users(self.repo)
+        if users is not None:
+            moved_users = self.cache.clear_state_cache({user: commit for user, commit in cache_dict.items() if user in users})
+        else:
+            moved_users = self.cache.clear_state_cache(cache_dict)
 
         cache_keys = [key for key in cache_dict.keys()]
         #l.debug(f"Updating branches on Users Cache...")
         branch_set = set(cache_keys)
         self.cache.clear_user_branch_cache(branch_set)
+        if tracer.enabled:
+            for old_commit, new_commit in moved_users.values():
+                tracer.add_commits(*self._commits_between(old_commit, new_commit))
+
+        return moved_users
 
 
@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import git
+
+from binsync.core.snapshot import dump_snapshot, load_snapshot
+from binsync.core.state import State
+
+l = logging.getLogger(__name__)
+
+
+class StateDiskCache:
+    """
+    Keeps parsed States on disk between sessions, so reopening a project does not reparse the branch of every
+    user. Each entry is a snapshot (see binsync.core.snapshot) of the State parsed from a Git tree, named and
+    validated by the hexsha of that tree. Trees are immutable, so an entry can never go stale; it just stops
+    being used once its branch moves.
+
+    Entries are evicted least recently used first once they take up more than max_size bytes. Loading an entry
+    touches its modification time, which is what recency is tracked by.
+    """
+    ENTRY_SUFFIX = ".snapshot"
+
+    def __init__(self, cache_dir, max_size: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self._evict_lock = threading.Lock()
+
+    def _entry_path(self, tree: git.Tree) -> Path:
+        return self.cache_dir / f"{tree.hexsha}{self.ENTRY_SUFFIX}"
+
+    def load(self, tree: git.Tree, client=None) -> Optional[State]:
+        """
+        Loads the State parsed from a Git tree, if it is cached.
+
+        @param tree:    The Git tree the State was parsed from
+        @param client:  Client used to read the metadata of the tree
+        @return:        The State, or None if it is not cached
+        """
+        path = self._entry_path(tree)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+
+        artifact_dicts = load_snapshot(data, tree.hexsha)
+        if artifact_dicts is None:
+            # made by an incompatible version, so it will never load
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        # metadata is small and always read from the tree, just like for a snapshot in the tree
+        return State.from_artifact_dicts(artifact_dicts, tree, client=client)
+
+    def store(self, tree: git.Tree, state: State):
+        """
+        Caches the State parsed from a Git tree, then evicts the least recently used entries over the budget.
+        """
+        path = self._entry_path(tree)
+        if path.exists():
+            return
+
+        try:
+            data = dump_snapshot(state.artifact_dicts(), tree.hexsha)
+        except TypeError as e:
+            l.warning(f"Unable to cache the state of {tree.hexsha}: {e}")
+            return
+
+        if len(data) > self.max_size:
+            return
+
+        # entries are written whole and then renamed, so a concurrent load never sees a partial entry
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            l.warning(f"Unable to cache the state of {tree.hexsha}: {e}")
+            self._remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_size.
+        """
+        with self._evict_lock:
+            entries = []
+            try:
+                with os.scandir(self.cache_dir) as it:
+                    for entry in it:
+                        if not entry.name.endswith(self.ENTRY_SUFFIX):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                return
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+
+                self._remove(Path(path))
+                total_size -= size
+
+    @staticmethod
+    def _remove(path: Path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,264 @@
+import bisect
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# upper bounds of the default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# upper bounds of the buckets of histograms that count things, like artifacts or commits
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Metric:
+    """
+    A named value, kept separately for every combination of values of its labels.
+    """
+    TYPE = None
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # type: Dict[Tuple, object]
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        if len(labels) != len(self.labels) or any(label not in labels for label in self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}, not {tuple(labels)}")
+
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> List[Tuple[Dict[str, str], object]]:
+        """
+        Gets the value of every combination of labels that was recorded.
+
+        @return: List of (labels, value)
+        """
+        with self._lock:
+            return [(dict(zip(self.labels, key)), self._copy_value(value)) for key, value in self._values.items()]
+
+    @staticmethod
+    def _copy_value(value):
+        return value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, like the number of cache hits.
+    """
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, like the number of queued jobs.
+    """
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class _HistogramValue:
+    __slots__ = ("bucket_counts", "count", "sum")
+
+    def __init__(self, n_buckets: int):
+        self.bucket_counts = [0] * n_buckets
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    """
+    Counts observed values, like durations, in buckets by their size. Each bucket counts the values up to its
+    upper bound that are above the bound of the previous bucket.
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels=labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            hist = self._values.get(key, None)
+            if hist is None:
+                hist = self._values[key] = _HistogramValue(len(self.buckets))
+
+            hist.bucket_counts[index] += 1
+            hist.count += 1
+            hist.sum += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the seconds the body of the with statement took.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def value(self, **labels) -> Dict:
+        with self._lock:
+            hist = self._values.get(self._key(labels), None)
+            return self._copy_value(hist) if hist is not None else {"count": 0, "sum": 0.0, "buckets": {}}
+
+    def _copy_value(self, hist: _HistogramValue) -> Dict:
+        return {
+            "count": hist.count,
+            "sum": hist.sum,
+            "buckets": {_format_bound(bound): count for bound, count in zip(self.buckets, hist.bucket_counts)},
+        }
+
+
+class MetricsRegistry:
+    """
+    Holds every metric by name. Metrics are made on first use, so instrumented code just asks the registry for
+    them, and gets the same metric every time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # type: Dict[str, Metric]
+
+    def _get_or_make(self, metric_cls, name, description, labels, **kwargs) -> Metric:
+        metric = self._metrics.get(name, None)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name, None)
+                if metric is None:
+                    metric = self._metrics[name] = metric_cls(name, description, labels=labels, **kwargs)
+
+        if not isinstance(metric, metric_cls):
+            raise ValueError(f"{name} is already a {metric.TYPE}")
+
+        return metric
+
+    def counter(self, name: str, description: str = "", labels: Iterable[str] = ()) -> Counter:
+        return self._get_or_make(Counter, name, description, labels)
+
+    def gauge(self, name: str, description: str = "", labels: Iterable[str] = ()) -> Gauge:
+        return self._get_or_make(Gauge, name, description, labels)
+
+    def histogram(self, name: str, description: str = "", labels: Iterable[str] = (),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_make(Histogram, name, description, labels, buckets=buckets)
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name, None)
+
+    def metrics(self) -> List[Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def reset(self):
+        """
+        Clears the recorded values of every metric.
+        """
+        for metric in self.metrics():
+            metric.reset()
+
+    def collect(self) -> Dict[str, Dict]:
+        """
+        Gets every metric as plain data.
+
+        @return: Dict of metric name -> {"type", "description", "samples": [{"labels", "value"}]}
+        """
+        return {
+            metric.name: {
+                "type": metric.TYPE,
+                "description": metric.description,
+                "samples": [{"labels": labels, "value": value} for labels, value in metric.samples()],
+            }
+            for metric in self.metrics()
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.collect(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """
+        Gets every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics():
+            if metric.description:
+                lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for labels, value in metric.samples():
+                if metric.TYPE != Histogram.TYPE:
+                    lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+                    continue
+
+                # prometheus buckets are cumulative
+                cumulative = 0
+                for bound, count in value["buckets"].items():
+                    cumulative += count
+                    lines.append(f"{metric.name}_bucket{_format_labels(dict(labels, le=bound))} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{metric.name}_count{_format_labels(labels)} {value['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes every metric to a file, in the Prometheus text format if the file ends in .prom or .txt, or as
+        JSON otherwise.
+        """
+        path = Path(path)
+        data = self.to_prometheus() if path.suffix in (".prom", ".txt") else self.to_json()
+        path.write_text(data)
+
+
+def _format_bound(bound) -> str:
+    return "+Inf" if bound == math.inf else repr(bound)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+# the registry every part of BinSync records its metrics in
+registry = MetricsRegistry()
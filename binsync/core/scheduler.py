@@ -1,16 +1,38 @@
+import heapq
+import itertools
 import threading
 import logging
-from queue import PriorityQueue
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
 from threading import Thread
+from typing import Dict, Optional
+
+from binsync.core.metrics import registry
 
 _l = logging.getLogger(__name__)
 
+_QUEUE_DEPTH = registry.gauge(
+    "binsync_scheduler_queue_depth", "Jobs waiting to run, by scheduler and priority", labels=("scheduler", "priority")
+)
+_QUEUE_WAIT = registry.histogram(
+    "binsync_job_queue_wait_seconds", "Seconds jobs waited to run, by scheduler and function",
+    labels=("scheduler", "function")
+)
+_RUN_TIME = registry.histogram(
+    "binsync_job_run_seconds", "Seconds jobs took to run, by scheduler and function", labels=("scheduler", "function")
+)
+
 
 class SchedSpeed:
     FAST = 1
     AVERAGE = 2
     SLOW = 3
 
+    @staticmethod
+    def name(priority) -> str:
+        return {SchedSpeed.FAST: "FAST", SchedSpeed.AVERAGE: "AVERAGE", SchedSpeed.SLOW: "SLOW"}.get(priority, str(priority))
+
 
 class FailedJob:
     def __init__(self, reason):
@@ -26,14 +48,60 @@ class Job:
         self.ret_value = None
         self.exception = None
         self.finish_event = threading.Event()
+        # resolved with the result of the job, or cancelled to abandon the job before it runs
+        self.future = Future()
+        # identical jobs that were coalesced into this one, and finish with it
+        self._followers = []
+        self._leader = None  # type: Optional[Job]
+        self._queued = None  # type: Optional[_QueuedJob]
+        self.queued_time = None  # type: Optional[float]
 
     def execute(self):
+        jobs = [self] + self._followers
+        # a coalesced job still runs as long as any of the jobs merged into it wants the result
+        running_jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+        if not running_jobs:
+            for job in jobs:
+                job.finish_event.set()
+            return
+
         try:
-            self.ret_value = self.function(*self.args, **self.kwargs)
+            ret_value = self.function(*self.args, **self.kwargs)
         except Exception as e:
-            self.exception = e
+            for job in running_jobs:
+                job.exception = e
+                job.future.set_exception(e)
+        else:
+            for job in running_jobs:
+                job.ret_value = ret_value
+                job.future.set_result(ret_value)
         finally:
-            self.finish_event.set()
+            for job in jobs:
+                job.finish_event.set()
+
+    def cancel(self) -> bool:
+        """
+        Abandons the job if it has not started running.
+
+        @return: True if the job will never run
+        """
+        return self.future.cancel()
+
+    @property
+    def function_name(self) -> str:
+        return getattr(self.function, "__name__", type(self.function).__name__)
+
+    def coalesce_key(self):
+        """
+        Gets the key identical jobs share, or None if the arguments of the job can not be compared.
+        """
+        try:
+            key = (self.function, self.args, tuple(sorted(self.kwargs.items())))
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
 
     def __str__(self):
         return f"<Job: {self.function}({self.args}, {self.kwargs})>"
@@ -41,20 +109,73 @@ class Job:
     def __repr__(self):
         return self.__str__()
 
-    def __lt__(self, other):
-        return True
+
+class _QueuedJob:
+    __slots__ = ("job", "priority", "seq", "deadline", "key", "cancelled")
+
+    def __init__(self, job: Job, priority, seq: int, deadline: float, key=None):
+        self.job = job
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.key = key
+        # set once the job is taken off the queue, or replaced by an entry with a higher priority
+        self.cancelled = False
+
+    def __lt__(self, other: "_QueuedJob"):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
 
 
 class Scheduler:
-    def __init__(self, sleep_interval=0.05, name="Scheduler"):
+    """
+    Runs jobs one at a time on a worker thread. Jobs run in order of priority (lower SchedSpeed first), and in
+    the order they were scheduled within a priority. Every job also has a deadline, which is at most
+    starvation_timeout seconds after it was scheduled; a job past its deadline runs before any job that is not,
+    so a steady stream of FAST jobs can never postpone a SLOW job forever.
+    """
+    def __init__(self, sleep_interval=0.05, name="Scheduler", starvation_timeout=10.0):
         self.sleep_interval = sleep_interval
         self.name = name
+        self.starvation_timeout = starvation_timeout
         self._worker = Thread(target=self._worker_thread)
-        self._job_queue = PriorityQueue()
         self._work = False
 
+        self._queue_cond = threading.Condition()
+        self._queues: Dict[int, deque] = {}
+        self._deadlines = []  # heap of _QueuedJob ordered by deadline
+        self._coalescable: Dict[tuple, _QueuedJob] = {}
+        self._job_count = 0
+        self._seq = itertools.count()
+        self._stopped = False
+
     def stop_worker_thread(self):
-        self._work = False
+        """
+        Stops the worker after the job it is running, and cancels every job still waiting, so nothing waits on
+        a job that will never run. Jobs scheduled after the stop are cancelled right away.
+        """
+        with self._queue_cond:
+            self._work = False
+            self._stopped = True
+            pending = []
+            for jobs in self._queues.values():
+                for queued in jobs:
+                    if queued.cancelled:
+                        continue
+                    queued.cancelled = True
+                    self._count_queued(queued.priority, -1)
+                    pending += [queued.job] + queued.job._followers
+                jobs.clear()
+            self._deadlines.clear()
+            self._coalescable.clear()
+            self._queue_cond.notify_all()
+
+        for job in pending:
+            self._cancel_pending(job)
+
+    @staticmethod
+    def _cancel_pending(job: Job):
+        job.cancel()
+        job.finish_event.set()
 
     def start_worker_thread(self):
         self._work = True
@@ -65,33 +186,156 @@ class Scheduler:
         while self._work:
             self._complete_a_job(block=True)
 
-    def schedule_job(self, job: Job, priority=SchedSpeed.SLOW):
+    def empty(self):
+        """
+        If there are no jobs waiting to run. A job that is running is not waiting.
+        """
+        with self._queue_cond:
+            return self._job_count == 0
+
+    def schedule_job(self, job: Job, priority=SchedSpeed.SLOW, deadline: Optional[float] = None,
+                     coalesce=False) -> Future:
+        """
+        Queues a job to run on the worker thread.
+
+        @param job:         The job to run
+        @param priority:    A SchedSpeed, jobs of lower value run first
+        @param deadline:    Seconds from now after which the job runs ahead of jobs that are not past their
+                            deadline, if sooner than starvation_timeout
+        @param coalesce:    Merge the job into an identical job that has not run yet (same function and arguments),
+                            so the function runs once and both jobs finish with its result
+        @return:            The future of the job, which can be waited on, given callbacks, or cancelled
+        """
         if not self._work:
             _l.warning("%s is not currently set to work, but you are still scheduling a job...", self.name)
 
-        self._job_queue.put_nowait(
-            (priority, job,)
-        )
+        now = time.monotonic()
+        job_deadline = now + self.starvation_timeout
+        if deadline is not None:
+            job_deadline = min(job_deadline, now + deadline)
+
+        job.queued_time = now
+        key = job.coalesce_key() if coalesce else None
+        with self._queue_cond:
+            if self._stopped:
+                _l.debug("%s was stopped, cancelling %s", self.name, job)
+                self._cancel_pending(job)
+                return job.future
+
+            queued = self._coalescable.get(key, None) if key is not None else None
+            if queued is not None:
+                queued.job._followers.append(job)
+                job._leader = queued.job
+                job.future.add_done_callback(lambda _: self._drop_cancelled(job))
+                if priority >= queued.priority and job_deadline >= queued.deadline:
+                    return job.future
+
+                # requeue the pending job with the more urgent of the two priorities and deadlines
+                queued.cancelled = True
+                self._count_queued(queued.priority, -1)
+                self._enqueue(queued.job, min(priority, queued.priority), min(job_deadline, queued.deadline), key)
+                return job.future
+
+            self._enqueue(job, priority, job_deadline, key)
+            job.future.add_done_callback(lambda _: self._drop_cancelled(job))
+
+        return job.future
+
+    def _enqueue(self, job: Job, priority, deadline: float, key):
+        # must be called with the queue lock held
+        queued = _QueuedJob(job, priority, next(self._seq), deadline, key=key)
+        job._queued = queued
+        self._queues.setdefault(priority, deque()).append(queued)
+        heapq.heappush(self._deadlines, queued)
+        if key is not None:
+            self._coalescable[key] = queued
+
+        self._count_queued(priority, 1)
+        self._queue_cond.notify()
+
+    def _count_queued(self, priority, delta: int):
+        # must be called with the queue lock held
+        self._job_count += delta
+        _QUEUE_DEPTH.inc(delta, scheduler=self.name, priority=SchedSpeed.name(priority))
+
+    def _drop_cancelled(self, job: Job):
+        """
+        Takes a job off the queue once it and every job coalesced into it were cancelled, so abandoned work
+        never waits in line or counts as pending.
+        """
+        leader = job._leader or job
+        with self._queue_cond:
+            queued = leader._queued
+            if queued is None or queued.cancelled:
+                return
 
-    def schedule_and_wait_job(self, job: Job, priority=SchedSpeed.SLOW, timeout=30):
-        self.schedule_job(job, priority=priority)
+            if not all(j.future.cancelled() for j in [leader] + leader._followers):
+                return
+
+            queued.cancelled = True
+            self._count_queued(queued.priority, -1)
+            if queued.key is not None and self._coalescable.get(queued.key, None) is queued:
+                del self._coalescable[queued.key]
+
+    def schedule_and_wait_job(self, job: Job, priority=SchedSpeed.SLOW, timeout=30, coalesce=False):
+        """
+        Queues a job and waits for its result, see schedule_job.
+
+        @param timeout: Seconds to wait for the result, or None to wait until the job is done
+        @return:        The return value of the job
+        @raises TimeoutError: When the job did not finish in time. A job that has not started by then is
+                              cancelled, so it never runs for a caller that stopped waiting.
+        """
+        future = self.schedule_job(job, priority=priority, coalesce=coalesce)
         try:
-            job.finish_event.wait(timeout=timeout)
-        except Exception as e:
-            return FailedJob(e)
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            if job.cancel():
+                _l.warning("%s: gave up on %s after waiting %s seconds for it to start", self.name, job, timeout)
+            raise
+
+    def _next_job(self) -> Optional[Job]:
+        # must be called with the queue lock held
+        if not self._job_count:
+            return None
+
+        queued = None
+        while self._deadlines and self._deadlines[0].cancelled:
+            heapq.heappop(self._deadlines)
+        if self._deadlines and self._deadlines[0].deadline <= time.monotonic():
+            queued = heapq.heappop(self._deadlines)
         else:
-            if job.exception is None:
-                return job.ret_value
-            else:
-                raise job.exception
+            for priority in sorted(self._queues):
+                jobs = self._queues[priority]
+                while jobs and jobs[0].cancelled:
+                    jobs.popleft()
+                if jobs:
+                    queued = jobs.popleft()
+                    break
+
+        # entries left in the other structure are cancelled, and dropped when they reach the front
+        queued.cancelled = True
+        self._count_queued(queued.priority, -1)
+        if queued.key is not None and self._coalescable.get(queued.key, None) is queued:
+            del self._coalescable[queued.key]
+
+        return queued.job
 
     def _complete_a_job(self, block=False):
-        if block:
-            _, job = self._job_queue.get()
-        elif self._job_queue.not_empty:
-            _, job = self._job_queue.get_nowait()
-        else:
+        with self._queue_cond:
+            job = self._next_job()
+            # wake up once in a while when blocking, so a stopped worker exits
+            while job is None and block and self._work:
+                self._queue_cond.wait(timeout=self.sleep_interval)
+                job = self._next_job()
+
+        if job is None:
             return
 
         _l.debug("%s: completing scheduled job now: %s", self.name, job)
+        start_time = time.monotonic()
+        function_name = job.function_name
+        if job.queued_time is not None:
+            _QUEUE_WAIT.observe(start_time - job.queued_time, scheduler=self.name, function=function_name)
         job.execute()
+        _RUN_TIME.observe(time.monotonic() - start_time, scheduler=self.name, function=function_name)
@@ -0,0 +1,224 @@
+"""
+A compact, length-prefixed snapshot of every artifact in a State, which can be loaded much faster than
+parsing each TOML file. The TOML files stay the source of truth: a snapshot records a digest of the
+artifact files it was made from, and is only used when that digest matches the files it sits next to.
+
+Layout:
+    MAGIC | version (u16) | record | record | ...
+where every record is a u32 length followed by that many bytes of UTF-8 JSON. The first record is a header,
+and every following record holds one artifact dict of the State. Artifacts are rebuilt from a fixed set of
+libbs classes, so loading a snapshot from another user's branch never runs arbitrary code.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import struct
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import libbs
+from libbs.artifacts import (
+    Comment,
+    Enum,
+    Function,
+    FunctionArgument,
+    FunctionHeader,
+    GlobalVariable,
+    Patch,
+    StackVariable,
+    Struct,
+    StructMember,
+)
+
+l = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = "state.snapshot"
+SNAPSHOT_MAGIC = b"BSSNAP"
+SNAPSHOT_VERSION = 1
+
+_LENGTH = struct.Struct(">I")
+_VERSION = struct.Struct(">H")
+
+SNAPSHOT_CLASSES = {
+    cls.__name__: cls for cls in (
+        Comment, Enum, Function, FunctionArgument, FunctionHeader, GlobalVariable, Patch, StackVariable,
+        Struct, StructMember,
+    )
+}
+# slots that hold live decompiler objects, which are never stored
+_SKIPPED_SLOTS = {"dec_obj"}
+
+
+def _artifact_slots(cls):
+    slots = []
+    for klass in reversed(cls.__mro__):
+        for slot in getattr(klass, "__slots__", ()):
+            if slot not in slots and slot not in _SKIPPED_SLOTS:
+                slots.append(slot)
+
+    return slots
+
+
+_CLASS_SLOTS = {name: _artifact_slots(cls) for name, cls in SNAPSHOT_CLASSES.items()}
+
+
+def git_blob_sha(data: bytes) -> str:
+    """
+    Computes the hexsha Git would give a blob of data, without writing it anywhere.
+    """
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def snapshot_digest(file_shas: Dict[str, str]) -> str:
+    """
+    Computes the digest of a set of files, which a snapshot must match to be loaded.
+
+    @param file_shas:   Dict of file path -> blob hexsha, for every file the snapshot covers
+    @return:            Hex digest
+    """
+    digest = hashlib.sha256()
+    for path in sorted(file_shas):
+        digest.update(f"{path}\0{file_shas[path]}\n".encode())
+
+    return digest.hexdigest()
+
+
+#
+# Encoding
+#
+
+def _encode(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, OrderedDict):
+        return {"$o": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    elif isinstance(value, dict):
+        return {"$d": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    elif isinstance(value, datetime.datetime):
+        return {"$t": value.isoformat()}
+    elif isinstance(value, bytes):
+        return {"$b": value.hex()}
+    elif isinstance(value, (list, tuple)):
+        return {"$l": [_encode(v) for v in value]}
+
+    cls_name = type(value).__name__
+    if SNAPSHOT_CLASSES.get(cls_name, None) is type(value):
+        return {"$a": cls_name, "v": [_encode(getattr(value, slot, None)) for slot in _CLASS_SLOTS[cls_name]]}
+
+    raise TypeError(f"Unable to store {type(value)} in a snapshot")
+
+
+def _decode_object(obj: dict):
+    if "$a" in obj:
+        cls = SNAPSHOT_CLASSES[obj["$a"]]
+        # artifacts are rebuilt slot by slot, since their constructors and loaders are much slower
+        artifact = cls.__new__(cls)
+        for slot, value in zip(_CLASS_SLOTS[obj["$a"]], obj["v"]):
+            setattr(artifact, slot, value)
+        for slot in _SKIPPED_SLOTS.intersection(getattr(cls, "__slots__", ())):
+            setattr(artifact, slot, None)
+        return artifact
+    elif "$d" in obj:
+        return {k: v for k, v in obj["$d"]}
+    elif "$o" in obj:
+        return OrderedDict((k, v) for k, v in obj["$o"])
+    elif "$t" in obj:
+        return datetime.datetime.fromisoformat(obj["$t"])
+    elif "$b" in obj:
+        return bytes.fromhex(obj["$b"])
+    elif "$l" in obj:
+        return obj["$l"]
+
+    return obj
+
+
+def _record(obj) -> bytes:
+    payload = json.dumps(obj, separators=(",", ":")).encode()
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def encode_artifacts(obj) -> bytes:
+    """
+    Serializes artifacts, or containers of them, in the snapshot encoding. This is also how artifacts are sent
+    between processes, since it is much faster to load than a pickle of them.
+    """
+    return json.dumps(_encode(obj), separators=(",", ":")).encode()
+
+
+def decode_artifacts(data: bytes):
+    """
+    Loads artifacts serialized with encode_artifacts.
+    """
+    return json.loads(data, object_hook=_decode_object)
+
+
+def dump_snapshot(artifact_dicts: Dict[str, Dict], digest: str) -> bytes:
+    """
+    Serializes artifact dicts into a snapshot.
+
+    @param artifact_dicts:  Dict of artifact dict name (like "functions") -> dict of key -> artifact
+    @param digest:          Digest of the artifact files the artifacts were dumped to, see snapshot_digest
+    @return:                The snapshot bytes
+    """
+    header = {
+        "digest": digest,
+        "libbs_version": libbs.__version__,
+        "slots": _CLASS_SLOTS,
+        "records": list(artifact_dicts),
+    }
+    records = [_record(header)] + [_record(_encode(dict(artifacts))) for artifacts in artifact_dicts.values()]
+    return SNAPSHOT_MAGIC + _VERSION.pack(SNAPSHOT_VERSION) + b"".join(records)
+
+
+def _read_records(data: bytes):
+    offset = len(SNAPSHOT_MAGIC) + _VERSION.size
+    while offset < len(data):
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        if offset + length > len(data):
+            raise ValueError("truncated record")
+
+        yield data[offset:offset + length]
+        offset += length
+
+
+def load_snapshot(data: bytes, digest: str) -> Optional[Dict[str, Dict]]:
+    """
+    Loads the artifact dicts of a snapshot, if the snapshot was made from files with the expected digest.
+
+    @param data:    The snapshot bytes
+    @param digest:  Digest of the artifact files the snapshot sits next to, see snapshot_digest
+    @return:        Dict of artifact dict name -> dict of key -> artifact, or None if the snapshot is
+                    stale, unreadable, or was made by an incompatible version
+    """
+    if not data.startswith(SNAPSHOT_MAGIC):
+        return None
+
+    version, = _VERSION.unpack_from(data, len(SNAPSHOT_MAGIC))
+    if version != SNAPSHOT_VERSION:
+        return None
+
+    try:
+        records = _read_records(data)
+        header = json.loads(next(records))
+        if header.get("digest", None) != digest:
+            return None
+
+        # artifacts are stored slot by slot, so any difference in the artifact layout invalidates the snapshot
+        if header.get("libbs_version", None) != libbs.__version__ or header.get("slots", None) != _CLASS_SLOTS:
+            return None
+
+        artifact_dicts = {
+            name: json.loads(record, object_hook=_decode_object)
+            for name, record in zip(header["records"], records)
+        }
+    except (ValueError, KeyError, TypeError, StopIteration, struct.error) as e:
+        l.warning(f"Ignoring a corrupted state snapshot: {e}")
+        return None
+
+    if len(artifact_dicts) != len(header["records"]):
+        l.warning("Ignoring a truncated state snapshot")
+        return None
+
+    return artifact_dicts
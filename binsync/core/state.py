@@ -2,8 +2,11 @@ import logging
 import os
 import pathlib
 import datetime
+import time
+from collections import defaultdict
+from concurrent.futures import BrokenExecutor, Executor
 from functools import wraps
-from typing import Dict, Optional, Union, List
+from typing import Dict, Optional, Union, List, Set, Tuple
 
 import git
 import toml
@@ -23,6 +26,10 @@ from libbs.artifacts import (
 from libbs.artifacts import TomlHexEncoder
 from binsync import __version__ as BS_VERS
 from binsync.core.errors import MetadataNotFoundError
+from binsync.core.metrics import COUNT_BUCKETS, registry
+from binsync.core.snapshot import (
+    SNAPSHOT_FILENAME, decode_artifacts, dump_snapshot, encode_artifacts, git_blob_sha, load_snapshot, snapshot_digest
+)
 
 
 l = logging.getLogger(__name__)
@@ -38,16 +45,60 @@ class ArtifactType:
     ENUM = "enum"
 
 
+# files that hold every artifact of a type in a single file
+AGGREGATE_ARTIFACT_FILES = {
+    "comments.toml": ArtifactType.COMMENT,
+    "patches.toml": ArtifactType.PATCH,
+    "global_vars.toml": ArtifactType.GLOBAL_VAR,
+    "enums.toml": ArtifactType.ENUM,
+}
+
+# artifact files sent to a worker process at once when parsing with a process pool
+PROCESS_PARSE_CHUNK_SIZE = 256
+# states with fewer artifact files are parsed in-process, since sending them to workers costs more than it saves
+PROCESS_PARSE_MIN_FILES = 2 * PROCESS_PARSE_CHUNK_SIZE
+
+_PARSE_TIME = registry.histogram("binsync_state_parse_seconds", "Seconds State.parse took")
+_PARSE_ARTIFACTS = registry.histogram(
+    "binsync_state_parse_artifacts", "Artifacts in the states State.parse returned", buckets=COUNT_BUCKETS
+)
+_DUMP_TIME = registry.histogram("binsync_state_dump_seconds", "Seconds State.dump took")
+_DUMP_FILES = registry.histogram(
+    "binsync_state_dump_files", "Files written or removed by State.dump", buckets=COUNT_BUCKETS
+)
+
 #
 # Helper Funcs
 #
 
+def artifact_type_and_key(artifact):
+    """
+    Gets the type of the artifact and the key it is stored under in a State.
+    Function headers and stack variables are stored in the function they belong to.
+    """
+    if isinstance(artifact, (Function, FunctionHeader, StackVariable)):
+        return ArtifactType.FUNCTION, artifact.addr
+    elif isinstance(artifact, Comment):
+        return ArtifactType.COMMENT, artifact.addr
+    elif isinstance(artifact, Patch):
+        return ArtifactType.PATCH, artifact.offset
+    elif isinstance(artifact, Struct):
+        return ArtifactType.STRUCT, artifact.name
+    elif isinstance(artifact, GlobalVariable):
+        return ArtifactType.GLOBAL_VAR, artifact.addr
+    elif isinstance(artifact, Enum):
+        return ArtifactType.ENUM, artifact.name
+
+    raise Exception("Undefined Artifact Type!")
+
+
 def update_dirty_flag(f):
     @wraps(f)
     def _update_dirty_flag(self, *args, **kwargs):
         r = f(self, *args, **kwargs)
         if r is True:
             self._dirty = True
+            self._dirty_artifacts.add(artifact_type_and_key(args[0]))
         return r
 
     return _update_dirty_flag
@@ -62,7 +113,7 @@ def update_last_change(f):
 
         # make a function if one does not exist
         if isinstance(artifact, (FunctionHeader, StackVariable)):
-            func = self.get_or_make_function(artifact.addr)
+            self.get_or_make_function(artifact.addr)
 
         if not should_set:
             from_user_msg = f" from {from_user}" if from_user else ""
@@ -79,13 +130,15 @@ def update_last_change(f):
             # update function its in, if it's in a function
             func = self.find_func_for_addr(artifact.addr)
             if func:
+                func = self._writable_function(func.addr)
                 func.last_change = artifact.last_change
+                self._dirty_artifacts.add((ArtifactType.FUNCTION, func.addr))
 
         # Stack Var
         elif isinstance(artifact, StackVariable):
             artifact_loc = artifact.addr
             artifact_type = ArtifactType.FUNCTION
-            func.last_change = artifact.last_change
+            self._writable_function(artifact.addr).last_change = artifact.last_change
 
         elif isinstance(artifact, Function):
             artifact_loc = artifact.addr
@@ -95,7 +148,7 @@ def update_last_change(f):
         elif isinstance(artifact, FunctionHeader):
             artifact_loc = artifact.addr
             artifact_type = ArtifactType.FUNCTION
-            func.last_change = artifact.last_change
+            self._writable_function(artifact.addr).last_change = artifact.last_change
 
         # Patch
         elif isinstance(artifact, Patch):
@@ -129,7 +182,11 @@ def update_last_change(f):
     return _update_last_change
 
 
-def list_files_in_dir(src: Union[pathlib.Path, git.Tree], dir_name, client=None) -> List[str]:
+def list_files_in_dir(src: Union[pathlib.Path, git.Tree, Dict[str, str]], dir_name, client=None) -> List[str]:
+    # load from files that were already read, like a batch read of a Git tree
+    if isinstance(src, dict):
+        return [name for name in src if name.startswith(dir_name + "/")]
+
     if client and isinstance(src, git.Tree):
         files = client.list_files_in_tree(src)
         return [name for name in files if name.startswith(dir_name)]
@@ -148,8 +205,10 @@ def list_files_in_dir(src: Union[pathlib.Path, git.Tree], dir_name, client=None)
     ]
 
 
-def load_toml_from_file(src: Union[pathlib.Path, git.Tree], filename, client=None):
-    if client and isinstance(src, git.Tree):
+def load_toml_from_file(src: Union[pathlib.Path, git.Tree, Dict[str, str]], filename, client=None):
+    if isinstance(src, dict):
+        file_data = src.get(str(pathlib.PurePosixPath(filename)), None)
+    elif client and isinstance(src, git.Tree):
         file_data = client.load_file_from_tree(src, filename)
     else:
         if not src:
@@ -165,6 +224,50 @@ def load_toml_from_file(src: Union[pathlib.Path, git.Tree], filename, client=Non
     return toml.loads(file_data) if file_data is not None else file_data
 
 
+def load_artifact_files(files: Dict[str, bytes]) -> bytes:
+    """
+    Decodes the TOML artifact files of a State. This is the work done by worker processes when parsing
+    with a process pool, so it only takes and returns bytes.
+
+    @param files:   Dict of file path -> raw file contents, for function, struct, and aggregate artifact files
+    @return:        Dict of file path -> artifact (or dict of artifacts for aggregate files), see encode_artifacts
+    """
+    src = {path: data.decode() for path, data in files.items()}
+    artifacts = {}
+    for path in src:
+        artifact_type, _ = artifact_for_path(path)
+        if artifact_type == ArtifactType.FUNCTION:
+            artifacts[path] = Function.load(load_toml_from_file(src, path))
+        elif artifact_type == ArtifactType.STRUCT:
+            artifacts[path] = Struct.load(load_toml_from_file(src, path))
+        elif artifact_type is not None:
+            artifacts[path] = State._parse_aggregate_file(src, path)
+
+    return encode_artifacts(artifacts)
+
+
+def artifact_for_path(path: str) -> Tuple[Optional[str], object]:
+    """
+    Maps a file path in a user's tree to the artifact it stores. Per-artifact files (functions and structs)
+    map to their artifact key, while aggregate files (comments, patches, ...) map to a key of None, meaning
+    every artifact of that type may live in the file.
+
+    @param path:    A file path relative to the root of a user's tree
+    @return:        A tuple of (ArtifactType, key), or (None, None) for files that store no artifacts
+    """
+    path = pathlib.PurePosixPath(path)
+    if len(path.parts) == 2 and path.suffix == ".toml":
+        if path.parts[0] == "functions":
+            try:
+                return ArtifactType.FUNCTION, int(path.stem, 16)
+            except ValueError:
+                return None, None
+        elif path.parts[0] == "structs":
+            return ArtifactType.STRUCT, path.stem
+
+    return AGGREGATE_ARTIFACT_FILES.get(str(path), None), None
+
+
 #
 # State Defn & Operators
 #
@@ -177,6 +280,22 @@ class State:
     :ivar int version:  Version of the state, starting from 0.
     """
 
+    ARTIFACT_DICT_NAMES = {
+        ArtifactType.FUNCTION: "functions",
+        ArtifactType.COMMENT: "comments",
+        ArtifactType.STRUCT: "structs",
+        ArtifactType.PATCH: "patches",
+        ArtifactType.GLOBAL_VAR: "global_vars",
+        ArtifactType.ENUM: "enums",
+    }
+
+    AGGREGATE_ARTIFACT_CLASSES = {
+        ArtifactType.COMMENT: Comment,
+        ArtifactType.PATCH: Patch,
+        ArtifactType.GLOBAL_VAR: GlobalVariable,
+        ArtifactType.ENUM: Enum,
+    }
+
     def __init__(self, user: str, version: str = None, client=None, last_push_time=None, last_commit_msg=None, dirty=True):
         # metadata info
         self.user = user  # type: str
@@ -190,8 +309,9 @@ class State:
         self.client = client  # type: Optional[Client]
 
         # data
-        self.functions: Dict[int, Function] = {}
-        self.comments: Dict[int, Comment] = {}
+        # functions and comments are sorted by address for range lookups
+        self.functions: Dict[int, Function] = SortedDict()
+        self.comments: Dict[int, Comment] = SortedDict()
         self.structs: Dict[str, Struct] = {}
         self.patches: Dict[int, Patch] = SortedDict()
         self.global_vars: Dict[int, GlobalVariable] = {}
@@ -199,6 +319,15 @@ class State:
 
         # state is dirty on creation (metadata)
         self._dirty = dirty  # type: bool
+        # (ArtifactType, key) of every artifact changed since the last commit
+        self._dirty_artifacts = set()  # type: Set[Tuple[str, object]]
+        # a state that was never committed or parsed has no files to update, so it must be fully dumped
+        self._dump_all = dirty  # type: bool
+
+        # names of the artifact dicts shared with copies of this state, which are copied before any change
+        self._shared_dicts = set()  # type: Set[str]
+        # addresses of functions only this state holds, which can be changed in place
+        self._owned_functions = set()  # type: Set[int]
 
     def __eq__(self, other):
         if isinstance(other, State):
@@ -211,15 +340,22 @@ class State:
         return False
 
     def copy(self):
+        """
+        Copies the state in constant time. Both states share their artifact dicts and artifacts until one of
+        them changes: a setter copies the artifact dict it writes to, and any function it changes in place,
+        on its first write after the copy. Artifacts returned by getters may be shared with other states,
+        so they must be copied before being changed outside a setter.
+        """
         state = State(self.user, version=self.version, client=self.client, last_push_time=self.last_push_time, last_commit_msg=self.last_commit_msg, dirty=self._dirty)
-        artifacts = ["functions", "comments", "structs", "patches", "global_vars", "enums"]
-        for artifact in artifacts:
-            setattr(
-                state,
-                artifact,
-                {k: v.copy() for k, v in getattr(self, artifact).items()}
-            )
+        for name in self.ARTIFACT_DICT_NAMES.values():
+            setattr(state, name, getattr(self, name))
+
+        self._shared_dicts = set(self.ARTIFACT_DICT_NAMES.values())
+        self._owned_functions = set()
+        state._shared_dicts = set(self.ARTIFACT_DICT_NAMES.values())
 
+        state._dirty_artifacts = set(self._dirty_artifacts)
+        state._dump_all = self._dump_all
         return state
 
     def __str__(self):
@@ -236,7 +372,38 @@ class State:
     def dirty(self):
         return self._dirty
 
-    def _dump_data(self, dst: Union[pathlib.Path, git.IndexFile], filename, data):
+    @property
+    def dirty_artifacts(self) -> Set[Tuple[str, object]]:
+        return self._dirty_artifacts
+
+    def _mark_committed(self):
+        self._dirty = False
+        self._dirty_artifacts.clear()
+        self._dump_all = False
+
+    def _remove_data(self, dst: Union[pathlib.Path, git.IndexFile, Dict], filename):
+        # remove from a dict of files, which marks the file as deleted
+        if isinstance(dst, dict):
+            dst[str(pathlib.PurePosixPath(filename))] = None
+            return
+
+        # remove using Git files
+        if self.client and isinstance(dst, git.IndexFile):
+            self.client.remove_data(dst, filename)
+            return
+
+        # remove using filesystem
+        if not dst:
+            dst = pathlib.Path("")
+
+        dst.joinpath(filename).unlink(missing_ok=True)
+
+    def _dump_data(self, dst: Union[pathlib.Path, git.IndexFile, Dict], filename, data):
+        # dump to a dict of files, which can be committed without a working tree
+        if isinstance(dst, dict):
+            dst[str(pathlib.PurePosixPath(filename))] = data
+            return
+
         # dump using Git files
         if self.client and isinstance(dst, git.IndexFile):
             self.client.add_data(dst, filename, data)
@@ -251,7 +418,7 @@ class State:
         with open(out_path, "wb") as fp:
             fp.write(data)
 
-    def dump_metadata(self, dst: Union[pathlib.Path, git.IndexFile]):
+    def dump_metadata(self, dst: Union[pathlib.Path, git.IndexFile, Dict]):
         d = {
             "user": self.user,
             "version": self.version,
@@ -262,50 +429,153 @@ class State:
         }
         self._dump_data(dst, 'metadata.toml', toml.dumps(d, encoder=TomlHexEncoder()).encode())
 
-    def dump(self, dst: Union[pathlib.Path, git.IndexFile]):
+    def dump(self, dst: Union[pathlib.Path, git.IndexFile, Dict], only_dirty=False, snapshot=False,
+             existing_files: Optional[Dict[str, str]] = None):
+        """
+        Dumps the state to a folder, a Git index, or a dict of file path -> file bytes. In a dict, removed
+        files are marked with None instead of bytes. When only_dirty is set, the metadata and the files of
+        artifacts changed since the last commit are the only ones written. Files of changed artifacts that
+        no longer exist in the state are removed. A state that was never committed or parsed is always
+        dumped in full.
+
+        When snapshot is set, a snapshot of every artifact is also written next to the TOML files, which
+        State.parse prefers over the TOML files while they are unchanged. A partial dump only knows the files
+        it writes, so it needs existing_files to write a snapshot.
+
+        @param dst:             Path, Git index, or dict to dump to
+        @param only_dirty:      Only write the files of changed artifacts
+        @param snapshot:        Also write a snapshot of every artifact
+        @param existing_files:  Dict of file path -> blob hexsha of the files already in dst
+        @return:
+        """
+        start_time = time.perf_counter()
         if isinstance(dst, str):
             dst = pathlib.Path(dst)
 
+        dirty_keys = None
+        if only_dirty and not self._dump_all:
+            dirty_keys = defaultdict(set)
+            for artifact_type, key in self._dirty_artifacts:
+                dirty_keys[artifact_type].add(key)
+
+        # every file is collected first, so a snapshot can be made from the final set of files
+        files = {}
+
         # dump metadata
-        self.dump_metadata(dst)
+        self.dump_metadata(files)
 
         # dump functions, one file per function in ./functions/
-        for addr, func in self.functions.items():
+        func_addrs = self.functions.keys() if dirty_keys is None else dirty_keys[ArtifactType.FUNCTION]
+        for addr in func_addrs:
             path = pathlib.Path('functions').joinpath("%08x.toml" % addr)
-            self._dump_data(dst, path, func.dump().encode())
+            func = self.functions.get(addr, None)
+            if func is None:
+                self._remove_data(files, path)
+            else:
+                self._dump_data(files, path, func.dump().encode())
 
         # dump structs, one file per struct in ./structs/
-        for s_name, struct in self.structs.items():
+        struct_names = self.structs.keys() if dirty_keys is None else dirty_keys[ArtifactType.STRUCT]
+        for s_name in struct_names:
             path = pathlib.Path('structs').joinpath(f"{s_name}.toml")
-            self._dump_data(dst, path, struct.dump().encode())
+            struct = self.structs.get(s_name, None)
+            if struct is None:
+                self._remove_data(files, path)
+            else:
+                self._dump_data(files, path, struct.dump().encode())
+
+        # dump comments, patches, global vars, and enums
+        for filename, artifact_type in AGGREGATE_ARTIFACT_FILES.items():
+            if dirty_keys is not None and artifact_type not in dirty_keys:
+                continue
+
+            artifact_cls = self.AGGREGATE_ARTIFACT_CLASSES[artifact_type]
+            artifacts = self._get_artifact_dict(artifact_type)
+            self._dump_data(files, filename, toml.dumps(artifact_cls.dump_many(artifacts), encoder=TomlHexEncoder()).encode())
+
+        if snapshot:
+            self._dump_snapshot(files, existing_files if dirty_keys is not None else {})
+
+        for path, data in files.items():
+            if data is None:
+                self._remove_data(dst, path)
+            else:
+                self._dump_data(dst, path, data)
+
+        _DUMP_FILES.observe(len(files))
+        _DUMP_TIME.observe(time.perf_counter() - start_time)
+
+    def _dump_snapshot(self, files: Dict[str, Optional[bytes]], existing_files: Optional[Dict[str, str]]):
+        if existing_files is None:
+            l.debug("Skipping the state snapshot of a partial dump with unknown existing files")
+            return
 
-        # dump comments
-        self._dump_data(dst, 'comments.toml', toml.dumps(Comment.dump_many(self.comments), encoder=TomlHexEncoder()).encode())
+        changed_artifact_files = {path for path in files if artifact_for_path(path)[0] is not None}
+        # nothing the snapshot covers changed, so the existing snapshot is still valid
+        if not changed_artifact_files and SNAPSHOT_FILENAME in existing_files:
+            return
 
-        # dump patches
-        self._dump_data(dst, 'patches.toml', toml.dumps(Patch.dump_many(self.patches), encoder=TomlHexEncoder()).encode())
+        file_shas = {path: sha for path, sha in existing_files.items() if artifact_for_path(path)[0] is not None}
+        for path in changed_artifact_files:
+            if files[path] is None:
+                file_shas.pop(path, None)
+            else:
+                file_shas[path] = git_blob_sha(files[path])
 
-        # dump global vars
-        self._dump_data(dst, 'global_vars.toml', toml.dumps(GlobalVariable.dump_many(self.global_vars), encoder=TomlHexEncoder()).encode())
+        try:
+            files[SNAPSHOT_FILENAME] = dump_snapshot(self.artifact_dicts(), snapshot_digest(file_shas))
+        except TypeError as e:
+            l.warning(f"Unable to write a state snapshot: {e}")
 
-        # dump enums
-        self._dump_data(dst, 'enums.toml', toml.dumps(Enum.dump_many(self.enums), encoder=TomlHexEncoder()).encode())
+    @classmethod
+    def parse(cls, src: Union[pathlib.Path, git.Tree], client=None, prev_state=None, prev_tree=None,
+              executor: Optional[Executor] = None):
+        """
+        Parses a State from a folder or a Git tree. If both a previously parsed State and the Git tree it was
+        parsed from are provided, only the files that changed between the two trees are reloaded.
+        See parse_incremental for more info.
+
+        @param src:         Path, Git tree, or dict of file path -> file contents to parse from
+        @param client:      Client used to access the Git tree
+        @param prev_state:  An optional State that was parsed from prev_tree
+        @param prev_tree:   An optional Git tree prev_state was parsed from
+        @param executor:    An optional process pool to decode the TOML files of a large Git tree in
+        @return:
+        """
+        start_time = time.perf_counter()
+        state = cls._parse(src, client=client, prev_state=prev_state, prev_tree=prev_tree, executor=executor)
+        _PARSE_TIME.observe(time.perf_counter() - start_time)
+        _PARSE_ARTIFACTS.observe(state.artifact_count())
+        return state
 
     @classmethod
-    def parse(cls, src: Union[pathlib.Path, git.Tree], client=None):
+    def _parse(cls, src, client=None, prev_state=None, prev_tree=None, executor=None):
         if isinstance(src, str):
             src = pathlib.Path(src)
 
+        if prev_state is not None and prev_tree is not None and client and isinstance(src, git.Tree):
+            state, _ = cls.parse_incremental(src, prev_state, prev_tree, client=client)
+            return state
+
+        if client and isinstance(src, git.Tree):
+            file_shas = client.list_blobs_in_tree(src)
+            state = cls._parse_snapshot(src, file_shas, client)
+            if state is not None:
+                return state
+
+            # read every file of a Git tree in a single batch
+            blobs = client.read_blobs({path: sha for path, sha in file_shas.items() if path != SNAPSHOT_FILENAME})
+            if executor is not None:
+                state = cls._parse_in_executor(blobs, executor, client)
+                if state is not None:
+                    return state
+
+            src = {path: data.decode() for path, data in blobs.items()}
+
         state = cls(None, client=client)
 
         # load metadata
-        metadata = load_toml_from_file(src, "metadata.toml", client=client)
-        if metadata is None:
-            # metadata is not found
-            raise MetadataNotFoundError()
-        state.user = metadata["user"]
-        state.version = metadata["version"]
-        state.last_push_time = metadata.get("last_push_time", None)
+        cls._parse_metadata(state, src, client=client)
 
         # load functions
         function_files = list_files_in_dir(src, "functions", client=client)
@@ -314,35 +584,9 @@ class State:
             func = Function.load(func_toml)
             state.functions[func.addr] = func
 
-        # load comments
-        comments_toml = load_toml_from_file(src, "comments.toml", client=client)
-        comments = {}
-        if comments_toml:
-            for comment in Comment.load_many(comments_toml):
-                comments[comment.addr] = comment
-        state.comments = comments
-
-        # load patches
-        patches_toml = load_toml_from_file(src, "patches.toml", client=client)
-        patches = {}
-        if patches_toml:
-            for patch in Patch.load_many(patches_toml):
-                patches[patch.offset] = patch
-        state.patches = SortedDict(patches)
-
-        # load global_vars
-        global_vars_toml = load_toml_from_file(src, "global_vars.toml", client=client)
-        global_vars = {}
-        if global_vars_toml:
-            for global_var in GlobalVariable.load_many(global_vars_toml):
-                global_vars[global_var.addr] = global_var
-        state.global_vars = SortedDict(global_vars)
-
-        # load enums
-        enums_toml = load_toml_from_file(src, "enums.toml", client=client)
-        state.enums = {
-            enum.name: enum for enum in Enum.load_many(enums_toml)
-        } if enums_toml else {}
+        # load aggregate artifacts: comments, patches, global vars, and enums
+        for filename, artifact_type in AGGREGATE_ARTIFACT_FILES.items():
+            state._set_artifact_dict(artifact_type, cls._parse_aggregate_file(src, filename, client=client))
 
         # load structs
         struct_files = list_files_in_dir(src, "structs", client=client)
@@ -352,9 +596,235 @@ class State:
             state.structs[struct.name] = struct
 
         # clear the dirty bit
-        state._dirty = False
+        state._mark_committed()
         return state
 
+    @classmethod
+    def parse_incremental(cls, src: git.Tree, prev_state: "State", prev_tree: git.Tree, client=None) \
+            -> Tuple["State", Dict[str, Set]]:
+        """
+        Parses a State from a Git tree by starting from a copy of prev_state and only reloading the
+        files whose blobs differ between prev_tree and src. Functions and structs that were added, modified,
+        or deleted are updated one by one, while an aggregate file (like comments.toml) is reloaded as a whole
+        when its blob changed. Metadata is always reloaded.
+
+        @param src:         Git tree to parse from
+        @param prev_state:  The State that was parsed from prev_tree
+        @param prev_tree:   The Git tree prev_state was parsed from
+        @param client:      Client used to access the Git trees
+        @return:            The new State and a dict of ArtifactType -> set of keys that changed
+        """
+        changed_files, deleted_files = client.diff_trees(prev_tree, src)
+        # read every changed artifact file of the Git tree in a single batch
+        src = client.load_files_from_tree(
+            src, {path for path in changed_files if artifact_for_path(path)[0] is not None} | {"metadata.toml"}
+        )
+
+        state = prev_state.copy()
+        state.client = client
+        cls._parse_metadata(state, src, client=client)
+
+        changes = defaultdict(set)
+        for path in sorted(changed_files | deleted_files):
+            artifact_type, key = artifact_for_path(path)
+            if artifact_type is None:
+                continue
+
+            deleted = path in deleted_files
+            if artifact_type == ArtifactType.FUNCTION:
+                functions = state._writable_dict(artifact_type)
+                if deleted:
+                    functions.pop(key, None)
+                else:
+                    func = Function.load(load_toml_from_file(src, path, client=client))
+                    # the key in the name of a file is always the same as the address in it
+                    key = func.addr
+                    functions[key] = func
+                    state._owned_functions.add(key)
+                changes[artifact_type].add(key)
+            elif artifact_type == ArtifactType.STRUCT:
+                structs = state._writable_dict(artifact_type)
+                if deleted:
+                    structs.pop(key, None)
+                else:
+                    struct = Struct.load(load_toml_from_file(src, path, client=client))
+                    key = struct.name
+                    structs[key] = struct
+                changes[artifact_type].add(key)
+            else:
+                # aggregate files are replaced wholesale, but only the artifacts that differ are reported
+                old_artifacts = state._get_artifact_dict(artifact_type)
+                new_artifacts = {} if deleted else cls._parse_aggregate_file(src, path, client=client)
+                changes[artifact_type].update(
+                    key for key in set(old_artifacts) | set(new_artifacts)
+                    if old_artifacts.get(key, None) != new_artifacts.get(key, None)
+                )
+                state._set_artifact_dict(artifact_type, new_artifacts)
+
+        state._mark_committed()
+        return state, dict(changes)
+
+    @classmethod
+    def _parse_in_executor(cls, blobs: Dict[str, bytes], executor: Executor, client) -> Optional["State"]:
+        """
+        Parses a State by decoding its artifact files in chunks on a process pool, see load_artifact_files.
+
+        @return:    The State, or None if there are too few files to be worth it or the pool is broken
+        """
+        artifact_paths = [path for path in blobs if artifact_for_path(path)[0] is not None]
+        if len(artifact_paths) < PROCESS_PARSE_MIN_FILES:
+            return None
+
+        state = cls(None, client=client)
+        cls._parse_metadata(state, {path: blobs[path].decode() for path in ("metadata.toml",) if path in blobs})
+
+        try:
+            futures = [
+                executor.submit(
+                    load_artifact_files,
+                    {path: blobs[path] for path in artifact_paths[i:i + PROCESS_PARSE_CHUNK_SIZE]}
+                )
+                for i in range(0, len(artifact_paths), PROCESS_PARSE_CHUNK_SIZE)
+            ]
+            artifact_chunks = [decode_artifacts(future.result()) for future in futures]
+        except BrokenExecutor as e:
+            l.warning(f"Unable to parse a state in worker processes, parsing it in-process: {e}")
+            return None
+
+        for artifacts in artifact_chunks:
+            for path, artifact in artifacts.items():
+                artifact_type, _ = artifact_for_path(path)
+                if artifact_type == ArtifactType.FUNCTION:
+                    state.functions[artifact.addr] = artifact
+                elif artifact_type == ArtifactType.STRUCT:
+                    state.structs[artifact.name] = artifact
+                else:
+                    state._set_artifact_dict(artifact_type, artifact)
+
+        state._mark_committed()
+        return state
+
+    @classmethod
+    def _parse_snapshot(cls, src: git.Tree, file_shas: Dict[str, str], client) -> Optional["State"]:
+        """
+        Parses a State from the snapshot in a Git tree, if there is one and it was made from the artifact
+        files currently in the tree. Metadata is always read from its TOML file.
+        """
+        if SNAPSHOT_FILENAME not in file_shas or "metadata.toml" not in file_shas:
+            return None
+
+        blobs = client.read_blobs({path: file_shas[path] for path in ("metadata.toml", SNAPSHOT_FILENAME)})
+        digest = snapshot_digest(
+            {path: sha for path, sha in file_shas.items() if artifact_for_path(path)[0] is not None}
+        )
+        artifact_dicts = load_snapshot(blobs[SNAPSHOT_FILENAME], digest)
+        if artifact_dicts is None:
+            l.debug(f"Snapshot of {src} is stale, falling back to its TOML files")
+            return None
+
+        return cls.from_artifact_dicts(artifact_dicts, {"metadata.toml": blobs["metadata.toml"].decode()}, client=client)
+
+    @classmethod
+    def from_artifact_dicts(cls, artifact_dicts: Dict[str, Dict], metadata_src, client=None) -> "State":
+        """
+        Creates a committed State from loaded artifact dicts, like the ones of a snapshot.
+
+        @param artifact_dicts:  Dict of artifact dict name (like "functions") -> dict of key -> artifact
+        @param metadata_src:    Path, Git tree, or dict of file path -> file contents holding metadata.toml
+        @param client:          Client used to access a Git tree
+        @return:
+        """
+        state = cls(None, client=client)
+        cls._parse_metadata(state, metadata_src, client=client)
+        for artifact_type, name in cls.ARTIFACT_DICT_NAMES.items():
+            state._set_artifact_dict(artifact_type, artifact_dicts.get(name, {}))
+
+        state._mark_committed()
+        return state
+
+    def artifact_dicts(self) -> Dict[str, Dict]:
+        """
+        Gets every artifact dict of the State by name (like "functions"), which is what a snapshot stores.
+        """
+        return {name: getattr(self, name) for name in self.ARTIFACT_DICT_NAMES.values()}
+
+    @staticmethod
+    def _parse_metadata(state: "State", src, client=None):
+        metadata = load_toml_from_file(src, "metadata.toml", client=client)
+        if metadata is None:
+            # metadata is not found
+            raise MetadataNotFoundError()
+
+        state.user = metadata["user"]
+        state.version = metadata["version"]
+        state.last_push_time = metadata.get("last_push_time", None)
+
+    @staticmethod
+    def _parse_aggregate_file(src, filename, client=None) -> Dict:
+        artifact_type = AGGREGATE_ARTIFACT_FILES[filename]
+        artifacts_toml = load_toml_from_file(src, filename, client=client)
+        if not artifacts_toml:
+            return {}
+
+        if artifact_type == ArtifactType.COMMENT:
+            return {comment.addr: comment for comment in Comment.load_many(artifacts_toml)}
+        elif artifact_type == ArtifactType.PATCH:
+            return {patch.offset: patch for patch in Patch.load_many(artifacts_toml)}
+        elif artifact_type == ArtifactType.GLOBAL_VAR:
+            return {gvar.addr: gvar for gvar in GlobalVariable.load_many(artifacts_toml)}
+        elif artifact_type == ArtifactType.ENUM:
+            return {enum.name: enum for enum in Enum.load_many(artifacts_toml)}
+
+        raise ValueError(f"Unknown aggregate artifact file {filename}")
+
+    def artifact_count(self) -> int:
+        """
+        Gets the number of artifacts in the State, across every artifact type.
+        """
+        return sum(len(self._get_artifact_dict(artifact_type)) for artifact_type in self.ARTIFACT_DICT_NAMES)
+
+    def _get_artifact_dict(self, artifact_type) -> Dict:
+        return getattr(self, self.ARTIFACT_DICT_NAMES[artifact_type])
+
+    def _set_artifact_dict(self, artifact_type, artifacts: Dict):
+        if artifact_type in (ArtifactType.FUNCTION, ArtifactType.COMMENT, ArtifactType.PATCH, ArtifactType.GLOBAL_VAR) \
+                and not isinstance(artifacts, SortedDict):
+            artifacts = SortedDict(artifacts)
+
+        name = self.ARTIFACT_DICT_NAMES[artifact_type]
+        setattr(self, name, artifacts)
+        self._shared_dicts.discard(name)
+        if artifact_type == ArtifactType.FUNCTION:
+            self._owned_functions = set()
+
+    def _writable_dict(self, artifact_type) -> Dict:
+        """
+        Gets an artifact dict that is safe to change, copying it first if it is shared with a copy of this state.
+        """
+        name = self.ARTIFACT_DICT_NAMES[artifact_type]
+        artifacts = getattr(self, name)
+        if name in self._shared_dicts:
+            # dict and SortedDict copies keep their type
+            artifacts = artifacts.copy()
+            setattr(self, name, artifacts)
+            self._shared_dicts.discard(name)
+
+        return artifacts
+
+    def _writable_function(self, addr) -> Optional[Function]:
+        """
+        Gets a function that is safe to change in place, copying it first if it may be shared with
+        a copy of this state.
+        """
+        functions = self._writable_dict(ArtifactType.FUNCTION)
+        func = functions.get(addr, None)
+        if func is not None and addr not in self._owned_functions:
+            func = func.copy()
+            functions[addr] = func
+            self._owned_functions.add(addr)
+
+        return func
+
     #
     # Setters
     #
@@ -365,7 +835,9 @@ class State:
         if function.addr in self.functions and self.functions[function.addr] == function:
             return False
 
-        self.functions[function.addr] = function
+        self._writable_dict(ArtifactType.FUNCTION)[function.addr] = function
+        # the function may still be held by the caller
+        self._owned_functions.discard(function.addr)
         return True
 
     @update_dirty_flag
@@ -374,7 +846,7 @@ class State:
         if func_header.addr in self.functions and self.functions[func_header.addr] == func_header:
             return False
 
-        self.functions[func_header.addr].header = func_header
+        self._writable_function(func_header.addr).header = func_header
         return True
 
     @update_dirty_flag
@@ -394,7 +866,7 @@ class State:
                 if set_last_change:
                     comment.last_change = comment.last_change or old_cmt.last_change
 
-            self.comments[comment.addr] = comment
+            self._writable_dict(ArtifactType.COMMENT)[comment.addr] = comment
             return True
 
         return False
@@ -411,7 +883,7 @@ class State:
             old_patch = None
 
         if old_patch != patch:
-            self.patches[addr] = patch
+            self._writable_dict(ArtifactType.PATCH)[addr] = patch
             return True
 
         return False
@@ -432,7 +904,7 @@ class State:
             old_var = None
 
         if old_var != variable:
-            func.stack_vars[variable.offset] = variable
+            self._writable_function(variable.addr).stack_vars[variable.offset] = variable
             return True
 
         return False
@@ -461,14 +933,14 @@ class State:
         # delete old struct only when we know what it is
         if old_name is not None:
             try:
-                del self.structs[old_name]
-                #remove_data(self.client.repo.index, os.path.join('structs', f'{old_name}.toml'))
+                del self._writable_dict(ArtifactType.STRUCT)[old_name]
+                self._dirty_artifacts.add((ArtifactType.STRUCT, old_name))
             except KeyError:
                 pass
 
         # set the new struct
         if struct.name is not None:
-            self.structs[struct.name] = struct
+            self._writable_dict(ArtifactType.STRUCT)[struct.name] = struct
             return True
 
         return False
@@ -482,7 +954,7 @@ class State:
             old_gvar = None
 
         if old_gvar != gloabl_var:
-            self.global_vars[gloabl_var.addr] = gloabl_var
+            self._writable_dict(ArtifactType.GLOBAL_VAR)[gloabl_var.addr] = gloabl_var
             return True
 
         return False
@@ -496,7 +968,7 @@ class State:
             old_enum = None
 
         if old_enum != enum:
-            self.enums[enum.name] = enum
+            self._writable_dict(ArtifactType.ENUM)[enum.name] = enum
             return True
 
         return False
@@ -509,8 +981,9 @@ class State:
         try:
             func = self.functions[addr]
         except KeyError:
-            self.functions[addr] = Function(addr, 0)
-            func = self.functions[addr]
+            func = Function(addr, 0)
+            self._writable_dict(ArtifactType.FUNCTION)[addr] = func
+            self._owned_functions.add(addr)
 
         return func
 
@@ -548,8 +1021,7 @@ class State:
             return {}
 
         return {
-            addr: cmt for addr, cmt in self.comments.items()
-            if func.addr <= addr <= func.addr + func.size
+            addr: self.comments[addr] for addr in self.comments.irange(func.addr, func.addr + func.size)
         }
 
     def get_patch(self, addr) -> Patch:
@@ -642,8 +1114,15 @@ class State:
     #
 
     def find_func_for_addr(self, search_addr):
-        for func_addr, func in self.functions.items():
-            if func.addr <= search_addr < (func.addr + func.size):
-                return func
-        else:
-            return None
+        """
+        Finds the function containing an address. Functions are assumed not to overlap, so the containing
+        function is the closest one starting at or before the address, skipping functions of unknown size.
+        """
+        for func_addr in self.functions.irange(maximum=search_addr, reverse=True):
+            func = self.functions[func_addr]
+            if not func.size:
+                continue
+
+            return func if search_addr < func.addr + func.size else None
+
+        return None
@@ -0,0 +1,283 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+l = logging.getLogger(__name__)
+
+# max finished spans kept, the oldest are dropped first
+DEFAULT_MAX_SPANS = 100000
+# category of the flow events that link the spans of a commit
+FLOW_CATEGORY = "commit"
+
+
+class Span:
+    """
+    A timed stage of the edit pipeline, like a commit or a pull, done by one BinSync client.
+
+    :ivar str name:         Name of the stage, like "Client._push"
+    :ivar str process:      Name of the client that did it, which is its master user
+    :ivar commits:          Hexshas of the commits the stage handled, which correlate the spans of an edit
+    :ivar args:             Dict of extra info shown with the span
+    """
+    __slots__ = ("name", "process", "thread_id", "thread_name", "start", "duration", "commits", "args")
+
+    def __init__(self, name: str, process: Optional[str] = None, commits: Iterable[str] = (), args=None):
+        thread = threading.current_thread()
+        self.name = name
+        self.process = process or "binsync"
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        # wall clock time, so the traces of different machines can be merged
+        self.start = time.time()
+        self.duration = None  # type: Optional[float]
+        self.commits = list(dict.fromkeys(commits))
+        self.args = args or {}
+
+    def add_commits(self, *commits):
+        for commit in commits:
+            if commit and commit not in self.commits:
+                self.commits.append(commit)
+
+    def __repr__(self):
+        return f"<Span: {self.name} process={self.process} commits={len(self.commits)}>"
+
+
+class Tracer:
+    """
+    Records spans that follow an artifact change through BinSync: the edit, the queued master state, the commit,
+    the push, the pull of another client, and the update of its tables. Spans carry the hexshas of the commits
+    they handled, so the spans of one edit can be found across clients. Spans of an edit that happen before its
+    commit exists are registered as pending, and get the hexsha once the commit is made.
+
+    Tracing is off by default, and costs next to nothing while off. Setting the BINSYNC_TRACE environment
+    variable to a path turns it on and writes the trace there when Python exits.
+    """
+
+    def __init__(self, max_spans=DEFAULT_MAX_SPANS):
+        self.enabled = False
+        self._spans = deque(maxlen=max_spans)
+        self._pending = {}  # type: Dict[str, deque]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+            self._pending.clear()
+
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def _span_stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str, process: Optional[str] = None, commits: Iterable[str] = (), pending: Optional[str] = None,
+             **args):
+        """
+        Times the body of the with statement as a span.
+
+        @param name:        Name of the span
+        @param process:     Name of the client doing the work
+        @param commits:     Hexshas of the commits handled, more can be added with add_commits
+        @param pending:     Key of the commit the span waits for, see resolve_pending
+        @param args:        Extra info shown with the span
+        @return:            The Span, or None if tracing is off
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        span = Span(name, process=process, commits=commits, args=args)
+        stack = self._span_stack()
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                self._spans.append(span)
+                if pending is not None:
+                    self._pending.setdefault(pending, deque(maxlen=self._spans.maxlen)).append(span)
+
+    def add_commits(self, *commits):
+        """
+        Adds commit hexshas to every span open on this thread, so a stage that makes or finds a commit also
+        tags the stages it is part of.
+        """
+        if not self.enabled:
+            return
+
+        for span in self._span_stack():
+            span.add_commits(*commits)
+
+    def resolve_pending(self, key: str, *commits):
+        """
+        Adds commit hexshas to every span pending on key, and stops them from pending.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            spans = self._pending.pop(key, ())
+
+        for span in spans:
+            span.add_commits(*commits)
+
+    def to_chrome_trace(self) -> Dict:
+        """
+        Gets every finished span as Chrome trace-event JSON, which chrome://tracing and Perfetto open. Each client
+        is a process, and the spans of a commit are linked by flow arrows.
+        """
+        events = []
+        named = set()
+        for span in self.spans():
+            pid = _process_id(span.process)
+            if (pid, None) not in named:
+                named.add((pid, None))
+                events.append({"ph": "M", "name": "process_name", "pid": pid, "args": {"name": span.process}})
+            if (pid, span.thread_id) not in named:
+                named.add((pid, span.thread_id))
+                events.append({
+                    "ph": "M", "name": "thread_name", "pid": pid, "tid": span.thread_id,
+                    "args": {"name": span.thread_name},
+                })
+
+            events.append({
+                "name": span.name,
+                "cat": "binsync",
+                "ph": "X",
+                "ts": span.start * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": dict(span.args, commits=list(span.commits)),
+            })
+
+        return {"traceEvents": events + _flow_events(events), "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        """
+        Writes every finished span to a file as Chrome trace-event JSON.
+        """
+        Path(path).write_text(json.dumps(self.to_chrome_trace()))
+
+
+def merge_chrome_traces(traces: Iterable[Dict]) -> Dict:
+    """
+    Merges the Chrome traces of several clients, like ones dumped on different machines, and links the spans of
+    every commit across all of them.
+    """
+    events = []
+    seen_metadata = set()
+    for trace in traces:
+        for event in trace.get("traceEvents", []):
+            if event.get("cat") == FLOW_CATEGORY:
+                continue
+
+            if event.get("ph") == "M":
+                key = (event["name"], event["pid"], event.get("tid", None))
+                if key in seen_metadata:
+                    continue
+                seen_metadata.add(key)
+
+            events.append(event)
+
+    return {"traceEvents": events + _flow_events(events), "displayTimeUnit": "ms"}
+
+
+def _process_id(process: str) -> int:
+    # stable across machines, so merged traces keep a process per client
+    return zlib.crc32(process.encode()) & 0x7fffffff
+
+
+def _flow_events(events: List[Dict]) -> List[Dict]:
+    spans_by_commit = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+
+        for commit in event.get("args", {}).get("commits", []):
+            spans_by_commit.setdefault(commit, []).append(event)
+
+    flows = []
+    for commit, spans in spans_by_commit.items():
+        if len(spans) < 2:
+            continue
+
+        spans.sort(key=lambda span: span["ts"])
+        for i, span in enumerate(spans):
+            phase = "s" if i == 0 else "f" if i == len(spans) - 1 else "t"
+            flow = {
+                "name": commit[:10], "cat": FLOW_CATEGORY, "ph": phase, "id": commit,
+                "ts": span["ts"], "pid": span["pid"], "tid": span["tid"],
+            }
+            if phase == "f":
+                # bind to the span the arrow ends in, not the next one
+                flow["bp"] = "e"
+            flows.append(flow)
+
+    return flows
+
+
+def traced(name: Optional[str] = None, process: Optional[Callable] = None, pending: bool = False):
+    """
+    Records every call of a method as a span while tracing is on.
+
+    @param name:        Name of the span, the qualified name of the method by default
+    @param process:     Function taking the object of the method and returning the name of its client
+    @param pending:     Register the span as pending on the client name, see Tracer.resolve_pending
+    """
+    def _traced(f):
+        span_name = name or f.__qualname__
+
+        @wraps(f)
+        def _traced_call(self, *args, **kwargs):
+            if not tracer.enabled:
+                return f(self, *args, **kwargs)
+
+            process_name = process(self) if process is not None else None
+            with tracer.span(span_name, process=process_name, pending=process_name if pending else None):
+                return f(self, *args, **kwargs)
+
+        return _traced_call
+
+    return _traced
+
+
+def _dump_at_exit(path):
+    # a trace that can not be written must not end the interpreter with a traceback
+    try:
+        tracer.dump(path)
+    except (OSError, TypeError, ValueError) as e:
+        l.warning(f"Unable to write the BinSync trace to {path}: {e}")
+
+
+# the tracer every part of BinSync records its spans in
+tracer = Tracer()
+
+_TRACE_PATH = os.environ.get("BINSYNC_TRACE", None)
+if _TRACE_PATH:
+    tracer.enable()
+    atexit.register(_dump_at_exit, _TRACE_PATH)
@@ -0,0 +1,228 @@
+import asyncio
+import datetime
+import logging
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import toml
+
+from binsync.core.async_client import AsyncClient
+from binsync.core.disk_cache import StateDiskCache
+from binsync.core.scheduler import Scheduler
+
+l = logging.getLogger(__name__)
+
+DEFAULT_PULL_INTERVAL = 10
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+class DaemonRepo:
+    """
+    A BinSync repo served by the SyncDaemon, and the user the daemon commits as in it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        user: str,
+        binary_hash: str = "",
+        remote_url: Optional[str] = None,
+        init_repo: bool = False,
+        pull_interval: Optional[float] = None,
+        pull: bool = True,
+        push: bool = True,
+    ):
+        """
+        @param path:            Path to the BinSync repo
+        @param user:            Username the daemon commits as
+        @param binary_hash:     Hash of the binary the repo is for, only checked against the repo
+        @param remote_url:      Remote URL to clone the repo from, if there is nothing at path yet
+        @param init_repo:       Init the repo, like the Client option
+        @param pull_interval:   Seconds between syncs of the repo, or None for the interval of the daemon
+        @param pull:            Pull the remote when syncing
+        @param push:            Push to the remote when syncing
+        """
+        self.path = os.path.expanduser(path)
+        self.user = user
+        self.binary_hash = binary_hash
+        self.remote_url = remote_url
+        self.init_repo = init_repo
+        self.pull_interval = pull_interval
+        self.pull = pull
+        self.push = push
+
+        self.client = None  # type: Optional[AsyncClient]
+        self.last_sync_time = None  # type: Optional[datetime.datetime]
+
+    def __repr__(self):
+        return f"<DaemonRepo: {self.user}@{self.path}>"
+
+
+class SyncDaemon:
+    """
+    Keeps many BinSync repos in sync from one process. Every repo gets its own Client, and with it its own lock
+    file and caches, but the clients share the threads that run their Git actions, the threads that parse their
+    states, and a disk cache of parsed states. Git trees are content addressed, so mirrors of the same project
+    share their cached states too.
+
+    Repos are synced (commit, pull, push) on their own interval by one asyncio event loop, which runs every
+    fetch and push as a subprocess, so a slow remote never holds up the other repos.
+    """
+
+    def __init__(
+        self,
+        repos: List[DaemonRepo],
+        pull_interval: float = DEFAULT_PULL_INTERVAL,
+        git_threads: int = 2,
+        parse_workers: int = 4,
+        cache_dir: Optional[str] = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        """
+        @param repos:           The repos to serve
+        @param pull_interval:   Seconds between syncs of repos that do not set their own interval
+        @param git_threads:     Number of threads running the Git actions of every repo. The Git actions of a
+                                repo always run on the same thread, so they still run one at a time.
+        @param parse_workers:   Number of threads parsing the states of every repo
+        @param cache_dir:       Directory of the shared disk cache of parsed states, or None for the
+                                .git/binsync-cache of each repo
+        @param cache_size:      Max bytes of the shared disk cache
+        """
+        self.repos = repos
+        self.pull_interval = pull_interval
+        self.git_threads = max(1, git_threads)
+        self.parse_workers = max(1, parse_workers)
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self.cache_size = cache_size
+
+        self._schedulers = []  # type: List[Scheduler]
+        self._parse_pool = None  # type: Optional[ThreadPoolExecutor]
+        self._disk_cache = None  # type: Optional[StateDiskCache]
+
+    @classmethod
+    def from_config(cls, config_path) -> "SyncDaemon":
+        """
+        Creates a daemon from a TOML config, which has the options of the daemon at the top level and a
+        [[repos]] table for each repo:
+
+            pull_interval = 10
+            cache_dir = "~/.cache/binsync"
+
+            [[repos]]
+            path = "~/projects/fauxware_bs"
+            user = "ci"
+            remote_url = "git@github.com:org/fauxware_bs.git"
+            pull_interval = 30
+        """
+        config = toml.loads(Path(config_path).read_text())
+        repos = []
+        for repo_config in config.pop("repos", []):
+            if "init" in repo_config:
+                repo_config["init_repo"] = repo_config.pop("init")
+            repos.append(DaemonRepo(**repo_config))
+
+        return cls(repos, **config)
+
+    async def run(self, stop_event: Optional[asyncio.Event] = None):
+        """
+        Opens every repo and keeps them in sync until stop_event is set. Repos that fail to open are skipped.
+        """
+        stop_event = stop_event or asyncio.Event()
+        self._start_shared_resources()
+        try:
+            await asyncio.gather(*(self._open_repo(repo) for repo in self.repos))
+            repos = [repo for repo in self.repos if repo.client is not None]
+            l.info(f"Syncing {len(repos)} of {len(self.repos)} repos")
+            await asyncio.gather(*(self._sync_repo_routine(repo, stop_event) for repo in repos))
+        finally:
+            await asyncio.gather(*(self._close_repo(repo) for repo in self.repos))
+            self._stop_shared_resources()
+
+    def _start_shared_resources(self):
+        self._schedulers = [Scheduler(name=f"DaemonGitScheduler{i}") for i in range(self.git_threads)]
+        for scheduler in self._schedulers:
+            scheduler.start_worker_thread()
+
+        self._parse_pool = ThreadPoolExecutor(max_workers=self.parse_workers, thread_name_prefix="StateParser")
+        if self.cache_dir is not None and self.cache_size > 0:
+            self._disk_cache = StateDiskCache(self.cache_dir, self.cache_size)
+
+    def _stop_shared_resources(self):
+        for scheduler in self._schedulers:
+            scheduler.stop_worker_thread()
+        self._schedulers = []
+
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=True)
+            self._parse_pool = None
+
+        self._disk_cache = None
+
+    async def _open_repo(self, repo: DaemonRepo):
+        index = self.repos.index(repo)
+        try:
+            repo.client = await AsyncClient.open(
+                repo.user,
+                repo.path,
+                repo.binary_hash,
+                # a repo cloned by an earlier run is reused
+                remote_url=repo.remote_url if not os.path.exists(repo.path) else None,
+                init_repo=repo.init_repo,
+                pull_on_update=repo.pull,
+                push_on_update=repo.push,
+                state_parse_workers=self.parse_workers,
+                scheduler=self._schedulers[index % len(self._schedulers)],
+                state_parse_pool=self._parse_pool,
+                disk_cache=self._disk_cache,
+            )
+        except Exception as e:
+            l.error(f"Failed to open {repo}: {e}")
+
+    async def _close_repo(self, repo: DaemonRepo):
+        if repo.client is None:
+            return
+
+        try:
+            await repo.client.close()
+        except Exception as e:
+            l.warning(f"Failed to close {repo}: {e}")
+        repo.client = None
+
+    async def _sync_repo_routine(self, repo: DaemonRepo, stop_event: asyncio.Event):
+        interval = repo.pull_interval if repo.pull_interval is not None else self.pull_interval
+        while not stop_event.is_set():
+            try:
+                await repo.client.commit_and_update_states()
+                repo.last_sync_time = datetime.datetime.now(tz=datetime.timezone.utc)
+            except Exception as e:
+                l.warning(f"Failed to sync {repo}: {e}")
+
+            try:
+                # the client backs off the interval while the remote is idle
+                await asyncio.wait_for(stop_event.wait(), timeout=repo.client.client.next_pull_delay(interval))
+            except asyncio.TimeoutError:
+                pass
+
+
+def run_daemon(config_path):
+    """
+    Runs a SyncDaemon from a TOML config until it is interrupted.
+    """
+    daemon = SyncDaemon.from_config(config_path)
+
+    async def _run():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                # signal handlers are not supported by every event loop, like on Windows
+                pass
+
+        await daemon.run(stop_event)
+
+    asyncio.run(_run())
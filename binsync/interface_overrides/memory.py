@@ -0,0 +1,192 @@
+import collections
+import threading
+import time
+from typing import Dict, Optional
+
+from libbs.api import DecompilerInterface
+from libbs.api.artifact_lifter import ArtifactLifter
+from libbs.artifacts import Comment, Enum, Function, FunctionHeader, GlobalVariable, Patch, StackVariable, Struct
+
+
+class MemoryArtifactLifter(ArtifactLifter):
+    """
+    Lifts nothing, since the in-memory decompiler stores artifacts in their lifted form.
+    """
+
+    def lift_type(self, type_str: str) -> str:
+        return type_str
+
+    def lift_addr(self, addr: int) -> int:
+        return addr
+
+    def lift_stack_offset(self, offset: int, func_addr: int) -> int:
+        return offset
+
+    def lower_type(self, type_str: str) -> str:
+        return type_str
+
+    def lower_addr(self, addr: int) -> int:
+        return addr
+
+    def lower_stack_offset(self, offset: int, func_addr: int) -> int:
+        return offset
+
+
+class MemoryBSInterface(DecompilerInterface):
+    """
+    A headless decompiler that keeps every artifact in dicts, so the BSController sync algorithms, like fill_all
+    and magic_fill, can run and be profiled without a real decompiler:
+
+        deci = MemoryBSInterface(latency=0.001)
+        controller = BSController(decompiler_interface=deci, headless=True)
+
+    Every artifact call of the interface sleeps for latency seconds, to simulate the RPC cost of a decompiler
+    like IDA or Ghidra, and is counted in call_counts by the name of the call.
+    """
+
+    def __init__(self, binary_hash="memory_hash", latency=0.0, **kwargs):
+        """
+        :param binary_hash:     Hash of the fake binary, which BinSync checks against the hash of a repo
+        :param latency:         Seconds every artifact call takes, on top of the in-memory work
+        """
+        self.latency = latency
+        self.call_counts = collections.Counter()
+        self._binary_hash = binary_hash
+        self._lock = threading.Lock()
+        self._functions_map = {}  # type: Dict[int, Function]
+        self._comments_map = {}  # type: Dict[int, Comment]
+        self._structs_map = {}  # type: Dict[str, Struct]
+        self._enums_map = {}  # type: Dict[str, Enum]
+        self._global_vars_map = {}  # type: Dict[int, GlobalVariable]
+        self._patches_map = {}  # type: Dict[int, Patch]
+        kwargs.setdefault("name", "memory")
+        super().__init__(headless=True, artifact_lifter=MemoryArtifactLifter(self), **kwargs)
+
+    def _init_headless_components(self, *args, **kwargs):
+        # there is no decompiler or binary to check for
+        pass
+
+    def _call(self, name: str):
+        with self._lock:
+            self.call_counts[name] += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    @property
+    def binary_base_addr(self) -> int:
+        return 0
+
+    @property
+    def binary_hash(self) -> str:
+        return self._binary_hash
+
+    def get_func_size(self, func_addr) -> int:
+        self._call("get_func_size")
+        func = self._functions_map.get(func_addr, None)
+        return func.size if func is not None else 0
+
+    def gui_active_context(self):
+        return None
+
+    #
+    # Artifact Storage
+    #
+
+    def _set_function(self, func: Function, **kwargs) -> bool:
+        # functions are set through their header and stack variables, like the base interface does, so a
+        # function costs as many calls as it would in a real decompiler
+        stored_func = self._functions_map.setdefault(func.addr, Function(func.addr, func.size))
+        if func.size:
+            stored_func.size = func.size
+
+        return super()._set_function(func, **kwargs)
+
+    def _get_function(self, addr, **kwargs) -> Optional[Function]:
+        self._call("get_function")
+        func = self._functions_map.get(addr, None)
+        return func.copy() if func is not None else None
+
+    def _functions(self) -> Dict[int, Function]:
+        self._call("functions")
+        return {addr: Function(addr, func.size) for addr, func in self._functions_map.items()}
+
+    def _set_function_header(self, fheader: FunctionHeader, **kwargs) -> bool:
+        self._call("set_function_header")
+        func = self._functions_map.setdefault(fheader.addr, Function(fheader.addr, 0))
+        if func.header == fheader:
+            return False
+
+        func.header = fheader.copy()
+        return True
+
+    def _set_stack_variable(self, svar: StackVariable, **kwargs) -> bool:
+        self._call("set_stack_variable")
+        func = self._functions_map.setdefault(svar.addr, Function(svar.addr, 0))
+        if func.stack_vars.get(svar.offset, None) == svar:
+            return False
+
+        func.stack_vars[svar.offset] = svar.copy()
+        return True
+
+    def _set_comment(self, comment: Comment, **kwargs) -> bool:
+        return self._set_in("set_comment", self._comments_map, comment.addr, comment)
+
+    def _get_comment(self, addr) -> Optional[Comment]:
+        return self._get_from("get_comment", self._comments_map, addr)
+
+    def _comments(self) -> Dict[int, Comment]:
+        return self._list("comments", self._comments_map)
+
+    def _set_struct(self, struct: Struct, header=True, members=True, **kwargs) -> bool:
+        return self._set_in("set_struct", self._structs_map, struct.name, struct)
+
+    def _get_struct(self, name) -> Optional[Struct]:
+        return self._get_from("get_struct", self._structs_map, name)
+
+    def _structs(self) -> Dict[str, Struct]:
+        return self._list("structs", self._structs_map)
+
+    def _set_enum(self, enum: Enum, **kwargs) -> bool:
+        return self._set_in("set_enum", self._enums_map, enum.name, enum)
+
+    def _get_enum(self, name) -> Optional[Enum]:
+        return self._get_from("get_enum", self._enums_map, name)
+
+    def _enums(self) -> Dict[str, Enum]:
+        return self._list("enums", self._enums_map)
+
+    def _set_global_variable(self, gvar: GlobalVariable, **kwargs) -> bool:
+        return self._set_in("set_global_variable", self._global_vars_map, gvar.addr, gvar)
+
+    def _get_global_var(self, addr) -> Optional[GlobalVariable]:
+        return self._get_from("get_global_var", self._global_vars_map, addr)
+
+    def _global_vars(self) -> Dict[int, GlobalVariable]:
+        return self._list("global_vars", self._global_vars_map)
+
+    def _set_patch(self, patch: Patch, **kwargs) -> bool:
+        return self._set_in("set_patch", self._patches_map, patch.addr, patch)
+
+    def _get_patch(self, addr) -> Optional[Patch]:
+        return self._get_from("get_patch", self._patches_map, addr)
+
+    def _patches(self) -> Dict[int, Patch]:
+        return self._list("patches", self._patches_map)
+
+    def _set_in(self, call_name: str, artifacts: Dict, key, artifact) -> bool:
+        self._call(call_name)
+        if artifacts.get(key, None) == artifact:
+            return False
+
+        artifacts[key] = artifact.copy()
+        return True
+
+    def _get_from(self, call_name: str, artifacts: Dict, key):
+        self._call(call_name)
+        artifact = artifacts.get(key, None)
+        return artifact.copy() if artifact is not None else None
+
+    def _list(self, call_name: str, artifacts: Dict) -> Dict:
+        self._call(call_name)
+        return dict(artifacts)
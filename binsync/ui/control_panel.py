@@ -51,14 +51,16 @@ class ControlPanel(QWidget):
         self.ctx_change.connect(self._reload_ctx)
         self.controller.ctx_change_callback = self.ctx_callback
 
-    def update_callback(self, states):
+    def update_callback(self, states, changes=None):
         """
         This function will be called in another thread, so the work
         done here is guaranteed to be thread safe.
 
+        @param states:  Every user's state
+        @param changes: Dict of user -> changed artifacts since the last update, or None to reload everything
         @return:
         """
-        self._update_table_data(states)
+        self._update_table_data(states, changes=changes)
         status = self.controller.status_string() if self.controller else "Disconnected"
         self.update_ready.emit(status)
 
@@ -124,9 +126,9 @@ class ControlPanel(QWidget):
         self._status_bar.showMessage(f"{ctx_name}@{hex(self.controller.last_ctx.addr)}")
         self._ctx_table.reload()
 
-    def _update_table_data(self, states):
+    def _update_table_data(self, states, changes=None):
 
         for _, table in self.tables.items():
-            table.update_table(states)
+            table.update_table(states, changes=changes)
 
         self._ctx_table.update_table(states)
@@ -0,0 +1,95 @@
+import logging
+
+from libbs.ui.qt_objects import (
+    QAbstractItemView,
+    QDialog,
+    QFileDialog,
+    QHBoxLayout,
+    QHeaderView,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+)
+
+from binsync.core.metrics import Histogram, registry
+
+l = logging.getLogger(__name__)
+
+
+class MetricsDialog(QDialog):
+    """
+    Shows the current value of every BinSync metric, like the time spent waiting on Git, and can export them
+    as JSON or Prometheus text.
+    """
+    COLUMNS = ["Metric", "Labels", "Value"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("BinSync Metrics")
+        self.resize(800, 500)
+        self._init_widgets()
+        self.refresh()
+
+    def _init_widgets(self):
+        self._table = QTableWidget(self)
+        self._table.setColumnCount(len(self.COLUMNS))
+        self._table.setHorizontalHeaderLabels(self.COLUMNS)
+        self._table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self._table.horizontalHeader().setStretchLastSection(True)
+        self._table.verticalHeader().setVisible(False)
+        self._table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh)
+        export_button = QPushButton("Export...")
+        export_button.clicked.connect(self._handle_export_button)
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(self._handle_reset_button)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(refresh_button)
+        buttons_layout.addWidget(reset_button)
+        buttons_layout.addWidget(export_button)
+
+        main_layout = QVBoxLayout()
+        main_layout.addWidget(self._table)
+        main_layout.addLayout(buttons_layout)
+        self.setLayout(main_layout)
+
+    def refresh(self):
+        rows = []
+        for metric in registry.metrics():
+            for labels, value in sorted(metric.samples(), key=lambda sample: sorted(sample[0].items())):
+                label_text = ", ".join(f"{name}={label}" for name, label in labels.items())
+                rows.append((metric.name, label_text, _format_value(metric, value)))
+
+        self._table.setRowCount(len(rows))
+        for row, items in enumerate(rows):
+            for col, text in enumerate(items):
+                self._table.setItem(row, col, QTableWidgetItem(text))
+
+    def _handle_reset_button(self):
+        registry.reset()
+        self.refresh()
+
+    def _handle_export_button(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, caption="Export metrics", filter="JSON (*.json);;Prometheus text (*.prom)"
+        )
+        if not path:
+            return
+
+        try:
+            registry.dump(path)
+        except OSError as e:
+            l.critical(f"Unable to export metrics to {path}: {e}")
+
+
+def _format_value(metric, value) -> str:
+    if metric.TYPE != Histogram.TYPE:
+        return str(value)
+
+    count = value["count"]
+    mean = value["sum"] / count if count else 0
+    return f"count={count} sum={value['sum']:.4f} mean={mean:.4f}"
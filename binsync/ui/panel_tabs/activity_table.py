@@ -1,7 +1,6 @@
 import datetime
 import logging
-from collections import defaultdict
-from typing import Dict
+from typing import Optional
 import time
 
 from binsync.controller import BSController
@@ -15,6 +14,7 @@ from libbs.ui.qt_objects import (
 )
 from binsync.ui.utils import friendly_datetime
 from binsync.core.scheduler import SchedSpeed
+from binsync.core.state import ArtifactType
 from libbs.artifacts import Function
 
 l = logging.getLogger(__name__)
@@ -47,7 +47,7 @@ class ActivityTableModel(BinsyncTableModel):
                 return time.mktime(self.row_data[row][col].timetuple())
             return self.row_data[row][col]
         elif role == Qt.BackgroundRole:
-            return self.data_bgcolors[row]
+            return self.row_color(row)
         elif role == self.FilterRole:
             return f"{self.row_data[row][0]} {hex(self.row_data[row][1])}"
         elif role == Qt.ToolTipRole:
@@ -55,31 +55,14 @@ class ActivityTableModel(BinsyncTableModel):
             pass
         return None
 
-    def update_table(self, states):
-        cmenu_cache = defaultdict(list)
-        updated_row_keys = set()
-
+    def update_table(self, states, changes=None):
+        updated_rows = {}
         for state in states:
-            latest_func = None
-            user_funcs: Dict[int, Function] = state.functions
             user_name = state.user
+            if changes is not None and user_name not in changes:
+                continue
 
-            for func_addr, sync_func in user_funcs.items():
-                # don't add functions that were never changed by the user
-                if not sync_func.last_change:
-                    continue
-
-                cmenu_cache[user_name].append(func_addr)
-
-                if latest_func is None:
-                    latest_func = sync_func
-                    continue
-
-                if latest_func is not None and sync_func.last_change <= latest_func.last_change:
-                    continue
-
-                latest_func = sync_func
-
+            latest_func = self._find_latest_func(state, None if changes is None else changes[user_name])
             if latest_func is not None:
                 most_recent_func = latest_func.addr
                 last_state_change = latest_func.last_change
@@ -87,12 +70,55 @@ class ActivityTableModel(BinsyncTableModel):
                 most_recent_func = -1
                 last_state_change = state.last_push_time
 
-            self.data_dict[user_name] = [user_name, most_recent_func, last_state_change]
-            updated_row_keys.add(user_name)
+            row = [user_name, most_recent_func, last_state_change]
+            if row != self.data_dict.get(user_name, None):
+                self.data_dict[user_name] = row
+                updated_rows[user_name] = row
+
+        self._update_changed_rows(updated_rows)
+
+    def _find_latest_func(self, state, user_changes) -> Optional[Function]:
+        """
+        Finds the most recently changed function of a user, and tracks every function the user changed.
+        Every function of the user is only scanned when the user is new, or their latest function changed.
+
+        @param state:           The user's state
+        @param user_changes:    Dict of ArtifactType -> set of keys that changed, or None if anything may have changed
+        @return:                The latest function, or None if the user changed no function
+        """
+        user_name = state.user
+        prev_row = self.data_dict.get(user_name, None)
+        changed_addrs = set(user_changes.get(ArtifactType.FUNCTION, ())) if user_changes is not None else None
+        if changed_addrs is None or prev_row is None or prev_row[1] in changed_addrs:
+            # don't add functions that were never changed by the user
+            self.context_menu_cache[user_name] = {
+                addr for addr, func in state.functions.items() if func.last_change
+            }
+            candidate_addrs = self.context_menu_cache[user_name]
+        else:
+            user_funcs = self.context_menu_cache.setdefault(user_name, set())
+            for addr in changed_addrs:
+                func = state.functions.get(addr, None)
+                if func is not None and func.last_change:
+                    user_funcs.add(addr)
+                else:
+                    user_funcs.discard(addr)
+
+            # the previous latest function is unchanged, so only the changed functions can be newer
+            candidate_addrs = {addr for addr in changed_addrs if addr in user_funcs}
+            if prev_row[1] in user_funcs:
+                candidate_addrs.add(prev_row[1])
+
+        latest_func = None
+        for func_addr in candidate_addrs:
+            sync_func = state.functions[func_addr]
+            if latest_func is not None and sync_func.last_change <= latest_func.last_change:
+                continue
+
+            latest_func = sync_func
+
+        return latest_func
 
-        self.context_menu_cache = cmenu_cache
-        self._update_changed_rows(self.data_dict, updated_row_keys)
-        self.refresh_time_cells()
 
 class ActivityTableView(BinsyncTableView):
     HEADER = ['User', 'Activity', 'Last Push']
@@ -111,7 +137,7 @@ class ActivityTableView(BinsyncTableView):
 
     def _get_valid_funcs_for_user(self, username):
         if username in self.model.context_menu_cache:
-            for addr in self.model.context_menu_cache[username]:
+            for addr in sorted(self.model.context_menu_cache[username]):
                 yield hex(addr)
         else:
             # only populate with cached items to prevent main thread waiting on atomic actions
@@ -186,8 +212,8 @@ class QActivityTable(QWidget):
         self.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
 
-    def update_table(self, states):
-        self.table.update_table(states)
+    def update_table(self, states, changes=None):
+        self.table.update_table(states, changes=changes)
 
     def reload(self):
         pass
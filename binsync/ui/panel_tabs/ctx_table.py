@@ -41,7 +41,7 @@ class CTXTableModel(BinsyncTableModel):
                 return time.mktime(self.row_data[row][col].timetuple())
             return self.row_data[row][col]
         elif role == Qt.BackgroundRole:
-            return self.data_bgcolors[row]
+            return self.row_color(row)
         elif role == self.FilterRole:
             return self.row_data[row][0] + " " + self.row_data[row][1]
         elif role == Qt.ToolTipRole:
@@ -55,27 +55,34 @@ class CTXTableModel(BinsyncTableModel):
         if self.saved_ctx is None and new_ctx is None:
             return
 
-        # the context has updated
+        # the context has updated, so every row is replaced
+        reset = False
         if new_ctx and self.saved_ctx != new_ctx:
             self.saved_ctx = new_ctx
             self.data_dict = {}
+            reset = True
 
-        updated_row_keys = set()
+        updated_rows = {}
         for state in states:
             user_name = state.user
             func = state.get_function(self.saved_ctx)
             if not func or not func.last_change:
-                continue
-
-            self.data_dict[user_name] = [user_name, func.name, func.last_change]
-            updated_row_keys.add(user_name)
-
-        # clear the entire table in the case of a new empty ctx
-        if not self.data_dict:
-            self.update_signal.emit([], [])
-        else:
-            self._update_changed_rows(self.data_dict, updated_row_keys)
-        self.refresh_time_cells()
+                row = None
+            else:
+                row = [user_name, func.name, func.last_change]
+
+            if reset:
+                if row is not None:
+                    self.data_dict[user_name] = row
+                    updated_rows[user_name] = row
+            elif row != self.data_dict.get(user_name, None):
+                if row is None:
+                    del self.data_dict[user_name]
+                else:
+                    self.data_dict[user_name] = row
+                updated_rows[user_name] = row
+
+        self._update_changed_rows(updated_rows, reset=reset)
 
 
 class QCTXTable(BinsyncTableView):
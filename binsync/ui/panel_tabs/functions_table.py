@@ -1,8 +1,6 @@
 import datetime
 import logging
 import time
-from typing import Dict
-from collections import defaultdict
 
 from binsync.controller import BSController
 from binsync.ui.panel_tabs.table_model import BinsyncTableModel, BinsyncTableFilterLineEdit, BinsyncTableView
@@ -15,6 +13,7 @@ from libbs.ui.qt_objects import (
 )
 from binsync.ui.utils import friendly_datetime
 from binsync.core.scheduler import SchedSpeed
+from binsync.core.state import ArtifactType
 from libbs.artifacts import Function
 
 l = logging.getLogger(__name__)
@@ -45,7 +44,7 @@ class FunctionTableModel(BinsyncTableModel):
                 return time.mktime(self.row_data[row][col].timetuple())
             return self.row_data[row][col]
         elif role == Qt.BackgroundRole:
-            return self.data_bgcolors[row]
+            return self.row_color(row)
         elif role == self.FilterRole:
             return f"{hex(self.row_data[row][0])} {self.row_data[row][1]} {self.row_data[row][2]}"
         elif role == Qt.ToolTipRole:
@@ -53,35 +52,67 @@ class FunctionTableModel(BinsyncTableModel):
             pass
         return None
 
-    def update_table(self, states):
-        cmenu_cache = defaultdict(list)
-        updated_row_keys = set()
+    def update_table(self, states, changes=None):
+        # only the functions that changed for some user need their row recomputed
+        if changes is None:
+            func_addrs = set(self.data_dict)
+            for state in states:
+                func_addrs.update(state.functions)
+        else:
+            states_by_user = {state.user: state for state in states}
+            func_addrs = set()
+            for user_name, user_changes in changes.items():
+                state = states_by_user.get(user_name, None)
+                if state is None:
+                    continue
 
-        # grab all the new info from user states
+                known_addrs = [addr for addr, users in self.context_menu_cache.items() if user_name in users] \
+                    if user_changes is None else ()
+                func_addrs |= self._changed_keys(state, user_changes, ArtifactType.FUNCTION, known_addrs)
+
+        updated_rows = {}
+        for func_addr in func_addrs:
+            row, users = self._compute_row(func_addr, states)
+            if users:
+                self.context_menu_cache[func_addr] = users
+            else:
+                self.context_menu_cache.pop(func_addr, None)
+
+            if row == self.data_dict.get(func_addr, None):
+                continue
+
+            if row is None:
+                del self.data_dict[func_addr]
+            else:
+                self.data_dict[func_addr] = row
+            updated_rows[func_addr] = row
+
+        self._update_changed_rows(updated_rows)
+
+    @staticmethod
+    def _compute_row(func_addr, states):
+        """
+        Finds the most recent change to a function across every user.
+
+        @return: The row for the function, or None if no user changed it, and the users that changed it
+        """
+        row = None
+        users = []
         for state in states:
-            user_funcs: Dict[int, Function] = state.functions
-            user_name = state.user
-            for func_addr, sync_func in user_funcs.items():
-                func_change_time = sync_func.last_change
-                # don't add functions that were never changed by the user
-                if not func_change_time:
-                    continue
+            sync_func: Function = state.functions.get(func_addr, None)
+            # don't add functions that were never changed by the user
+            if not sync_func or not sync_func.last_change:
+                continue
 
-                cmenu_cache[func_addr].append(user_name)
+            users.append(state.user)
+            # skip older changes to the function
+            if row is not None and sync_func.last_change <= row[3]:
+                continue
 
-                # skip updating existent, older, functions
-                if func_addr in self.data_dict and \
-                        (not func_change_time or func_change_time <= self.data_dict[func_addr][self.time_col]):
-                    continue
+            row = [func_addr, sync_func.name if sync_func.name else "", state.user, sync_func.last_change]
 
-                self.data_dict[func_addr] = [
-                    func_addr, sync_func.name if sync_func.name else "", user_name, func_change_time
-                ]
-                updated_row_keys.add(func_addr)
+        return row, users
 
-        self.context_menu_cache = cmenu_cache
-        self._update_changed_rows(self.data_dict, updated_row_keys)
-        self.refresh_time_cells()
 
 class FunctionTableView(BinsyncTableView):
     HEADER = ['Addr', 'Remote Name', 'User', 'Last Push']
@@ -180,8 +211,8 @@ class QFunctionTable(QWidget):
         self.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
 
-    def update_table(self, states):
-        self.table.update_table(states)
+    def update_table(self, states, changes=None):
+        self.table.update_table(states, changes=changes)
 
     def reload(self):
         pass
@@ -1,6 +1,5 @@
 import logging
 import datetime
-from collections import defaultdict
 import re
 import time
 from enum import Enum
@@ -18,6 +17,7 @@ from libbs.ui.qt_objects import (
 )
 from binsync.ui.utils import friendly_datetime
 from binsync.core.scheduler import SchedSpeed
+from binsync.core.state import ArtifactType
 
 l = logging.getLogger(__name__)
 
@@ -29,6 +29,8 @@ class GlobalsTableModel(BinsyncTableModel):
         self.data_dict = {}
         self.saved_color_window = self.controller.table_coloring_window
         self.context_menu_cache = {}
+        # row key -> (ArtifactType, key in the state) of every global in the table
+        self.row_idents = {}
 
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
@@ -47,7 +49,7 @@ class GlobalsTableModel(BinsyncTableModel):
                 return time.mktime(self.row_data[row][col].timetuple())
             return self.row_data[row][col]
         elif role == Qt.BackgroundRole:
-            return self.data_bgcolors[row]
+            return self.row_color(row)
         elif role == self.FilterRole:
             #print(self.row_data)
             #print(self.row_data[row][0] + " " + self.row_data[row][1] + " " + self.row_data[row][2])
@@ -57,47 +59,87 @@ class GlobalsTableModel(BinsyncTableModel):
             pass
         return None
 
-    def update_table(self, states):
-        cmenu_cache = defaultdict(list)
-        updated_row_keys = set()
+    # artifact type of each global, and the name of its type in the table
+    GLOBAL_TYPES = {
+        ArtifactType.ENUM: "Enum",
+        ArtifactType.STRUCT: "Struct",
+        ArtifactType.GLOBAL_VAR: "Variable",
+    }
+
+    def update_table(self, states, changes=None):
+        # only the globals that changed for some user need their row recomputed, as (ArtifactType, key)
+        if changes is None:
+            global_idents = set(self.row_idents.values())
+            for state in states:
+                for artifact_type in self.GLOBAL_TYPES:
+                    global_idents.update((artifact_type, key) for key in state._get_artifact_dict(artifact_type))
+        else:
+            states_by_user = {state.user: state for state in states}
+            global_idents = set()
+            for user_name, user_changes in changes.items():
+                state = states_by_user.get(user_name, None)
+                if state is None:
+                    continue
 
-        for state in states:
-            user_structs = state.structs
-            user_gvars = state.global_vars
-            user_enums = state.enums
-            user_name = state.user
+                for artifact_type in self.GLOBAL_TYPES:
+                    known_keys = [
+                        ident[1] for row_key, ident in self.row_idents.items()
+                        if ident[0] == artifact_type
+                        and any(user == user_name for user, _ in self.context_menu_cache.get(row_key, ()))
+                    ] if user_changes is None else ()
+                    global_idents.update(
+                        (artifact_type, key) for key in self._changed_keys(state, user_changes, artifact_type, known_keys)
+                    )
+
+        updated_rows = {}
+        for artifact_type, key in global_idents:
+            global_type = self.GLOBAL_TYPES[artifact_type]
+            row_key = key + f"({global_type})" if global_type in ("Enum", "Struct") else key
+            row, users = self._compute_row(artifact_type, key, states)
+            if users:
+                self.context_menu_cache[row_key] = users
+                self.row_idents[row_key] = (artifact_type, key)
+            else:
+                self.context_menu_cache.pop(row_key, None)
+                self.row_idents.pop(row_key, None)
 
-            all_artifacts = ((user_enums, "Enum"), (user_structs, "Struct"), (user_gvars, "Variable"))
-            for user_artifacts, global_type in all_artifacts:
-                for _, artifact in user_artifacts.items():
-                    change_time = artifact.last_change
+            if row == self.data_dict.get(row_key, None):
+                continue
 
-                    if not change_time:
-                        continue
+            if row is None:
+                del self.data_dict[row_key]
+            else:
+                self.data_dict[row_key] = row
+            updated_rows[row_key] = row
+
+        self._update_changed_rows(updated_rows)
 
-                    artifact_name = artifact.name
-                    if global_type in ("Enum", "Struct"):
-                        artifact_key = artifact_name + f"({global_type})"
-                    elif global_type in ("Variable",):
-                        artifact_key = artifact.addr
-                        artifact_name += f" ({hex(artifact.addr)})"
-                    else:
-                        l.critical("Attempted to parse an unparsable global type!")
-                        return
+    def _compute_row(self, artifact_type, key, states):
+        """
+        Finds the most recent change to a global across every user.
+
+        @return: The row for the global, or None if no user changed it, and the (user, type) pairs that changed it
+        """
+        global_type = self.GLOBAL_TYPES[artifact_type]
+        row = None
+        users = []
+        for state in states:
+            artifact = state._get_artifact_dict(artifact_type).get(key, None)
+            if not artifact or not artifact.last_change:
+                continue
 
-                    cmenu_cache[artifact_key].append((user_name, global_type[0]))
+            users.append((state.user, global_type[0]))
+            # skip older changes to the global
+            if row is not None and artifact.last_change <= row[self.time_col]:
+                continue
 
-                    # skip updating existent, older, artifacts
-                    if artifact_key in self.data_dict and \
-                            (not change_time or change_time <= self.data_dict[artifact_key][self.time_col]):
-                        continue
+            artifact_name = artifact.name
+            if artifact_type == ArtifactType.GLOBAL_VAR:
+                artifact_name += f" ({hex(artifact.addr)})"
 
-                    self.data_dict[artifact_key] = [global_type[0], artifact_name, user_name, change_time]
-                    updated_row_keys.add(artifact_key)
+            row = [global_type[0], artifact_name, state.user, artifact.last_change]
 
-        self.context_menu_cache = cmenu_cache
-        self._update_changed_rows(self.data_dict, updated_row_keys)
-        self.refresh_time_cells()
+        return row, users
 
 
 class GlobalsTableView(BinsyncTableView):
@@ -222,8 +264,8 @@ class QGlobalsTable(QWidget):
         self.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
 
-    def update_table(self, states):
-        self.table.update_table(states)
+    def update_table(self, states, changes=None):
+        self.table.update_table(states, changes=changes)
 
     def reload(self):
         pass
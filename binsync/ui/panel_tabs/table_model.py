@@ -1,6 +1,6 @@
 import logging
 import datetime
-from typing import Dict, Set
+from typing import Dict, Optional
 
 from binsync.controller import BSController
 from libbs.ui.qt_objects import (
@@ -31,7 +31,8 @@ class BinsyncTableModel(QAbstractTableModel):
     # Color for most recently updated, the alpha value decreases linearly over controller.table_coloring_window
     ACTIVE_FUNCTION_COLOR = (100, 255, 100, 70)
 
-    update_signal = Signal(list, list)
+    # (dict of row key -> row, or None to remove the row; bool to replace every row)
+    update_signal = Signal(dict, bool)
 
     def __init__(self, controller: BSController, col_headers=None, filter_cols=None, time_col=None, addr_col=None, parent=None):
         """
@@ -48,7 +49,9 @@ class BinsyncTableModel(QAbstractTableModel):
         super().__init__(parent)
         self.controller = controller
         self.row_data = []
-        self.data_bgcolors = []
+        # the key of every row, and the row index of every key
+        self.row_keys = []
+        self.row_index = {}
         self.data_tooltips = []
 
         self.col_headers = col_headers
@@ -88,7 +91,8 @@ class BinsyncTableModel(QAbstractTableModel):
         self.beginInsertRows(QModelIndex(), position, position + rows - 1)
         for row in range(rows):
             self.row_data.insert(position + row, [0]*self.columnCount())
-            self.data_bgcolors.insert(position + row, [QColor(0, 0, 0, 0)])
+            self.row_keys.insert(position + row, None)
+        self._reindex_rows()
         self.endInsertRows()
         return True
 
@@ -97,11 +101,15 @@ class BinsyncTableModel(QAbstractTableModel):
         if 0 <= position < len(self.row_data) and 0 <= position + rows < len(self.row_data):
             self.beginRemoveRows(QModelIndex(), position, position + rows - 1)
             del self.row_data[position:position + rows]
-            del self.data_bgcolors[position:position + rows]
+            del self.row_keys[position:position + rows]
+            self._reindex_rows()
             self.endRemoveRows()
             return True
         return False
 
+    def _reindex_rows(self):
+        self.row_index = {key: idx for idx, key in enumerate(self.row_keys)}
+
     def setData(self, index, value, role=Qt.EditRole):
         """ Adjust the data (set it to <value>) depending on the given
             index and role. """
@@ -117,24 +125,62 @@ class BinsyncTableModel(QAbstractTableModel):
             return True
         return False
 
-    @Slot(list, list)
-    def update_data(self, new_data, new_colors):
-        prev_rc = len(self.row_data)
-        new_rc = len(new_data)
-        adding = prev_rc < new_rc
-        removing = new_rc < prev_rc
-        if adding:
-            self.beginInsertRows(QModelIndex(), prev_rc, new_rc-1)
-        elif removing:
-            self.beginRemoveRows(QModelIndex(), new_rc, prev_rc-1)
-
-        self.row_data = new_data
-        self.data_bgcolors = new_colors
-
-        if adding:
-            self.endInsertRows()
-        elif removing:
+    @Slot(dict, bool)
+    def update_data(self, updated_rows: Dict, reset: bool):
+        """
+        Applies row changes on the GUI thread. Only the rows that changed are signaled, so the cost of an
+        update scales with the number of changes, not the number of rows.
+
+        @param updated_rows:    Dict of row key -> row, or None to remove the row
+        @param reset:           Replace every row with the updated rows
+        """
+        if reset:
+            self.beginResetModel()
+            self.row_keys = [key for key, row in updated_rows.items() if row is not None]
+            self.row_data = [row for row in updated_rows.values() if row is not None]
+            self._reindex_rows()
+            self.endResetModel()
+            return
+
+        last_col = self.columnCount() - 1
+        removed_idxs = []
+        new_rows = []
+        for key, row in updated_rows.items():
+            idx = self.row_index.get(key, None)
+            if row is None:
+                if idx is not None:
+                    removed_idxs.append(idx)
+            elif idx is None:
+                new_rows.append((key, row))
+            else:
+                self.row_data[idx] = row
+                self.dataChanged.emit(self.index(idx, 0), self.index(idx, last_col))
+
+        # remove from the bottom up so the indices of the remaining removals stay valid
+        for idx in sorted(removed_idxs, reverse=True):
+            self.beginRemoveRows(QModelIndex(), idx, idx)
+            del self.row_data[idx]
+            del self.row_keys[idx]
             self.endRemoveRows()
+        if removed_idxs:
+            self._reindex_rows()
+
+        if new_rows:
+            first_row = len(self.row_data)
+            self.beginInsertRows(QModelIndex(), first_row, first_row + len(new_rows) - 1)
+            for key, row in new_rows:
+                self.row_index[key] = len(self.row_data)
+                self.row_keys.append(key)
+                self.row_data.append(row)
+            self.endInsertRows()
+
+        # user may have changed how dark he wants colors to go (color window), which changes every row
+        if self.controller.table_coloring_window != self.saved_color_window:
+            self.saved_color_window = self.controller.table_coloring_window
+            if self.row_data:
+                self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, last_col))
+        else:
+            self.refresh_time_cells()
 
     def flags(self, index):
         """ Set the item flags at the given index. """
@@ -149,40 +195,30 @@ class BinsyncTableModel(QAbstractTableModel):
 
     def refresh_time_cells(self):
         # always update every column in the table that contains time
+        if not self.row_data:
+            return
+
         self.dataChanged.emit(
             self.createIndex(0, self.time_col),
             self.createIndex(self.rowCount() - 1, self.time_col)
         )
 
-    def _update_changed_rows(self, row_data: Dict, updated_row_keys: Set):
-        # user may have changed how dark he wants colors to go (color window)
-        force_color_update = self.controller.table_coloring_window != self.saved_color_window
-
-        # no changes are required
-        if not updated_row_keys and not force_color_update:
-            return False
-
-        row_colors = [
-            self._compute_row_color(row[self.time_col]) for row in row_data.values()
-        ]
+    def _update_changed_rows(self, updated_rows: Dict, reset=False):
+        """
+        Sends changed rows to the GUI thread, see update_data.
 
-        if force_color_update:
-            # update all rows
-            self.saved_color_window = self.controller.table_coloring_window
-            row_update_idxs = range(len(row_data))
-        else:
-            # update only rows with changes
-            row_update_idxs = [
-                idx for idx, row_key in enumerate(row_data.keys())
-                if row_key in updated_row_keys
-            ]
+        @param updated_rows:    Dict of row key -> row, or None to remove the row
+        @param reset:           Replace every row with the updated rows
+        """
+        self.update_signal.emit(updated_rows, reset)
 
-        # send update signal for everything in row data, with new colors
-        self.update_signal.emit(list(row_data.values()), row_colors)
+    def row_color(self, row: int) -> Optional[QColor]:
+        """ Computes the background color of a row when it is drawn, from the time of its last change. """
+        change_time = self.row_data[row][self.time_col]
+        if not isinstance(change_time, datetime.datetime):
+            return None
 
-        # ask for in-row updates (in UI) to any single row changed
-        for update_idx in row_update_idxs:
-            self.dataChanged.emit(self.index(0, update_idx), self.index(self.rowCount() - 1, update_idx))
+        return self._compute_row_color(change_time)
 
     def _compute_row_color(self, artifact_update_time: datetime.datetime):
         duration = int(datetime.datetime.now(tz=datetime.timezone.utc).timestamp() - artifact_update_time.timestamp())
@@ -197,8 +233,30 @@ class BinsyncTableModel(QAbstractTableModel):
 
         return None
 
-    def update_table(self, states):
-        """ Updates the table using the controller's information. """
+    @staticmethod
+    def _changed_keys(state, user_changes: Optional[Dict], artifact_type, known_keys=()):
+        """
+        Gets the keys of the artifacts of one type that may have changed in a user's state.
+
+        @param state:           The user's state
+        @param user_changes:    Dict of ArtifactType -> set of keys that changed, or None if anything may have changed
+        @param artifact_type:   The ArtifactType to get keys for
+        @param known_keys:      Keys already in the table for the user, which may have been removed
+        @return:                Set of keys
+        """
+        if user_changes is None:
+            return set(state._get_artifact_dict(artifact_type)) | set(known_keys)
+
+        return set(user_changes.get(artifact_type, ()))
+
+    def update_table(self, states, changes=None):
+        """
+        Updates the table using the controller's information.
+
+        @param states:  Every user's state
+        @param changes: Dict of user -> (dict of ArtifactType -> set of changed keys, or None when anything may
+                        have changed), or None to rebuild the table from every state
+        """
         raise NotImplementedError
 
 
@@ -280,9 +338,9 @@ class BinsyncTableView(QTableView):
         else:
             self.hideColumn(index)
 
-    def update_table(self, states):
+    def update_table(self, states, changes=None):
         """ Update the model of the table with new data from the controller """
-        self.model.update_table(states)
+        self.model.update_table(states, changes=changes)
 
     def reload(self):
         pass
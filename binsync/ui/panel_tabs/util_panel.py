@@ -12,11 +12,14 @@ from libbs.ui.qt_objects import (
     QVBoxLayout,
     QWidget,
     QLineEdit,
-    QIntValidator
+    QIntValidator,
+    QFileDialog
 )
 from binsync.ui.magic_sync_dialog import MagicSyncDialog
 from binsync.ui.force_push import ForcePushUI
+from binsync.ui.metrics_dialog import MetricsDialog
 from binsync.controller import BSController
+from binsync.core.tracing import tracer
 from binsync.extras import EXTRAS_AVAILABLE
 
 l = logging.getLogger(__name__)
@@ -107,6 +110,23 @@ class QUtilPanel(QWidget):
         dev_options_layout.addWidget(self._auto_push)
         dev_options_layout.addWidget(self._auto_pull)
 
+        self._metrics_button = QPushButton("Show Metrics...")
+        self._metrics_button.setToolTip("Shows how long BinSync spends in Git, parsing states, and updating.")
+        self._metrics_button.clicked.connect(self._handle_metrics_button)
+        dev_options_layout.addWidget(self._metrics_button)
+
+        self._trace_toggle = QCheckBox("Record Edit Traces")
+        self._trace_toggle.setToolTip("Records how long each edit takes to go from a commit to the tables of other "
+                                      "users, for viewing in chrome://tracing or Perfetto.")
+        self._trace_toggle.setChecked(tracer.enabled)
+        self._trace_toggle.stateChanged.connect(self._handle_trace_toggle)
+        self._export_trace_button = QPushButton("Export Trace...")
+        self._export_trace_button.clicked.connect(self._handle_export_trace_button)
+        trace_layout = QHBoxLayout()
+        trace_layout.addWidget(self._trace_toggle)
+        trace_layout.addWidget(self._export_trace_button)
+        dev_options_layout.addLayout(trace_layout)
+
 
         #
         # UI Options Group
@@ -246,6 +266,26 @@ class QUtilPanel(QWidget):
         self.popup = ForcePushUI(self.controller)
         self.popup.show()
 
+    def _handle_metrics_button(self):
+        self.metrics_popup = MetricsDialog()
+        self.metrics_popup.show()
+
+    def _handle_trace_toggle(self, state):
+        if state == Qt.Checked:
+            tracer.enable()
+        else:
+            tracer.disable()
+
+    def _handle_export_trace_button(self):
+        path, _ = QFileDialog.getSaveFileName(self, caption="Export trace", filter="Chrome trace (*.json)")
+        if not path:
+            return
+
+        try:
+            tracer.dump(path)
+        except OSError as e:
+            l.critical(f"Unable to export the trace to {path}: {e}")
+
     def _handle_auto_commit_toggle(self, state):
         if state == Qt.Checked:
             l.info("Disabling auto-commit!")
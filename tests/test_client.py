@@ -1,16 +1,25 @@
+import asyncio
 import git
 import os
 import pathlib
 import sys
 import tempfile
+import threading
+import time
 import toml
 
 import unittest
+from unittest import mock
 
 from libbs.artifacts import (
     FunctionHeader, StackVariable, Comment, Struct
 )
+from binsync.core.async_client import AsyncClient
 from binsync.core.client import Client
+from binsync.core.disk_cache import StateDiskCache
+from binsync.core.scheduler import Job
+from binsync.core.snapshot import SNAPSHOT_FILENAME
+from binsync.core.state import PROCESS_PARSE_MIN_FILES, ArtifactType, State
 
 
 class TestClient(unittest.TestCase):
@@ -44,13 +53,15 @@ class TestClient(unittest.TestCase):
             state = client.get_state(user="user0", no_cache=True)
             assert len(state.functions) == 1
             assert state.functions[self.FAKE_ADDR].header == func_header
+            # actions can also be waited on later
+            assert client.get_state(user="user0", no_cache=True, block=False).result(timeout=30) == state
 
             # git is still running at least on windows
             client.shutdown()
 
     def test_commit_messages(self):
         with tempfile.TemporaryDirectory() as tmpdir:
-            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True, coalesce_commits=False)
             state = client.master_state
 
             # create changes, and verify the state recorded a message
@@ -74,11 +85,35 @@ class TestClient(unittest.TestCase):
 
             # now check those changes really made it into the git repo
             client.commit_master_state()
-            commits = list(client.repo.iter_commits())
+            commits = list(client.repo.iter_commits(client.user_branch_name))
             assert commits[0].message == f"Merged in {fh_1} from user1"
             assert commits[1].message == f"Updated {sv_0}"
             assert commits[2].message == f"Updated {fh_0}"
 
+    def test_coalesced_commits(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            client.commit_master_state()
+            commit_count = len(list(client.repo.iter_commits(client.user_branch_name)))
+
+            fh_0 = FunctionHeader("user0_func", self.FAKE_ADDR)
+            sv_0 = StackVariable(-0x10, "u0_var", "int", 4, self.FAKE_ADDR)
+            for artifact, setter in ((fh_0, State.set_function_header), (sv_0, State.set_stack_variable)):
+                state = client.master_state
+                setter(state, artifact)
+                client.master_state = state
+
+            # every queued change lands in one commit
+            client.commit_master_state()
+            commits = list(client.repo.iter_commits(client.user_branch_name))
+            assert len(commits) == commit_count + 1
+            assert commits[0].message == f"Combined 2 changes\n\n- Updated {fh_0}\n- Updated {sv_0}"
+
+            state = client.get_state(user="user0", no_cache=True)
+            assert state.get_function_header(self.FAKE_ADDR) == fh_0
+            assert state.get_stack_variable(self.FAKE_ADDR, -0x10) == sv_0
+            client.shutdown()
+
     def test_multi_user_branch_loading(self):
         with tempfile.TemporaryDirectory() as tmpdir:
 
@@ -110,6 +145,449 @@ class TestClient(unittest.TestCase):
             assert user0_state.functions[self.FAKE_ADDR].header == user0_func_header
             assert client.master_state.functions[self.FAKE_ADDR].header == user1_func_header
 
+    def test_batched_tree_loading(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.master_state
+            state.set_function_header(FunctionHeader("some_name", self.FAKE_ADDR))
+            client.master_state = state
+            client.commit_master_state()
+
+            tree = client._get_tree("user0", client.repo)
+            files = client.load_files_from_tree(tree)
+            # empty files share a blob, but each must still be loaded
+            assert set(files) == {
+                ".gitignore", "binary_hash", "metadata.toml", "comments.toml", "patches.toml", "global_vars.toml", "enums.toml",
+                "functions/00400080.toml"
+            }
+            for path, data in files.items():
+                assert data == tree[path].data_stream.read().decode()
+
+            assert client.load_files_from_tree(tree, ["metadata.toml", "missing.toml"]).keys() == {"metadata.toml"}
+            assert [user.name for user in client.users(no_cache=True)] == ["user0"]
+            client.shutdown()
+
+    def test_parallel_state_loading(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            user_names = [f"user{i}" for i in range(4)]
+            for i, user_name in enumerate(user_names):
+                client = Client(user_name, tmpdir, "fake_hash", init_repo=(i == 0))
+                state = client.master_state
+                state.set_function_header(FunctionHeader(f"{user_name}_func", self.FAKE_ADDR + i))
+                client.master_state = state
+                client.commit_master_state()
+                client.shutdown()
+
+            client = Client("user0", tmpdir, "fake_hash", state_parse_workers=3)
+            parse_threads = set()
+            parse_state = client._parse_state
+
+            def _recording_parse_state(*args, **kwargs):
+                parse_threads.add(threading.current_thread().name)
+                return parse_state(*args, **kwargs)
+
+            client._parse_state = _recording_parse_state
+            states = client.all_states()
+            assert [state.user for state in states] == user_names
+            for i, state in enumerate(states):
+                assert state.functions[self.FAKE_ADDR + i].name == f"user{i}_func"
+
+            # only the other users were parsed, all off of the Git scheduler thread
+            assert parse_threads and all(name.startswith("StateParser") for name in parse_threads)
+
+            # the parsed states are cached, so loading them again parses nothing
+            parse_threads.clear()
+            assert [state.user for state in client.all_states()] == user_names
+            assert not parse_threads
+            client.shutdown()
+
+    def test_state_snapshot_loading(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True, write_snapshots=True)
+            state = client.master_state
+            state.set_function_header(FunctionHeader("some_name", self.FAKE_ADDR))
+            state.set_stack_variable(StackVariable(0x10, "v1", "int", 4, self.FAKE_ADDR))
+            state.set_comment(Comment(self.FAKE_ADDR + 4, "a comment"))
+            state.set_struct(Struct("some_struct", 8, {}))
+            client.master_state = state
+            client.commit_master_state()
+
+            tree = client._get_tree("user0", client.repo)
+            assert SNAPSHOT_FILENAME in client.list_files_in_tree(tree)
+            snapshot_state = State._parse_snapshot(tree, client.list_blobs_in_tree(tree), client)
+            assert snapshot_state is not None
+            assert snapshot_state == State.parse(tree, client=client)
+            assert snapshot_state.get_stack_variable(self.FAKE_ADDR, 0x10).name == "v1"
+
+            # a partial commit must refresh the snapshot
+            state = client.master_state
+            state.set_comment(Comment(self.FAKE_ADDR + 8, "another comment"))
+            client.master_state = state
+            client.commit_master_state()
+            tree = client._get_tree("user0", client.repo)
+            snapshot_state = State._parse_snapshot(tree, client.list_blobs_in_tree(tree), client)
+            assert snapshot_state is not None
+            assert snapshot_state.get_comment(self.FAKE_ADDR + 8) == Comment(self.FAKE_ADDR + 8, "another comment")
+            assert snapshot_state == State.parse(tree, client=client)
+
+            # a commit without a snapshot makes the old one stale, so the TOML files are used
+            client.write_snapshots = False
+            state = client.master_state
+            state.set_comment(Comment(self.FAKE_ADDR + 12, "a third comment"))
+            client.master_state = state
+            client.commit_master_state()
+            tree = client._get_tree("user0", client.repo)
+            assert State._parse_snapshot(tree, client.list_blobs_in_tree(tree), client) is None
+            assert State.parse(tree, client=client).get_comment(self.FAKE_ADDR + 12) == Comment(self.FAKE_ADDR + 12, "a third comment")
+            client.shutdown()
+
+    def test_process_pool_parsing(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.master_state
+            for i in range(PROCESS_PARSE_MIN_FILES):
+                addr = self.FAKE_ADDR + i * 0x10
+                state.set_function_header(FunctionHeader(f"func_{i}", addr))
+                state.set_stack_variable(StackVariable(-0x10, f"v_{i}", "int", 4, addr))
+            state.set_comment(Comment(self.FAKE_ADDR + 4, "a comment"))
+            state.set_struct(Struct("some_struct", 8, {}))
+            client.master_state = state
+            client.commit_master_state()
+            client.shutdown()
+
+            client = Client("user1", tmpdir, "fake_hash", parse_processes=2)
+            tree = client._get_tree("user0", client.repo)
+            process_state = client.get_state(user="user0")
+            assert client._parse_process_pool is not None
+            assert process_state == State.parse(tree, client=client)
+            assert process_state.get_stack_variable(self.FAKE_ADDR + 0x10, -0x10).name == "v_1"
+            assert process_state.get_comment(self.FAKE_ADDR + 4) == Comment(self.FAKE_ADDR + 4, "a comment")
+            client.shutdown()
+
+    def test_disk_state_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = client.master_state
+            state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+            state.set_stack_variable(StackVariable(-0x10, "v1", "int", 4, self.FAKE_ADDR))
+            client.master_state = state
+            client.commit_master_state()
+            client.shutdown()
+
+            client = Client("user1", tmpdir, "fake_hash")
+            state = client.master_state
+            state.set_function_header(FunctionHeader("user1_func", self.FAKE_ADDR))
+            client.master_state = state
+            client.commit_master_state()
+            user0_state = client.get_state(user="user0")
+            tree = client._get_tree("user0", client.repo)
+            # fully parsed states are cached when parsed, so shutdown has nothing left to write for them
+            with mock.patch("binsync.core.client.DISK_CACHE_SHUTDOWN_BUDGET", 0):
+                client.shutdown()
+            cache_dir = pathlib.Path(client.repo_root) / ".git" / "binsync-cache"
+            assert (cache_dir / f"{tree.hexsha}.snapshot").exists()
+
+            # a new session loads the state from disk, without parsing the tree
+            client = Client("user1", tmpdir, "fake_hash")
+            parse = State.parse
+            State.parse = None
+            try:
+                cached_state = client.get_state(user="user0")
+            finally:
+                State.parse = parse
+            assert cached_state == user0_state
+            assert cached_state.get_stack_variable(self.FAKE_ADDR, -0x10).name == "v1"
+            client.shutdown()
+
+            # entries used least recently are evicted first
+            user0_entry = cache_dir / f"{tree.hexsha}.snapshot"
+            other_entries = [path for path in cache_dir.glob("*.snapshot") if path != user0_entry]
+            assert len(other_entries) == 1
+            os.utime(other_entries[0], (0, 0))
+            StateDiskCache(cache_dir, user0_entry.stat().st_size).evict()
+            assert user0_entry.exists() and not other_entries[0].exists()
+
+    def test_git_action_timeouts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            client.commit_master_state()
+            # hold the Git scheduler, like a slow push would
+            release = threading.Event()
+            client.scheduler.schedule_job(Job(release.wait, 10))
+            try:
+                # callers that ask for a timeout get an error
+                with self.assertRaises(TimeoutError):
+                    client.users(no_cache=True, timeout=0.05)
+
+                # while the long-lived callers, like the updater, get an empty result and skip the round
+                with mock.patch("binsync.core.client.DEFAULT_GIT_ACTION_TIMEOUT", 0.05):
+                    assert client.users(no_cache=True) == {}
+                    assert client.all_states() == {}
+            finally:
+                release.set()
+
+            assert [user.name for user in client.users(no_cache=True)] == ["user0"]
+
+            # callers waiting behind other work are let go once the scheduler stops
+            release.clear()
+            client.scheduler.schedule_job(Job(release.wait, 10))
+            results = []
+            waiter = threading.Thread(target=lambda: results.append(client.users(no_cache=True)))
+            waiter.start()
+            while client.scheduler.empty():
+                time.sleep(0.01)
+            client.scheduler.stop_worker_thread()
+            waiter.join(timeout=5)
+            release.set()
+            assert not waiter.is_alive() and results == [{}]
+
+            # callers waiting behind other work are let go once the scheduler stops
+            release.clear()
+            client.scheduler.schedule_job(Job(release.wait, 10))
+            results = []
+            waiter = threading.Thread(target=lambda: results.append(client.users(no_cache=True)))
+            waiter.start()
+            while client.scheduler.empty():
+                time.sleep(0.01)
+            client.scheduler.stop_worker_thread()
+            waiter.join(timeout=5)
+            release.set()
+            assert not waiter.is_alive() and results == [{}]
+            client.shutdown()
+
+    def test_fetch_only_pull(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+            client0 = Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote)
+            queued_commits = []
+            client0.commit_queued_callback = lambda: queued_commits.append(True)
+            state = client0.master_state
+            state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+            client0.master_state = state
+            assert queued_commits
+            client0.commit_and_update_states()
+            assert set(client0.last_update_timings) == {"commit", "pull", "push", "dispatch"}
+
+            client1 = Client("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote)
+            assert client1.get_state(user="user0").get_function_header(self.FAKE_ADDR).name == "user0_func"
+
+            state = client0.master_state
+            state.set_function_header(FunctionHeader("user0_func_renamed", self.FAKE_ADDR))
+            client0.master_state = state
+            client0.commit_and_update_states()
+
+            # the local branch is fast-forwarded without moving HEAD or touching the working tree
+            head = client1.repo.head.commit
+            client1._pull()
+            assert client1.repo.head.is_detached and client1.repo.head.commit == head
+            assert client1.repo.heads["binsync/user0"].commit.hexsha == client0.repo.heads["binsync/user0"].commit.hexsha
+            assert not client1.repo.is_dirty(untracked_files=True)
+            assert client1.get_state(user="user0").get_function_header(self.FAKE_ADDR).name == "user0_func_renamed"
+
+            client0.shutdown()
+            client1.shutdown()
+
+    def test_existing_user_clone(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+            client0 = Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote)
+            state = client0.master_state
+            state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+            client0.master_state = state
+            client0.commit_and_update_states()
+            client0.shutdown()
+
+            # the same user on a fresh clone continues their branch, so new commits can be pushed
+            client0 = Client("user0", os.path.join(tmpdir, "user0_clone"), "fake_hash", remote_url=remote)
+            assert client0.master_state.get_function_header(self.FAKE_ADDR).name == "user0_func"
+            state = client0.master_state
+            state.set_function_header(FunctionHeader("user0_func_renamed", self.FAKE_ADDR))
+            client0.master_state = state
+            client0.commit_and_update_states()
+            assert not client0._has_unpushed_commits()
+            client0.shutdown()
+
+    def test_diverged_user_branch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+            machine0 = Client("user0", os.path.join(tmpdir, "machine0"), "fake_hash", init_repo=True, remote_url=remote)
+            machine0.commit_and_update_states()
+            # the same user on a second machine
+            machine1 = Client("user0", os.path.join(tmpdir, "machine1"), "fake_hash", remote_url=remote)
+            machine1.commit_and_update_states()
+
+            state = machine0.master_state
+            state.set_function_header(FunctionHeader("machine0_func", self.FAKE_ADDR))
+            machine0.master_state = state
+            machine0.commit_and_update_states()
+
+            # both machines committed, so the branch of machine1 diverged and is merged before the push
+            state = machine1.master_state
+            state.set_comment(Comment(self.FAKE_ADDR, "machine1 comment"))
+            machine1.master_state = state
+            machine1.commit_and_update_states()
+            assert not machine1._has_unpushed_commits()
+            merged_state = machine1.get_state(user="user0", no_cache=True)
+            assert merged_state.get_function_header(self.FAKE_ADDR).name == "machine0_func"
+            assert merged_state.get_comment(self.FAKE_ADDR).comment.strip() == "machine1 comment"
+            assert machine1.master_state.get_function_header(self.FAKE_ADDR).name == "machine0_func"
+
+            # when both machines change the same files, the local changes are kept
+            machine0.commit_and_update_states()
+            state = machine0.master_state
+            state.set_function_header(FunctionHeader("machine0_func_renamed", self.FAKE_ADDR))
+            machine0.master_state = state
+            machine0.commit_and_update_states()
+            state = machine1.master_state
+            state.set_function_header(FunctionHeader("machine1_func", self.FAKE_ADDR))
+            machine1.master_state = state
+            machine1.commit_and_update_states()
+            assert not machine1._has_unpushed_commits()
+            assert machine1.get_state(user="user0", no_cache=True).get_function_header(self.FAKE_ADDR).name == \
+                "machine1_func"
+
+            # a Git that can not merge without a working tree leaves the branch diverged, keeping both sides
+            machine0.commit_and_update_states()
+            state = machine0.master_state
+            state.set_comment(Comment(self.FAKE_ADDR, "machine0 comment"))
+            machine0.master_state = state
+            machine0.commit_and_update_states()
+            remote_sha = machine0.repo.heads["binsync/user0"].commit.hexsha
+            state = machine1.master_state
+            state.set_function_header(FunctionHeader("machine1_func_renamed", self.FAKE_ADDR))
+            machine1.master_state = state
+            with mock.patch.object(git.Git, "merge_tree", create=True, return_value=(129, "", "usage")):
+                machine1.commit_and_update_states()
+            assert machine1._has_unpushed_commits()
+            assert not machine1.active_remote
+            local_commit = machine1.repo.heads["binsync/user0"].commit
+            assert len(local_commit.parents) == 1
+            assert not machine1.repo.is_ancestor(remote_sha, local_commit.hexsha)
+            assert git.Repo(remote).commit("binsync/user0").hexsha == remote_sha
+
+            machine0.shutdown()
+            machine1.shutdown()
+
+    def test_adaptive_pull(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+            client0 = Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote)
+            client0.commit_and_update_states()
+            client1 = Client("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote)
+            client1.commit_and_update_states()
+            assert not client1._has_unpushed_commits()
+
+            # pulls that find nothing new back off the pull interval, up to MAX_PULL_BACKOFF times
+            assert client1.next_pull_delay(10) == 20
+            delays = []
+            for _ in range(3):
+                client1._pull()
+                delays.append(client1.next_pull_delay(10))
+            assert delays == [40, 80, 80]
+
+            state = client0.master_state
+            state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+            client0.master_state = state
+            client0.commit_master_state()
+            assert client0._has_unpushed_commits()
+            client0._push()
+            assert not client0._has_unpushed_commits()
+
+            # a remote branch that moved is fetched, which resets the backoff
+            client1._pull()
+            assert client1.next_pull_delay(10) == 10
+            assert client1.get_state(user="user0").get_function_header(self.FAKE_ADDR).name == "user0_func"
+
+            # an unreachable remote backs off too
+            client1.repo.git.remote("set-url", "origin", os.path.join(tmpdir, "missing.git"))
+            client1._pull()
+            assert not client1.active_remote and client1.next_pull_delay(10) == 20
+
+            client0.shutdown()
+            client1.shutdown()
+
+    def test_state_change_events(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+            client0 = Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote)
+            client0.commit_and_update_states()
+            client1 = Client("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote)
+            client1.commit_and_update_states()
+
+            events0, events1 = [], []
+            client0.subscribe(events0.append)
+            client1.subscribe(events1.append)
+
+            state = client0.master_state
+            state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+            client0.master_state = state
+            client0.commit_and_update_states()
+
+            # a commit reports the artifacts it changed, and the pull reports the new user1 branch
+            assert [event.user for event in events0] == ["user0", "user1"]
+            assert events0[0].new_commit == client0.repo.heads["binsync/user0"].commit.hexsha
+            assert events0[0].changes == {ArtifactType.FUNCTION: {self.FAKE_ADDR}}
+            assert events0[1].old_commit is None and events0[1].changes is None
+
+            # a pull reports the users that moved, with the artifacts that changed in their trees
+            client1.commit_and_update_states()
+            user0_events = [event for event in events1 if event.user == "user0"]
+            assert len(user0_events) == 1
+            assert user0_events[0].old_commit == events0[0].old_commit
+            assert user0_events[0].new_commit == events0[0].new_commit
+            assert user0_events[0].changes == {ArtifactType.FUNCTION: {self.FAKE_ADDR}}
+
+            # nothing moved, so nothing is reported
+            events1.clear()
+            client1.commit_and_update_states()
+            assert not [event for event in events1 if event.user == "user0"]
+
+            client0.shutdown()
+            client1.shutdown()
+
+    def test_async_client(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+
+            async def _sync_clients():
+                client0 = await AsyncClient.open(
+                    "user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote
+                )
+                await client0.commit_and_update_states()
+                client1 = await AsyncClient.open("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote)
+                await client1.commit_and_update_states()
+
+                changes = client1.changes(users=["user0"])
+                next_change = asyncio.ensure_future(changes.__anext__())
+                # let the iteration start, which subscribes it
+                await asyncio.sleep(0)
+
+                state = await client0.get_state()
+                state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+                client0.client.master_state = state
+                await client0.commit_and_update_states()
+                await client1.pull()
+                client1.client.dispatch_state_changes()
+
+                event = await asyncio.wait_for(next_change, timeout=5)
+                assert event.changes == {ArtifactType.FUNCTION: {self.FAKE_ADDR}}
+                user0_state = await client1.get_state(user="user0")
+                assert user0_state.get_function_header(self.FAKE_ADDR).name == "user0_func"
+                assert {state.user for state in await client1.all_states()} == {"user0", "user1"}
+
+                await changes.aclose()
+                assert not client1.client._state_change_callbacks
+                await client0.close()
+                await client1.close()
+
+            asyncio.run(_sync_clients())
+
     def test_corrupted_toml_load(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             client = Client("user0", tmpdir, "fake_hash", init_repo=True)
@@ -121,12 +599,15 @@ class TestClient(unittest.TestCase):
             client.commit_master_state()
             client.shutdown()
 
+            # commits never touch the working tree, so checkout the user branch before corrupting its files
+            repo = git.Repo(tmpdir)
+            repo.git.checkout("binsync/user0")
+
             # do some emulated file corruption making this TOML no longer valid
             with open(pathlib.Path(tmpdir) / "functions" / "00400080.toml", "r+") as file:
                 file.truncate(5)
 
             # force a real git commit for later loading in the client
-            repo = git.Repo(tmpdir)
             repo.git.add(all=True)
             repo.index.commit("corrupt")
             
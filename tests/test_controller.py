@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import git
+from libbs.artifacts import Comment, Function, FunctionHeader, StackVariable, Struct, StructMember
+
+from binsync.controller import BSController
+from binsync.core.client import Client
+from binsync.interface_overrides.memory import MemoryBSInterface
+
+
+class TestController(unittest.TestCase):
+    FAKE_ADDR = 0x400080
+
+    def _make_project(self, tmpdir):
+        remote = os.path.join(tmpdir, "remote.git")
+        git.Repo.init(remote, bare=True)
+        client = Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote)
+        state = client.master_state
+        state.set_function(Function(self.FAKE_ADDR, 0x20))
+        state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR, "my_struct *"))
+        state.set_stack_variable(StackVariable(-0x8, "user0_var", "int", 4, self.FAKE_ADDR))
+        state.set_comment(Comment(self.FAKE_ADDR + 0x4, "user0 comment", func_addr=self.FAKE_ADDR))
+        state.set_struct(Struct("my_struct", 8, {0: StructMember("field", 0, "long", 8)}))
+        client.master_state = state
+        client.commit_and_update_states()
+        client.shutdown()
+        return remote
+
+    def _make_controller(self, tmpdir, remote, **kwargs):
+        deci = MemoryBSInterface(binary_hash="fake_hash", **kwargs)
+        controller = BSController(decompiler_interface=deci, headless=True)
+        controller.connect("user1", os.path.join(tmpdir, "user1"), remote_url=remote, single_thread=True)
+        return controller
+
+    def test_fill_all(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = self._make_project(tmpdir)
+            controller = self._make_controller(tmpdir, remote)
+            deci = controller.deci
+            controller.fill_all(user="user0")
+
+            func = deci.functions[self.FAKE_ADDR]
+            assert func.name == "user0_func"
+            assert func.stack_vars[-0x8].name == "user0_var"
+            # libbs line wraps comments, which ends them in a newline
+            assert deci.comments[self.FAKE_ADDR + 0x4].comment.strip() == "user0 comment"
+            assert "my_struct" in deci.structs
+            assert deci.call_counts["set_function_header"] > 0
+
+            # filled artifacts become part of the master state
+            master_state = controller.client.master_state
+            assert master_state.get_function_header(self.FAKE_ADDR).name == "user0_func"
+            controller.shutdown()
+            controller.client.shutdown()
+
+    def test_force_push_functions(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = self._make_project(tmpdir)
+            controller = self._make_controller(tmpdir, remote, latency=0.001)
+            deci = controller.deci
+            deci.functions[self.FAKE_ADDR] = Function(
+                self.FAKE_ADDR, 0x20, header=FunctionHeader("user1_func", self.FAKE_ADDR)
+            )
+            controller.force_push_functions([self.FAKE_ADDR])
+
+            assert controller.client.master_state.get_function_header(self.FAKE_ADDR).name == "user1_func"
+            assert deci.call_counts["get_function"] > 0
+            controller.shutdown()
+            controller.client.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+import git
+from libbs.artifacts import FunctionHeader
+
+from binsync.core.client import Client
+from binsync.daemon import SyncDaemon
+
+
+class TestDaemon(unittest.TestCase):
+    FAKE_ADDR = 0x400080
+
+    def test_multi_repo_sync(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+            client = Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote)
+            state = client.master_state
+            state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+            client.master_state = state
+            client.commit_and_update_states()
+            client.shutdown()
+
+            config_path = os.path.join(tmpdir, "daemon.toml")
+            with open(config_path, "w") as f:
+                f.write(f"""
+git_threads = 1
+pull_interval = 60
+cache_dir = "{os.path.join(tmpdir, 'cache')}"
+
+[[repos]]
+path = "{os.path.join(tmpdir, 'user0')}"
+user = "user0"
+binary_hash = "fake_hash"
+
+[[repos]]
+path = "{os.path.join(tmpdir, 'mirror')}"
+user = "mirror"
+remote_url = "{remote}"
+push = false
+
+[[repos]]
+path = "{os.path.join(tmpdir, 'missing')}"
+user = "missing"
+""")
+            daemon = SyncDaemon.from_config(config_path)
+            repo0, mirror, missing = daemon.repos
+            assert mirror.push is False and daemon.git_threads == 1
+
+            async def _run_daemon():
+                stop_event = asyncio.Event()
+                run_task = asyncio.ensure_future(daemon.run(stop_event))
+                while repo0.last_sync_time is None or mirror.last_sync_time is None:
+                    assert not run_task.done()
+                    await asyncio.sleep(0.05)
+
+                # the repos share the Git thread, parse threads, and disk cache of the daemon
+                assert repo0.client.client.scheduler is mirror.client.client.scheduler
+                assert repo0.client.client.disk_cache is mirror.client.client.disk_cache is not None
+                mirror_state = await mirror.client.get_state(user="user0")
+                assert mirror_state.get_function_header(self.FAKE_ADDR).name == "user0_func"
+
+                stop_event.set()
+                await asyncio.wait_for(run_task, timeout=10)
+
+            asyncio.run(_run_daemon())
+            # the repo that failed to open is skipped, and every repo lock is released on exit
+            assert missing.client is None and missing.last_sync_time is None
+            assert not os.path.exists(os.path.join(tmpdir, "user0", ".git", "binsync.lock"))
+            assert not os.path.exists(os.path.join(tmpdir, "mirror", ".git", "binsync.lock"))
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from libbs.artifacts import FunctionHeader
+
+from binsync.core.client import Client
+from binsync.core.metrics import MetricsRegistry, registry
+from binsync.core.scheduler import Job, Scheduler, SchedSpeed
+
+
+class TestMetrics(unittest.TestCase):
+    def test_registry(self):
+        metrics = MetricsRegistry()
+        counter = metrics.counter("hits", "Cache hits", labels=("function",))
+        counter.inc(function="get_state")
+        counter.inc(2, function="get_state")
+        # the same metric is returned for the same name
+        assert metrics.counter("hits", labels=("function",)) is counter
+        assert counter.value(function="get_state") == 3
+        assert counter.value(function="users") == 0
+        with self.assertRaises(ValueError):
+            counter.inc(user="user0")
+        with self.assertRaises(ValueError):
+            metrics.gauge("hits")
+
+        gauge = metrics.gauge("depth")
+        gauge.inc(3)
+        gauge.dec()
+        assert gauge.value() == 2
+
+        hist = metrics.histogram("seconds", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5.0):
+            hist.observe(value)
+        value = hist.value()
+        assert value["count"] == 4
+        assert value["sum"] == 5.65
+        assert value["buckets"] == {"0.1": 2, "1.0": 1, "+Inf": 1}
+
+        prom = metrics.to_prometheus()
+        assert "# HELP hits Cache hits" in prom
+        assert 'hits{function="get_state"} 3' in prom
+        assert "depth 2" in prom
+        # prometheus buckets are cumulative
+        assert 'seconds_bucket{le="1.0"} 3' in prom
+        assert 'seconds_bucket{le="+Inf"} 4' in prom
+        assert "seconds_count 4" in prom
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_path = os.path.join(tmpdir, "metrics.json")
+            metrics.dump(json_path)
+            with open(json_path) as fp:
+                data = json.load(fp)
+            assert data["hits"]["type"] == "counter"
+            assert data["hits"]["samples"] == [{"labels": {"function": "get_state"}, "value": 3}]
+
+            prom_path = os.path.join(tmpdir, "metrics.prom")
+            metrics.dump(prom_path)
+            with open(prom_path) as fp:
+                assert fp.read() == prom
+
+        metrics.reset()
+        assert counter.value(function="get_state") == 0
+        assert metrics.collect()["seconds"]["samples"] == []
+
+    def test_scheduler_metrics(self):
+        scheduler = Scheduler(name="metrics_test")
+        depth = registry.get("binsync_scheduler_queue_depth")
+        run_time = registry.get("binsync_job_run_seconds")
+        base_runs = run_time.value(scheduler="metrics_test", function="append")["count"]
+
+        calls = []
+        for i in range(3):
+            scheduler.schedule_job(Job(calls.append, i), priority=SchedSpeed.SLOW)
+        scheduler.schedule_job(Job(calls.append, 3), priority=SchedSpeed.FAST)
+        assert depth.value(scheduler="metrics_test", priority="SLOW") == 3
+        assert depth.value(scheduler="metrics_test", priority="FAST") == 1
+
+        while not scheduler.empty():
+            scheduler._complete_a_job(block=False)
+
+        assert calls == [3, 0, 1, 2]
+        assert depth.value(scheduler="metrics_test", priority="SLOW") == 0
+        assert depth.value(scheduler="metrics_test", priority="FAST") == 0
+        assert run_time.value(scheduler="metrics_test", function="append")["count"] == base_runs + 4
+        wait_time = registry.get("binsync_job_queue_wait_seconds")
+        assert wait_time.value(scheduler="metrics_test", function="append")["count"] >= 4
+
+    def test_client_metrics(self):
+        cache_lookups = registry.get("binsync_git_action_cache_total")
+        commit_batch = registry.get("binsync_commit_batch_size")
+        parse_time = registry.get("binsync_state_parse_seconds")
+        dump_time = registry.get("binsync_state_dump_seconds")
+        base_misses = cache_lookups.value(function="get_state", result="miss")
+        base_hits = cache_lookups.value(function="get_state", result="hit")
+        base_commits = commit_batch.value()["count"]
+        base_parses = parse_time.value()["count"]
+        base_dumps = dump_time.value()["count"]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            for i in range(3):
+                state = client.master_state
+                state.set_function_header(FunctionHeader(f"func_{i}", 0x400000 + i))
+                client.master_state = state
+            client.commit_master_state()
+
+            # bypassing the cache parses the committed state
+            client.get_state(user="user0", no_cache=True)
+            # the state of another user is only cached after the first lookup
+            client.get_state(user="user1")
+            client.get_state(user="user1")
+            client.shutdown()
+
+        assert commit_batch.value()["count"] > base_commits
+        assert dump_time.value()["count"] > base_dumps
+        assert parse_time.value()["count"] > base_parses
+        assert cache_lookups.value(function="get_state", result="miss") > base_misses
+        assert cache_lookups.value(function="get_state", result="hit") > base_hits
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
@@ -0,0 +1,124 @@
+import sys
+import time
+import unittest
+
+from binsync.core.scheduler import Job, Scheduler, SchedSpeed
+
+
+class TestScheduler(unittest.TestCase):
+    def _run_queued_jobs(self, scheduler: Scheduler):
+        # jobs are completed on this thread, so the order they run in is deterministic
+        while not scheduler.empty():
+            scheduler._complete_a_job(block=False)
+
+    def test_priority_fifo_order(self):
+        scheduler = Scheduler()
+        order = []
+        for i in range(5):
+            scheduler.schedule_job(Job(order.append, f"slow{i}"), priority=SchedSpeed.SLOW)
+            scheduler.schedule_job(Job(order.append, f"fast{i}"), priority=SchedSpeed.FAST)
+
+        self._run_queued_jobs(scheduler)
+        assert order == [f"fast{i}" for i in range(5)] + [f"slow{i}" for i in range(5)]
+
+        # completing a job from an empty queue without blocking returns right away
+        scheduler._complete_a_job(block=False)
+
+    def test_coalesced_jobs(self):
+        scheduler = Scheduler()
+        calls = []
+
+        def _get_state(user=None):
+            calls.append(user)
+            return f"{user}_state"
+
+        jobs = [Job(_get_state, user="user1") for _ in range(3)]
+        for job in jobs:
+            scheduler.schedule_job(job, priority=SchedSpeed.SLOW, coalesce=True)
+        other_job = Job(_get_state, user="user2")
+        scheduler.schedule_job(other_job, priority=SchedSpeed.SLOW, coalesce=True)
+        # a more urgent identical job moves the pending job ahead
+        fast_job = Job(_get_state, user="user2")
+        scheduler.schedule_job(fast_job, priority=SchedSpeed.FAST, coalesce=True)
+
+        self._run_queued_jobs(scheduler)
+        assert calls == ["user2", "user1"]
+        assert all(job.finish_event.is_set() and job.ret_value == "user1_state" for job in jobs)
+        assert other_job.ret_value == fast_job.ret_value == "user2_state"
+
+    def test_starvation_protection(self):
+        scheduler = Scheduler(starvation_timeout=0.05)
+        order = []
+        scheduler.schedule_job(Job(order.append, "slow"), priority=SchedSpeed.SLOW)
+        scheduler.schedule_job(Job(order.append, "deadline"), priority=SchedSpeed.AVERAGE, deadline=0)
+        time.sleep(0.1)
+        for i in range(3):
+            scheduler.schedule_job(Job(order.append, f"fast{i}"), priority=SchedSpeed.FAST)
+
+        self._run_queued_jobs(scheduler)
+        assert order == ["deadline", "slow", "fast0", "fast1", "fast2"]
+
+    def test_job_futures(self):
+        scheduler = Scheduler()
+        calls = []
+        done_values = []
+
+        future = scheduler.schedule_job(Job(calls.append, "run"))
+        future.add_done_callback(lambda f: done_values.append(f.result()))
+        cancelled_job = Job(calls.append, "cancelled")
+        cancelled_future = scheduler.schedule_job(cancelled_job)
+        assert cancelled_job.cancel() and cancelled_future.cancelled()
+
+        # cancelling one of two coalesced jobs still runs the other
+        coalesced_jobs = [Job(calls.append, "coalesced") for _ in range(2)]
+        coalesced_futures = [scheduler.schedule_job(job, coalesce=True) for job in coalesced_jobs]
+        coalesced_jobs[0].cancel()
+
+        self._run_queued_jobs(scheduler)
+        assert calls == ["run", "coalesced"]
+        assert done_values == [None]
+        assert coalesced_futures[0].cancelled() and coalesced_futures[1].done()
+
+    def test_wait_timeout(self):
+        scheduler = Scheduler()
+        calls = []
+        job = Job(calls.append, "abandoned")
+        # no worker is running, so the job can never start in time
+        self.assertRaises(TimeoutError, scheduler.schedule_and_wait_job, job, timeout=0.01)
+        assert job.future.cancelled() and scheduler.empty()
+
+        self._run_queued_jobs(scheduler)
+        scheduler._complete_a_job(block=False)
+        assert not calls
+
+    def test_worker_thread(self):
+        scheduler = Scheduler()
+        scheduler.start_worker_thread()
+        assert scheduler.schedule_and_wait_job(Job(sum, [1, 2, 3]), timeout=5) == 6
+        self.assertRaises(ZeroDivisionError, scheduler.schedule_and_wait_job, Job(lambda: 1 / 0), timeout=5)
+
+        # a stopped worker exits, even with nothing left to run
+        scheduler.stop_worker_thread()
+        scheduler._worker.join(timeout=5)
+        assert not scheduler._worker.is_alive()
+
+    def test_stop_cancels_pending_jobs(self):
+        scheduler = Scheduler()
+        calls = []
+        futures = [
+            scheduler.schedule_job(Job(calls.append, "slow"), priority=SchedSpeed.SLOW),
+            scheduler.schedule_job(Job(sum, (1, 2)), coalesce=True),
+            scheduler.schedule_job(Job(sum, (1, 2)), coalesce=True),
+        ]
+        scheduler.stop_worker_thread()
+        # nothing waiting on a job that will never run hangs
+        assert all(future.cancelled() for future in futures)
+        assert scheduler.empty()
+        assert scheduler.schedule_job(Job(calls.append, "late")).cancelled()
+
+        self._run_queued_jobs(scheduler)
+        assert not calls
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)
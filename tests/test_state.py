@@ -1,12 +1,13 @@
 import tempfile
 import os
+import pathlib
 import sys
 
 import unittest
 
 from binsync.core.client import Client
 from libbs.artifacts import (
-    FunctionHeader, Struct,
+    FunctionHeader, Struct, StackVariable, Comment, Function,
 )
 from binsync.core.state import State, ArtifactType
 
@@ -51,6 +52,106 @@ class TestState(unittest.TestCase):
             self.assertEqual(len(new_state.functions), 1)
             self.assertEqual(new_state.functions[0x400080].header, func_header)
 
+    def test_state_incremental_loading(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = State("user0", client=client)
+            state.set_function_header(FunctionHeader("func_0", 0x400080))
+            state.set_function_header(FunctionHeader("func_1", 0x400090))
+            client._commit_state(state)
+
+            prev_tree = client._get_tree(state.user, client.repo)
+            prev_state = State.parse(prev_tree, client=client)
+
+            # change one function, add a struct, and leave the other function alone
+            state.set_function_header(FunctionHeader("func_0_renamed", 0x400080))
+            state.set_struct(Struct("some_struct", 8, {}))
+            client._commit_state(state)
+
+            new_tree = client._get_tree(state.user, client.repo)
+            new_state, changes = State.parse_incremental(new_tree, prev_state, prev_tree, client=client)
+
+            self.assertEqual(new_state, State.parse(new_tree, client=client))
+            self.assertEqual(new_state.functions[0x400080].name, "func_0_renamed")
+            self.assertEqual(changes, {ArtifactType.FUNCTION: {0x400080}, ArtifactType.STRUCT: {"some_struct"}})
+
+    def test_state_dirty_dumping(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = Client("user0", tmpdir, "fake_hash", init_repo=True)
+            state = State("user0", client=client)
+            state.set_function_header(FunctionHeader("func_0", 0x400080))
+            state.set_function_header(FunctionHeader("func_1", 0x400090))
+            client._commit_state(state)
+            self.assertEqual(state.dirty_artifacts, set())
+
+            # a parsed state only dumps the artifacts changed after parsing
+            state = State.parse(client._get_tree(state.user, client.repo), client=client)
+            state.set_function_header(FunctionHeader("func_0_renamed", 0x400080))
+            state.set_struct(Struct("some_struct", 8, {}))
+            self.assertEqual(
+                state.dirty_artifacts,
+                {(ArtifactType.FUNCTION, 0x400080), (ArtifactType.STRUCT, "some_struct")}
+            )
+
+            with tempfile.TemporaryDirectory() as dumpdir:
+                state.dump(dumpdir, only_dirty=True)
+                dumped_files = sorted(
+                    str(path.relative_to(dumpdir)) for path in pathlib.Path(dumpdir).rglob("*") if path.is_file()
+                )
+            self.assertEqual(dumped_files, ["functions/00400080.toml", "metadata.toml", "structs/some_struct.toml"])
+
+            # renaming a struct removes the file of the old name on commit
+            state.set_struct(Struct("renamed_struct", 8, {}), old_name="some_struct")
+            client._commit_state(state)
+            new_state = State.parse(client._get_tree(state.user, client.repo), client=client)
+            self.assertEqual(set(new_state.structs), {"renamed_struct"})
+            self.assertEqual(new_state.functions[0x400090].name, "func_1")
+
+    def test_state_copy_on_write(self):
+        state = State("user0")
+        state.set_function_header(FunctionHeader("func_0", 0x400080))
+        state.set_stack_variable(StackVariable(0x10, "var_0", "int", 4, 0x400080))
+        state.set_comment(Comment(0x400084, "a comment"))
+
+        # copies share every artifact until one of the states changes
+        copied = state.copy()
+        self.assertIs(copied.functions, state.functions)
+        self.assertIs(copied.functions[0x400080], state.functions[0x400080])
+
+        copied.set_function_header(FunctionHeader("func_0_renamed", 0x400080))
+        copied.set_stack_variable(StackVariable(0x10, "var_0_renamed", "int", 4, 0x400080))
+        copied.set_comment(Comment(0x400088, "another comment"))
+        self.assertEqual(copied.functions[0x400080].name, "func_0_renamed")
+        self.assertEqual(copied.get_stack_variable(0x400080, 0x10).name, "var_0_renamed")
+        self.assertEqual(state.functions[0x400080].name, "func_0")
+        self.assertEqual(state.get_stack_variable(0x400080, 0x10).name, "var_0")
+        self.assertNotIn(0x400088, state.comments)
+        # untouched artifact dicts are still shared
+        self.assertIs(copied.structs, state.structs)
+
+        # the original is copied on write as well
+        state.set_function_header(FunctionHeader("func_0_original", 0x400080))
+        self.assertEqual(copied.functions[0x400080].name, "func_0_renamed")
+
+    def test_state_address_lookups(self):
+        state = State("user0")
+        for addr, size in ((0x1000, 0x100), (0x1100, 0x80), (0x2000, 0)):
+            state.set_function(Function(addr, size))
+        for addr in (0x0ff0, 0x1000, 0x1050, 0x1100, 0x1180, 0x2010):
+            state.set_comment(Comment(addr, f"cmt {addr:#x}"))
+
+        self.assertEqual(state.find_func_for_addr(0x1000).addr, 0x1000)
+        self.assertEqual(state.find_func_for_addr(0x10ff).addr, 0x1000)
+        self.assertEqual(state.find_func_for_addr(0x1100).addr, 0x1100)
+        self.assertIsNone(state.find_func_for_addr(0x0fff))
+        self.assertIsNone(state.find_func_for_addr(0x1180))
+        # functions of unknown size contain nothing, and are skipped when looking up earlier functions
+        self.assertIsNone(state.find_func_for_addr(0x2010))
+
+        self.assertEqual(list(state.get_func_comments(0x1000)), [0x1000, 0x1050, 0x1100])
+        self.assertEqual(list(state.get_func_comments(0x1100)), [0x1100, 0x1180])
+        self.assertEqual(state.get_func_comments(0x3000), {})
+
     def test_state_last_push(self):
         state = State("user0")
 
@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import git
+from libbs.artifacts import FunctionHeader
+
+from binsync.core.client import Client
+from binsync.core.tracing import Tracer, _dump_at_exit, merge_chrome_traces, tracer
+
+
+class TestTracing(unittest.TestCase):
+    FAKE_ADDR = 0x400080
+
+    def setUp(self):
+        tracer.clear()
+        tracer.enable()
+
+    def tearDown(self):
+        tracer.disable()
+        tracer.clear()
+
+    def test_pending_spans(self):
+        local_tracer = Tracer()
+        with local_tracer.span("off") as span:
+            assert span is None
+        assert not local_tracer.spans()
+
+        local_tracer.enable()
+        with local_tracer.span("edit", process="user0", pending="user0"):
+            pass
+        with local_tracer.span("commit", process="user0"):
+            with local_tracer.span("write", process="user0"):
+                local_tracer.add_commits("abc")
+            local_tracer.resolve_pending("user0", "abc")
+
+        spans = {span.name: span for span in local_tracer.spans()}
+        # nested spans all get the commit, and pending spans get it once resolved
+        assert all(span.commits == ["abc"] for span in spans.values())
+        trace = local_tracer.to_chrome_trace()
+        flows = [event for event in trace["traceEvents"] if event.get("cat") == "commit"]
+        assert [flow["ph"] for flow in flows] == ["s", "t", "f"]
+
+        # pending spans are only resolved once
+        local_tracer.resolve_pending("user0", "def")
+        assert spans["edit"].commits == ["abc"]
+
+    def test_dump_at_exit(self):
+        with tracer.span("edit"):
+            pass
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            trace_path = os.path.join(tmpdir, "trace.json")
+            _dump_at_exit(trace_path)
+            assert os.path.exists(trace_path)
+            # a path that can not be written is only logged
+            with self.assertLogs("binsync.core.tracing", level="WARNING"):
+                _dump_at_exit(os.path.join(tmpdir, "missing", "trace.json"))
+
+    def test_edit_propagation(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            remote = os.path.join(tmpdir, "remote.git")
+            git.Repo.init(remote, bare=True)
+            client0 = Client("user0", os.path.join(tmpdir, "user0"), "fake_hash", init_repo=True, remote_url=remote)
+            client0.commit_and_update_states()
+            client1 = Client("user1", os.path.join(tmpdir, "user1"), "fake_hash", remote_url=remote)
+            client1.commit_and_update_states()
+            events = []
+            client1.subscribe(events.append)
+            tracer.clear()
+
+            state = client0.master_state
+            state.set_function_header(FunctionHeader("user0_func", self.FAKE_ADDR))
+            client0.master_state = state
+            client0.commit_and_update_states()
+            client1.commit_and_update_states()
+            client0.shutdown()
+            client1.shutdown()
+
+        commit = next(event for event in events if event.user == "user0").new_commit
+        stages = {(span.process, span.name) for span in tracer.spans() if commit in span.commits}
+        assert {
+            ("user0", "Cache.set_state"),
+            ("user0", "Client._commit_state"),
+            ("user0", "Client._push"),
+            ("user1", "Client._pull"),
+            ("user1", "Client._update_cache"),
+        } <= stages
+        assert next(event for event in events if event.user == "user0").commits == [commit]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            trace_path = os.path.join(tmpdir, "trace.json")
+            tracer.dump(trace_path)
+            with open(trace_path) as fp:
+                trace = json.load(fp)
+
+        process_names = {
+            event["args"]["name"] for event in trace["traceEvents"]
+            if event["ph"] == "M" and event["name"] == "process_name"
+        }
+        assert {"user0", "user1"} <= process_names
+        flows = [event for event in trace["traceEvents"] if event.get("cat") == "commit" and event["id"] == commit]
+        assert len(flows) == len(stages)
+
+        # merging a trace with itself keeps one set of metadata and flows per commit
+        merged = merge_chrome_traces([trace, trace])
+        merged_flows = [event for event in merged["traceEvents"] if event.get("cat") == "commit"]
+        assert sum(1 for event in merged["traceEvents"] if event["ph"] == "M") == \
+            sum(1 for event in trace["traceEvents"] if event["ph"] == "M")
+        assert merged_flows[0]["ph"] == "s" and merged_flows[-1]["ph"] == "f"
+
+
+if __name__ == "__main__":
+    unittest.main(argv=sys.argv)